@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""What the benchmarks need to run the ff-* modules outside of willie: a
+fake bot, a local HTTP server for the payloads and a module loader."""
+
+import gzip
+import importlib.util
+import os
+import sys
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+here = os.path.dirname(os.path.abspath(__file__))
+modules_dir = os.path.join(here, '..', 'modules')
+sys.path.insert(0, modules_dir)
+
+import willie.bot  # noqa: F401, willie.module can only be imported after willie.bot
+
+
+class Section(object):
+    """Stands in for willie's config section: unknown keys are None."""
+
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+    def __getattr__(self, name):
+        return None
+
+    def get_list(self, name):
+        value = getattr(self, name)
+        return [item.strip() for item in value.split(',')] if value else []
+
+
+class FakeBot(object):
+    def __init__(self, **freifunk):
+        self.config = type('Config', (object,), {})()
+        self.config.freifunk = Section(**freifunk)
+        self.memory = {}
+        self.sent = []
+
+    def msg(self, target, text):
+        self.sent.append((target, text))
+
+    def say(self, text):
+        self.sent.append((None, text))
+
+
+class PayloadServer(object):
+    """Serves `bodies[path]` as JSON on a local port, in a thread of its own.
+
+    With `compress` bodies are gzipped for clients accepting it, with
+    `etags` they get an ETag and If-None-Match is answered with 304, with
+    `keep_alive` connections stay open for the next request. Every answer
+    waits `delay` seconds first. `connections` and `requests` count what
+    came in.
+    """
+
+    def __init__(self, compress=False, etags=False, keep_alive=False):
+        self.bodies = {}
+        self.delay = 0
+        self.connections = 0
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' if keep_alive else 'HTTP/1.0'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                server.connections += 1
+
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.delay)
+
+                body = server.bodies.get(self.path)
+
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                etag = '"{:08x}"'.format(zlib.crc32(body))
+                if etags and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                if etags:
+                    self.send_header('ETag', etag)
+                if compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:{:d}{:s}'.format(self.httpd.server_address[1], path)
+
+
+def load_module(name):
+    """Loads modules/`name`.py as a fresh module, the way willie does."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(modules_dir, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Counts the SQL statements one fetch() of ff-nodeinfo sends to SQLite.
+
+Serves synthetic nodes.json files from a local HTTP server, runs the module's
+fetch() against a fake bot and a scratch database and counts statements with
+fflib.db.StatementCounter. The count has to be the same for every map size.
+The time spent in SQLite comes from fflib.storage's query timer, the
+announcements are counted as they are queued in fflib.outbox.
+
+    python benchmarks/fetch_statements.py [--sizes 100 1000 10000]
+
+Needs the bot's own dependencies (willie, SQLAlchemy, requests).
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from fakebot import FakeBot, PayloadServer, load_module
+from fflib import db, outbox, storage
+
+from nodes_memory import make_node
+
+
+def run(size, server, tmpdir):
+    rnd = random.Random(size)
+    nodes = dict(make_node(i, rnd) for i in range(size))
+    server.bodies['/nodes.json'] = json.dumps({'nodes': nodes}).encode('utf-8')
+
+    bot = FakeBot(db_path=os.path.join(tmpdir, 'bench-{:d}.db'.format(size)), nodes_uri=server.url('/nodes.json'),
+                  channel='#ffxx', change_announce_target='#ffxx-changes',
+                  change_no_announce='clientcount', meshviewer_uri='http://example.org/m/{id:s}')
+
+    module = load_module('ff-nodeinfo')
+    module.setup(bot)
+
+    queued = outbox.get().queued
+
+    # some churn so the poll has inserts and updates to write. Nodes only go
+    # offline, a new highscore would add an UPDATE of its own.
+    for node_id in rnd.sample(sorted(nodes), size // 20):
+        nodes[node_id]['flags']['online'] = False
+    for i in range(size, size + size // 100 + 1):
+        node_id, data = make_node(i, rnd)
+        nodes[node_id] = data
+    server.bodies['/nodes.json'] = json.dumps({'nodes': nodes}).encode('utf-8')
+
+    store = storage.get(bot.config.freifunk.db_path)
+    sql_time = sum(stats[1] for stats in store.timer.stats.values())
+
+    with db.StatementCounter(store.engine) as counter:
+        module.fetch(bot)
+
+    sql_time = sum(stats[1] for stats in store.timer.stats.values()) - sql_time
+
+    return counter.count, sql_time, outbox.get().queued - queued
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    server = PayloadServer()
+    tmpdir = tempfile.mkdtemp(prefix='ffbench-')
+
+    try:
+        print('{:>8} {:>12} {:>8} {:>10}'.format('nodes', 'statements', 'sql ms', 'messages'))
+        counts = set()
+        for size in args.sizes:
+            statements, sql_time, messages = run(size, server, tmpdir)
+            counts.add(statements)
+            print('{:>8d} {:>12d} {:>8.1f} {:>10d}'.format(size, statements, sql_time * 1000, messages))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if len(counts) != 1:
+        sys.exit('statement count depends on the number of nodes')
+
+
+if __name__ == '__main__':
+    main()
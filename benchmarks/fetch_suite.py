@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Runs fetch() of ff-nodeinfo over synthetic networks.
+
+For every set of sources and network size a payloads.Mesh is served from a
+local HTTP server. The module's setup() does the first poll against a scratch
+database, then --polls more polls follow, each after one Mesh.step(). Every
+poll is reported with its wall time, SQL statements, time spent in SQLite,
+peak memory and the announcement lines it handed to fflib.outbox. The results are written
+as JSON so two revisions can be compared.
+
+    python benchmarks/fetch_suite.py [--sources meshviewer alfred both] [--sizes 100 1000 10000]
+        [--polls 5] [--churn 0.05] [--moves 0.01] [--new 0.001]
+        [--sites ffka=0.9,ffxx=0.1] [--uptime] [--drop-nodes] [--trace-memory] [--output fetch_suite.json]
+
+With --drop-nodes the runs with both sources end with two more polls:
+nodes.json is gone for longer than its freshness (stale), then it is
+served again (back). Every node's source flips in both, which must not be
+announced node by node.
+
+Peak memory is the process' max RSS, which only ever grows. With
+--trace-memory it is the peak of Python's allocations within each poll
+instead, which slows the polls down.
+
+Needs the bot's own dependencies (willie, SQLAlchemy, requests).
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from fakebot import FakeBot, PayloadServer, load_module
+from fflib import db, outbox, storage
+from payloads import Mesh, parse_sites
+
+PAYLOADS = {
+    'nodes_uri': ('/nodes.json', Mesh.nodes_json),
+    'alfred_uri': ('/alfred.json', Mesh.alfred_json),
+}
+
+# the config keys of the payloads ff-nodeinfo polls
+SOURCES = {
+    'meshviewer': ('nodes_uri',),
+    'alfred': ('alfred_uri',),
+    'both': ('nodes_uri', 'alfred_uri'),
+}
+
+# nodes_freshness in seconds with --drop-nodes
+DROP_FRESHNESS = 5
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(
+            os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(poll, store, trace_memory):
+    """Runs `poll()` and returns what it cost."""
+    queued = outbox.get().queued
+    sql_time = sum(stats[1] for stats in store.timer.stats.values())
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+
+    start = time.time()
+    with db.StatementCounter(store.engine) as counter:
+        poll()
+    wall_time = time.time() - start
+
+    if trace_memory:
+        peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+    else:
+        # KiB on Linux
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        'wall_ms': round(wall_time * 1000, 1),
+        'statements': counter.count,
+        'sql_ms': round((sum(stats[1] for stats in store.timer.stats.values()) - sql_time) * 1000, 1),
+        'peak_kb': peak_kb,
+        'announcements': outbox.get().queued - queued,
+    }
+
+
+def run(name, size, args, server, tmpdir):
+    sites = parse_sites(args.sites)
+    mesh = Mesh(size, sites=sites, seed=size, uptime=args.uptime)
+
+    def serve():
+        for key in SOURCES[name]:
+            path, render = PAYLOADS[key]
+            server.bodies[path] = render(mesh)
+        return sum(len(server.bodies[PAYLOADS[key][0]]) for key in SOURCES[name])
+
+    uris = dict((key, server.url(PAYLOADS[key][0])) for key in SOURCES[name])
+    drop = args.drop_nodes and len(uris) > 1
+    if drop:
+        uris['nodes_freshness'] = str(DROP_FRESHNESS)
+    bot = FakeBot(db_path=os.path.join(tmpdir, '{}-{:d}.db'.format(name, size)),
+                  site_codes=next(iter(sites)),
+                  channel='#ffxx', change_announce_target='#ffxx-changes', change_no_announce='clientcount',
+                  meshviewer_uri='http://example.org/m/{id:s}', map_uri='http://example.org/map', **uris)
+
+    module = load_module('ff-nodeinfo')
+    store = storage.get(bot.config.freifunk.db_path)
+
+    size_bytes = serve()
+    polls = [measure(lambda: module.setup(bot), store, args.trace_memory)]
+    polls[0]['bytes'] = size_bytes
+
+    for _ in range(args.polls):
+        mesh.step(churn=args.churn, moves=args.moves, new=args.new)
+        size_bytes = serve()
+
+        result = measure(lambda: module.fetch(bot), store, args.trace_memory)
+        result['bytes'] = size_bytes
+        polls.append(result)
+
+    if drop:
+        for label in ('stale', 'back'):
+            if label == 'stale':
+                del server.bodies[PAYLOADS['nodes_uri'][0]]
+                time.sleep(DROP_FRESHNESS + 0.5)
+                size_bytes = len(server.bodies[PAYLOADS['alfred_uri'][0]])
+            else:
+                size_bytes = serve()
+
+            result = measure(lambda: module.fetch(bot), store, args.trace_memory)
+            result['bytes'] = size_bytes
+            result['label'] = label
+            polls.append(result)
+
+    module.fetch_worker.stop(timeout=10)
+
+    return {'sources': name, 'nodes': size, 'polls': polls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sources', nargs='+', choices=sorted(SOURCES), default=['meshviewer', 'alfred', 'both'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--polls', type=int, default=5)
+    parser.add_argument('--churn', type=float, default=0.05, help='share of nodes going on- or offline per poll')
+    parser.add_argument('--moves', type=float, default=0.01, help='share of nodes moving per poll')
+    parser.add_argument('--new', type=float, default=0.001, help='share of nodes added per poll')
+    parser.add_argument('--sites', default='ffka=0.9,ffxx=0.1',
+                        help='site codes and their shares, the first one is the one polled')
+    parser.add_argument('--uptime', action='store_true', help='change the statistics of every node online per poll')
+    parser.add_argument('--drop-nodes', action='store_true',
+                        help='let nodes.json go stale and come back after the polls of both sources')
+    parser.add_argument('--trace-memory', action='store_true')
+    parser.add_argument('--output', default='fetch_suite.json')
+    args = parser.parse_args()
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    server = PayloadServer()
+    tmpdir = tempfile.mkdtemp(prefix='ffbench-')
+    runs = []
+
+    try:
+        print('{:>10} {:>8} {:>5} {:>10} {:>10} {:>8} {:>10} {:>13}'.format(
+            'sources', 'nodes', 'poll', 'wall ms', 'statements', 'sql ms', 'peak KiB', 'announcements'))
+
+        for name in args.sources:
+            for size in args.sizes:
+                result = run(name, size, args, server, tmpdir)
+                runs.append(result)
+
+                for i, poll in enumerate(result['polls']):
+                    print('{:>10} {:>8d} {:>5} {:>10.1f} {:>10d} {:>8.1f} {:>10d} {:>13d}'.format(
+                        name, size, poll.get('label') or ('setup' if i == 0 else str(i)), poll['wall_ms'], poll['statements'],
+                        poll['sql_ms'], poll['peak_kb'], poll['announcements']))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'revision': revision(),
+            'python': platform.python_version(),
+            'args': vars(args),
+            'runs': runs,
+        }, f, indent=2, sort_keys=True)
+
+    print('written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
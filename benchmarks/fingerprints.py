@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""CPU time of one nodes.json poll with and without node fingerprints.
+
+Serves a payloads.Mesh from a local HTTP server and polls it through
+fflib.ingest twice side by side, once with MeshviewerSource's fingerprints
+and once parsing every node in full. Both get the same payloads, --polls of
+them after the first, each after one Mesh.step() with the given churn. The
+CPU time covers parsing, merging and diffing, the median of the polls is
+reported along with the share of nodes skipped.
+
+    python benchmarks/fingerprints.py [--sizes 10000 50000] [--churn 0.02 0.05] [--polls 5]
+
+Every run is done with static statistics and with --uptime semantics, where
+the uptime of all nodes online changes in every poll like on a real map and
+only their nodeinfo can be skipped.
+"""
+
+import argparse
+import time
+
+from fakebot import PayloadServer
+from fflib import diff, httpclient, ingest, nodesjson, sources
+from fflib.storage import Node
+from payloads import Mesh
+
+
+def make_pipeline(url, fingerprints):
+    table = diff.NodeTable(column.name for column in Node.__table__.columns
+                           if column.name not in ('firstseen', 'lastseen'))
+    source = sources.MeshviewerSource(url, httpclient.HttpClient(), nodesjson.SiteFilter(['ffka']),
+                                      fingerprints=fingerprints)
+
+    return table, source, ingest.Ingest(table, [source])
+
+
+def poll(table, pipeline):
+    """Returns the CPU seconds of one poll, applied to `table`."""
+    start = time.process_time()
+
+    changes, errors = pipeline.poll()
+    if errors:
+        raise errors[0]
+    if changes is not None:
+        table.apply(changes)
+
+    return time.process_time() - start
+
+
+def run(size, churn, uptime, polls, server):
+    mesh = Mesh(size, seed=size, uptime=uptime)
+    server.bodies['/nodes.json'] = mesh.nodes_json()
+
+    pipelines = dict((fingerprints, make_pipeline(server.url('/nodes.json'), fingerprints))
+                     for fingerprints in (True, False))
+
+    for table, source, pipeline in pipelines.values():
+        poll(table, pipeline)
+
+    times = dict((fingerprints, []) for fingerprints in pipelines)
+    skipped = []
+
+    for _ in range(polls):
+        mesh.step(churn=churn)
+        server.bodies['/nodes.json'] = mesh.nodes_json()
+
+        for fingerprints, (table, source, pipeline) in pipelines.items():
+            times[fingerprints].append(poll(table, pipeline))
+            if fingerprints:
+                skipped.append(source.skip_ratio)
+
+    assert pipelines[True][0].rows == pipelines[False][0].rows
+
+    return (sorted(times[False])[polls // 2], sorted(times[True])[polls // 2], sum(skipped) / len(skipped))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--churn', type=float, nargs='+', default=[0.02, 0.05],
+                        help='share of nodes going on- or offline per poll')
+    parser.add_argument('--polls', type=int, default=5)
+    args = parser.parse_args()
+
+    server = PayloadServer()
+
+    print('{:>8} {:>6} {:>7} {:>10} {:>10} {:>8} {:>8}'.format(
+        'nodes', 'churn', 'uptime', 'full ms', 'skip ms', 'saved', 'skipped'))
+
+    for size in args.sizes:
+        for churn in args.churn:
+            for uptime in (False, True):
+                full, skip, ratio = run(size, churn, uptime, args.polls, server)
+                print('{:>8d} {:>6.0%} {:>7} {:>10.1f} {:>10.1f} {:>8.0%} {:>8.0%}'.format(
+                    size, churn, 'yes' if uptime else 'no', full * 1000, skip * 1000, 1 - skip / full, ratio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Checks fflib.httpclient.HttpClient against a local HTTP server.
+
+Polls a nodes.json from fakebot.PayloadServer several times and asserts that
+the body arrives gzipped and is decoded, that an unchanged file is answered
+with 304 once the ETag was remembered, that all polls go over one pooled
+connection, and that both the connect and the read timeout fire. Prints the
+timing dict of every poll.
+
+    python benchmarks/http_client.py [--polls 5] [--size 2000]
+
+Needs the bot's own dependencies (willie, requests).
+"""
+
+import argparse
+import json
+import random
+import socket
+import time
+
+import requests
+
+from fakebot import PayloadServer
+from fflib import httpclient
+
+from nodes_memory import make_node
+
+
+def poll(client, url):
+    """Returns the status and body of one GET, remembering the validators
+    of a 200 as fflib.sources does."""
+    response = client.get(url)
+
+    if response.status_code == 304:
+        client.release(response)
+        return 304, None
+
+    body = client.read(response)
+    client.remember(url, response)
+
+    return response.status_code, body
+
+
+def show(label, timing):
+    print('{:<12s} {:6.1f} {:8.1f} {:6.1f} {:9.1f} {:9d} {:10d}'.format(
+        label, timing['dns'] * 1000, timing['connect'] * 1000, timing['ttfb'] * 1000,
+        timing['transfer'] * 1000, timing['bytes'], timing['wire_bytes']))
+
+
+def check_pooling_and_validators(polls, size):
+    rnd = random.Random(0)
+    body = json.dumps({'nodes': dict(make_node(i, rnd) for i in range(size))}).encode('utf-8')
+
+    server = PayloadServer(compress=True, etags=True, keep_alive=True)
+    server.bodies['/nodes.json'] = body
+    url = server.url('/nodes.json')
+
+    client = httpclient.HttpClient()
+
+    print('{:<12s} {:>6s} {:>8s} {:>6s} {:>9s} {:>9s} {:>10s}'.format(
+        'poll', 'dns', 'connect', 'ttfb', 'transfer', 'bytes', 'wire_bytes'))
+
+    status, received = poll(client, url)
+    show('first', client.timings[url])
+    assert status == 200 and received == body, 'the first poll must return the whole body'
+    assert client.timings[url]['wire_bytes'] < len(body), 'the body must be sent gzipped'
+
+    for _ in range(polls):
+        status, received = poll(client, url)
+        show('unchanged', client.timings[url])
+        assert status == 304 and received is None, 'an unchanged file must be answered with 304'
+        assert client.timings[url]['connect'] == 0, 'a pooled connection must not connect again'
+
+    body = body.replace(b'"online": true', b'"online": false', 1)
+    server.bodies['/nodes.json'] = body
+
+    status, received = poll(client, url)
+    show('changed', client.timings[url])
+    assert status == 200 and received == body, 'a changed file must be downloaded again'
+
+    assert server.requests == polls + 2
+    assert server.connections == 1, '{:d} connections for {:d} polls'.format(server.connections, server.requests)
+    print('{:d} polls over {:d} connection'.format(server.requests, server.connections))
+
+
+def check_read_timeout():
+    server = PayloadServer()
+    server.bodies['/nodes.json'] = b'{"nodes": {}}'
+    server.delay = 1
+
+    client = httpclient.HttpClient(read_timeout=0.2)
+
+    start = time.time()
+    try:
+        client.get(server.url('/nodes.json'))
+    except requests.exceptions.ReadTimeout:
+        took = time.time() - start
+    else:
+        raise AssertionError('a server answering after 1 s must hit the read timeout of 0.2 s')
+
+    assert took < 0.9, 'the read timeout fired after {:.2f} s'.format(took)
+    print('read timeout after {:.2f} s'.format(took))
+
+
+def check_connect_timeout():
+    # a socket that never accepts, with its backlog filled, leaves every
+    # further SYN unanswered
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(0)
+
+    waiting = []
+    for _ in range(8):
+        pending = socket.socket()
+        pending.setblocking(False)
+        pending.connect_ex(listener.getsockname())
+        waiting.append(pending)
+
+    client = httpclient.HttpClient(connect_timeout=0.2, read_timeout=5)
+
+    start = time.time()
+    try:
+        client.get('http://{}:{:d}/nodes.json'.format(*listener.getsockname()))
+    except requests.exceptions.ConnectTimeout:
+        took = time.time() - start
+    else:
+        raise AssertionError('a server that doesn\'t accept must hit the connect timeout of 0.2 s')
+    finally:
+        for pending in waiting:
+            pending.close()
+        listener.close()
+
+    assert took < 2, 'the connect timeout fired after {:.2f} s'.format(took)
+    print('connect timeout after {:.2f} s'.format(took))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--polls', type=int, default=5)
+    parser.add_argument('--size', type=int, default=2000)
+    args = parser.parse_args()
+
+    check_pooling_and_validators(args.polls, args.size)
+    check_read_timeout()
+    check_connect_timeout()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Peak RSS of reading nodes.json with json.loads() vs. fflib.nodesjson.
+
+Generates synthetic meshviewer nodes.json files and reads each of them in a
+fresh interpreter, once the old way (whole body as text + json.loads) and
+once with the streaming NodesParser. Every node is touched the way fetch()
+does, then dropped.
+
+    python benchmarks/nodes_memory.py [--sizes 1000 10000 50000]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+from fflib import nodesjson
+
+
+def make_node(i, rnd):
+    mac = ':'.join('{:02x}'.format(b) for b in (0xc4, 0x6e, 0x1f, i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff))
+    node_id = mac.replace(':', '')
+    online = rnd.random() < 0.8
+
+    return node_id, {
+        'firstseen': '2015-01-01T00:00:00',
+        'lastseen': '2015-06-01T12:00:00',
+        'flags': {'online': online, 'gateway': False},
+        'statistics': {
+            'clients': rnd.randint(0, 30) if online else 0,
+            'uptime': rnd.uniform(0, 1e6),
+            'loadavg': rnd.uniform(0, 2),
+            'memory_usage': rnd.random(),
+            'rootfs_usage': rnd.random(),
+            'traffic': {k: {'bytes': rnd.randint(0, 1 << 40), 'packets': rnd.randint(0, 1 << 30)}
+                        for k in ('rx', 'tx', 'forward', 'mgmt_rx', 'mgmt_tx')},
+        },
+        'nodeinfo': {
+            'node_id': node_id,
+            'hostname': 'ffka-node-{:d}'.format(i),
+            'network': {
+                'mac': mac,
+                'addresses': ['fe80::c66e:1fff:fe{:02x}:{:04x}'.format(i >> 16 & 0xff, i & 0xffff),
+                              '2a03:2260:50:5:c66e:1fff:fe{:02x}:{:04x}'.format(i >> 16 & 0xff, i & 0xffff)],
+                'mesh_interfaces': [mac],
+            },
+            'location': {'latitude': 49.0 + rnd.random() / 5, 'longitude': 8.3 + rnd.random() / 5},
+            'owner': {'contact': 'node{:d}@example.org'.format(i)},
+            'software': {
+                'autoupdater': {'enabled': True, 'branch': 'stable'},
+                'firmware': {'base': 'gluon-v2015.1', 'release': '0.6.0'},
+                'batman-adv': {'version': '2014.4.0', 'compat': 15},
+                'fastd': {'enabled': True, 'version': 'v17'},
+            },
+            'hardware': {'model': 'TP-Link TL-WR841N/ND v9', 'nproc': 1},
+            'system': {'site_code': 'ffka'},
+        },
+    }
+
+
+def write_nodes_json(path, count, seed=0):
+    rnd = random.Random(seed)
+
+    with open(path, 'w') as f:
+        f.write('{"timestamp": "2015-06-01T12:00:00", "version": 1, "nodes": {')
+        for i in range(count):
+            node_id, data = make_node(i, rnd)
+            if i:
+                f.write(', ')
+            f.write(json.dumps(node_id))
+            f.write(': ')
+            f.write(json.dumps(data))
+        f.write('}}')
+
+
+def consume(node_id, data):
+    # roughly what fetch() looks at before handing the node on
+    return (node_id, data['flags']['online'], data['nodeinfo']['system']['site_code'])
+
+
+def child(mode, path):
+    count = 0
+
+    if mode == 'loads':
+        with open(path, 'rb') as f:
+            text = f.read().decode('utf-8')
+        for node_id, data in json.loads(text)['nodes'].items():
+            consume(node_id, data)
+            count += 1
+    elif mode == 'stream':
+        def chunks():
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(nodesjson.CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        for node_id, data in nodesjson.NodesParser(chunks()):
+            consume(node_id, data)
+            count += 1
+
+    # ru_maxrss is in KiB on Linux
+    print(json.dumps({'nodes': count, 'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def measure(mode, path):
+    out = subprocess.check_output([sys.executable, __file__, '--child', mode, path])
+    return json.loads(out.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='ffbench-')
+    baseline = measure('none', os.devnull)['maxrss_kb']
+
+    print('interpreter baseline: {:.1f} MiB'.format(baseline / 1024.0))
+    print('{:>8} {:>10} {:>14} {:>14}'.format('nodes', 'file MiB', 'loads MiB', 'stream MiB'))
+
+    for size in args.sizes:
+        path = os.path.join(tmpdir, 'nodes-{:d}.json'.format(size))
+        write_nodes_json(path, size)
+
+        loads = measure('loads', path)
+        stream = measure('stream', path)
+        assert loads['nodes'] == stream['nodes'] == size
+
+        print('{:>8d} {:>10.1f} {:>14.1f} {:>14.1f}'.format(
+            size, os.path.getsize(path) / 1048576.0,
+            (loads['maxrss_kb'] - baseline) / 1024.0, (stream['maxrss_kb'] - baseline) / 1024.0))
+
+        os.unlink(path)
+
+    os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
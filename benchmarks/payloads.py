@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Synthetic meshviewer nodes.json and alfred merged.json payloads.
+
+A Mesh is the state of a made-up network: nodes spread over a few sites,
+with positions, firmware and client counts. step() moves it on to the next
+poll, with a share of the nodes going offline or coming back, changing
+their client count, moving or being added. nodes_json() and alfred_json()
+render the current state the way the map backends serve it.
+
+    mesh = Mesh(10000, sites={'ffka': 0.9, 'ffxx': 0.1})
+    body = mesh.nodes_json()
+    mesh.step(churn=0.05, moves=0.01, new=0.001)
+"""
+
+import json
+import random
+
+HARDWARE = ['TP-Link TL-WR841N/ND v9', 'TP-Link TL-WR841N/ND v10', 'TP-Link TL-WR1043N/ND v2',
+            'TP-Link Archer C7 v2', 'Ubiquiti NanoStation M2', 'x86-64']
+RELEASES = ['0.6.0', '0.6.1', '0.7.0', '0.7.1']
+BRANCHES = ['stable', 'stable', 'stable', 'beta', 'experimental']
+
+# share of the online nodes whose client count changes in every poll
+CLIENT_CHURN = 0.3
+
+
+def parse_sites(text):
+    """Turns 'ffka=0.9,ffxx=0.1' into {'ffka': 0.9, 'ffxx': 0.1}."""
+    sites = {}
+
+    for part in text.split(','):
+        code, _, weight = part.partition('=')
+        sites[code.strip()] = float(weight or 1)
+
+    return sites
+
+
+class Mesh(object):
+    """A synthetic network of `count` nodes, reproducible through `seed`.
+
+    `sites` maps site codes to their share of the nodes, `gateways` is the
+    number of gateways among them. With `uptime` the uptime and lastseen of
+    the nodes online advance with every step, as they do on a real map, so
+    their statistics never look the same twice.
+    """
+
+    def __init__(self, count, sites=None, gateways=4, seed=0, uptime=False):
+        self.rnd = random.Random(seed)
+        self.sites = sorted((sites or {'ffka': 1.0}).items())
+        self.uptime = uptime
+        self.steps = 0
+        self.nodes = []
+
+        for i in range(count):
+            self.nodes.append(self._make_node(i, gateway=i < gateways))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def step(self, churn=0.05, moves=0.01, new=0.001):
+        """Moves on to the next poll: `churn` of the nodes go offline or come
+        back, `moves` of them get a new position and `new` of the count are
+        added."""
+        rnd = self.rnd
+        self.steps += 1
+
+        for node in rnd.sample(self.nodes, int(len(self.nodes) * churn)):
+            if not node['gateway']:
+                node['online'] = not node['online']
+                node['clients'] = rnd.randint(0, 30) if node['online'] else 0
+
+        for node in rnd.sample(self.nodes, int(len(self.nodes) * moves)):
+            node['lat'] += rnd.uniform(-0.001, 0.001)
+            node['lon'] += rnd.uniform(-0.001, 0.001)
+
+        online = [node for node in self.nodes if node['online'] and not node['gateway']]
+        for node in rnd.sample(online, int(len(online) * CLIENT_CHURN)):
+            node['clients'] = max(0, node['clients'] + rnd.randint(-3, 3))
+
+        start = len(self.nodes)
+        for i in range(start, start + int(len(self.nodes) * new)):
+            self.nodes.append(self._make_node(i))
+
+    def nodes_json(self):
+        """Returns the state as meshviewer nodes.json (version 1)."""
+        nodes = dict((node['node_id'], self._meshviewer(node)) for node in self.nodes)
+
+        return json.dumps({'timestamp': '2015-06-01T12:00:00', 'version': 1, 'nodes': nodes}).encode('utf-8')
+
+    def alfred_json(self):
+        """Returns the state as alfred merged.json, which only lists the
+        nodes that are online."""
+        nodes = dict((node['mac'], self._alfred(node)) for node in self.nodes if node['online'])
+
+        return json.dumps(nodes).encode('utf-8')
+
+    def _make_node(self, i, gateway=False):
+        rnd = self.rnd
+        mac = ':'.join('{:02x}'.format(b) for b in (0xc4, 0x6e, 0x1f, i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff))
+        online = gateway or rnd.random() < 0.8
+
+        # every site is a cluster of nodes around a point of its own
+        site = self._pick_site()
+        offset = sum(ord(c) for c in site) % 10 / 10.0
+
+        return {
+            'node_id': mac.replace(':', ''),
+            'mac': mac,
+            'hostname': '{}-{}-{:d}'.format(site, 'gw' if gateway else 'node', i),
+            'site': site,
+            'gateway': gateway,
+            'online': online,
+            'clients': rnd.randint(0, 30) if online and not gateway else 0,
+            'lat': 49.0 + offset + rnd.random() / 5,
+            'lon': 8.3 + offset + rnd.random() / 5,
+            'hardware': rnd.choice(HARDWARE),
+            'release': rnd.choice(RELEASES),
+            'branch': rnd.choice(BRANCHES),
+            'autoupdate': rnd.random() < 0.9,
+        }
+
+    def _pick_site(self):
+        x = self.rnd.random() * sum(weight for _, weight in self.sites)
+
+        for code, weight in self.sites:
+            x -= weight
+            if x < 0:
+                return code
+
+        return self.sites[-1][0]
+
+    @staticmethod
+    def _nodeinfo(node):
+        return {
+            'node_id': node['node_id'],
+            'hostname': node['hostname'],
+            'network': {'mac': node['mac'], 'mesh_interfaces': [node['mac']]},
+            'location': {'latitude': node['lat'], 'longitude': node['lon']},
+            'owner': {'contact': '{}@example.org'.format(node['hostname'])},
+            'software': {
+                'autoupdater': {'enabled': node['autoupdate'], 'branch': node['branch']},
+                'firmware': {'base': 'gluon-v2015.1', 'release': node['release']},
+            },
+            'hardware': {'model': node['hardware']},
+            'system': {'site_code': node['site']},
+        }
+
+    def _meshviewer(self, node):
+        # seconds since the first poll, one poll every 30 s
+        seconds = self.steps * 30 if self.uptime and node['online'] else 0
+
+        return {
+            'firstseen': '2015-01-01T00:00:00',
+            'lastseen': '2015-06-01T12:{:02d}:{:02d}'.format(seconds // 60 % 60, seconds % 60),
+            'flags': {'online': node['online'], 'gateway': node['gateway']},
+            'statistics': {'clients': node['clients'], 'uptime': 1000.0 + seconds, 'loadavg': 0.5},
+            'nodeinfo': self._nodeinfo(node),
+        }
+
+    def _alfred(self, node):
+        data = self._nodeinfo(node)
+        data['clients'] = {'total': node['clients'], 'wifi': node['clients']}
+        return data
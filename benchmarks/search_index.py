@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Lookup latency of fflib.search.NodeIndex.
+
+Indexes synthetic nodes with street/place style hostnames and times
+.nodeinfo-style queries of every kind against it.
+
+    python benchmarks/search_index.py [--nodes 50000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+from fflib import diff, search
+
+PREFIXES = ['ffka-', 'ffka-', 'ff-', 'freifunk-', '']
+WORDS = ['kaiser', 'haupt', 'bahnhof', 'linden', 'garten', 'schloss', 'muehlen', 'berg', 'wald', 'kirch',
+         'rhein', 'markt', 'durlach', 'oststadt', 'weststadt', 'nordstadt', 'suedstadt', 'hagsfeld',
+         'entropia', 'rathaus', 'schul', 'park', 'wiesen', 'sonnen', 'rosen', 'eichen', 'birken']
+SUFFIXES = ['str', 'weg', 'platz', 'allee', 'gasse', 'ring', '', '']
+
+FIELDS = ('node_id', 'mac', 'hostname', 'gateway', 'online')
+
+
+def make_hostname(i, rnd):
+    return '{}{}{}{}-{:d}'.format(rnd.choice(PREFIXES), rnd.choice(WORDS), rnd.choice(WORDS),
+                                  rnd.choice(SUFFIXES), i % 997)
+
+
+def make_queries(hostnames, count, rnd):
+    queries = []
+
+    for _ in range(count):
+        node_id, hostname = rnd.choice(hostnames)
+        kind = rnd.choice(['exact', 'prefix', 'substring', 'typo', 'mac'])
+
+        if kind == 'exact':
+            query = hostname.upper()
+        elif kind == 'prefix':
+            query = hostname[:rnd.randint(1, 6)]
+        elif kind == 'substring':
+            start = rnd.randint(0, len(hostname) - 4)
+            query = hostname[start:start + rnd.randint(4, 8)]
+        elif kind == 'typo':
+            i = rnd.randrange(len(hostname))
+            query = hostname[:i] + hostname[i + 1:]
+        else:
+            query = ':'.join(node_id[i:i + 2] for i in range(0, 12, 2))
+
+        queries.append((kind, query))
+
+    return queries
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+
+    table = diff.NodeTable(FIELDS)
+    hostnames = []
+    rows = []
+    for i in range(args.nodes):
+        node_id = 'c46e1f{:06x}'.format(i)
+        hostname = make_hostname(i, rnd)
+        hostnames.append((node_id, hostname))
+        rows.append({'node_id': node_id, 'mac': None, 'hostname': hostname, 'gateway': False,
+                     'online': rnd.random() < 0.8})
+    table.load(rows)
+
+    start = time.time()
+    index = search.NodeIndex(table.fields)
+    index.load(table)
+    print('indexed {:d} nodes in {:.0f} ms'.format(len(index), (time.time() - start) * 1000))
+
+    timings = {}
+    for kind, query in make_queries(hostnames, args.queries, rnd):
+        start = time.time()
+        index.search(query, table.online)
+        timings.setdefault(kind, []).append((time.time() - start) * 1000)
+
+    print('{:>10s} {:>8s} {:>8s} {:>8s}'.format('query', 'mean ms', 'p50 ms', 'p99 ms'))
+    for kind in ('exact', 'prefix', 'substring', 'typo', 'mac'):
+        values = timings.get(kind, [])
+        if values:
+            print('{:>10s} {:8.3f} {:8.3f} {:8.3f}'.format(
+                kind, sum(values) / len(values), percentile(values, 0.5), percentile(values, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Query latency of fflib.spatial.GridIndex.
+
+Indexes synthetic nodes spread over a few towns and times .near-style
+queries of several radii against it, next to a scan of every node with
+geo.calc_distance as it would be done without the index.
+
+    python benchmarks/spatial_index.py [--nodes 50000] [--queries 500]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+from fflib import diff, geo, spatial
+
+FIELDS = ('node_id', 'lat', 'lon', 'online', 'gateway')
+
+# (lat, lon, spread in degrees) of the towns the nodes are in
+TOWNS = [(49.01, 8.40, 0.08), (48.89, 8.70, 0.04), (49.49, 8.47, 0.06), (49.40, 8.69, 0.05), (48.47, 7.94, 0.04)]
+
+RADII = (500, 1000, 5000, 20000)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+
+    table = diff.NodeTable(FIELDS)
+    rows = []
+    for i in range(args.nodes):
+        lat, lon, spread = rnd.choice(TOWNS)
+        rows.append({'node_id': 'c46e1f{:06x}'.format(i), 'lat': rnd.gauss(lat, spread),
+                     'lon': rnd.gauss(lon, spread * 1.5), 'online': rnd.random() < 0.8,
+                     'gateway': i % 1000 == 0})
+    table.load(rows)
+
+    start = time.time()
+    index = spatial.GridIndex(table.fields)
+    index.load(table)
+    print('indexed {:d} nodes in {:.0f} ms, NumPy {}'.format(
+        len(index), (time.time() - start) * 1000, 'on' if geo.numpy is not None else 'off'))
+
+    centers = [(row['lat'], row['lon']) for row in rnd.sample(rows, args.queries)]
+
+    print('{:>8s} {:>8s} {:>8s} {:>8s} {:>8s}'.format('radius', 'found', 'mean ms', 'p99 ms', 'scan ms'))
+    for radius in RADII:
+        timings = []
+        found = 0
+
+        for lat, lon in centers:
+            start = time.time()
+            count, _ = index.near(lat, lon, radius, only=table.online)
+            timings.append((time.time() - start) * 1000)
+            found += count
+
+        # the scan is the same for every radius, a few queries are enough
+        start = time.time()
+        for lat, lon in centers[:10]:
+            [node_id for node_id in table.online
+             if geo.calc_distance(lat, lon, *(index.position(node_id) or (0, 0))) <= radius]
+        scan = (time.time() - start) * 100
+
+        print('{:>8d} {:>8d} {:8.3f} {:8.3f} {:8.1f}'.format(
+            radius, found // len(centers), sum(timings) / len(timings), percentile(timings, 0.99), scan))
+
+
+if __name__ == '__main__':
+    main()
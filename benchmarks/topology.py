@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Update cost of fflib.topology.Topology.
+
+Builds a synthetic mesh of about --links links, a grid of nodes with a few
+gateways and some longer links across, and times update() with --churn
+links coming and going per poll. A block of nodes is then cut off and
+reconnected to check the cloud events, and the components and the clouds
+cut off are compared with a full recount at the end. --trials small meshes
+get random links added and removed, with the same comparison after every
+poll.
+
+    python benchmarks/topology.py [--links 50000] [--churn 10 100 1000] [--polls 20] [--trials 200]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+from fflib import diff, topology
+
+FIELDS = ('node_id', 'online', 'gateway')
+
+# side length of the block cut off
+BLOCK = 10
+
+
+def make_mesh(links, rnd):
+    """Returns the node_ids of a square grid, its side, the function naming
+    the node at x, y and `links` links between the nodes as (node_id,
+    node_id) keys."""
+    side = int(math.sqrt(links / 2.2))
+
+    def node_id(x, y):
+        return 'c46e{:04x}{:04x}'.format(x, y)
+
+    result = set()
+
+    for x in range(side):
+        for y in range(side):
+            if x + 1 < side:
+                result.add((node_id(x, y), node_id(x + 1, y)))
+            if y + 1 < side:
+                result.add((node_id(x, y), node_id(x, y + 1)))
+
+    while len(result) < links:
+        a = node_id(rnd.randrange(side), rnd.randrange(side))
+        b = node_id(rnd.randrange(side), rnd.randrange(side))
+        if a != b:
+            result.add((a, b) if a < b else (b, a))
+
+    return [node_id(x, y) for x in range(side) for y in range(side)], side, node_id, result
+
+
+def components(links):
+    """Returns the components of `links` counted from scratch, as a set of
+    frozensets."""
+    adjacency = {}
+    for a, b in links:
+        adjacency.setdefault(a, set()).add(b)
+        adjacency.setdefault(b, set()).add(a)
+
+    seen = set()
+    result = set()
+
+    for start in adjacency:
+        if start in seen:
+            continue
+
+        component = {start}
+        stack = [start]
+        while stack:
+            for other in adjacency[stack.pop()]:
+                if other not in component:
+                    component.add(other)
+                    stack.append(other)
+
+        seen |= component
+        result.add(frozenset(component))
+
+    return result
+
+
+def check(mesh, links, quiet=False):
+    actual = set(frozenset(members) for members in mesh.members.values())
+    expected = components(links)
+    assert actual == expected, 'components differ from a full recount'
+
+    clouds = set(frozenset(mesh.members[label]) for label in mesh._clouds)
+    assert clouds == set(component for component in expected if len(component) >= mesh.minimum and
+                         not component & mesh.gateways), 'clouds differ from a full recount'
+
+    if not quiet:
+        print('{:d} components, {:d} cut off, same as a full recount'.format(len(actual), len(clouds)))
+
+
+def trials(count, rnd, nodes=40, gateways=3, minimum=3):
+    """Churns the links of `count` small random meshes, checking the
+    components and clouds after every poll."""
+    events = 0
+
+    for _ in range(count):
+        node_ids = ['n{:02d}'.format(i) for i in range(nodes)]
+        table = diff.NodeTable(FIELDS)
+        table.load({'node_id': node, 'online': True, 'gateway': i < gateways} for i, node in enumerate(node_ids))
+
+        mesh = topology.Topology(table.fields, minimum=minimum)
+        mesh.load(table)
+
+        links = set()
+        for _ in range(30):
+            changed = set()
+            for _ in range(rnd.randrange(1, 8)):
+                a, b = sorted(rnd.sample(node_ids, 2))
+                changed.add((a, b))
+                links ^= {(a, b)}
+
+            events += len(mesh.update(changed, links, time.time()))
+            check(mesh, links, quiet=True)
+
+    print('{:d} random meshes, {:d} cloud events, clouds always the same as a full recount'.format(count, events))
+
+
+def poll(mesh, links, changed):
+    start = time.time()
+    events = mesh.update(changed, links, time.time())
+    return (time.time() - start) * 1000, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--links', type=int, default=50000)
+    parser.add_argument('--churn', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--trials', type=int, default=200)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    nodes, side, node_id, links = make_mesh(args.links, rnd)
+
+    table = diff.NodeTable(FIELDS)
+    gateways = set(node_id(x, y) for x in (side // 4, side * 3 // 4) for y in (side // 4, side * 3 // 4))
+    table.load({'node_id': node, 'online': True, 'gateway': node in gateways} for node in nodes)
+
+    mesh = topology.Topology(table.fields)
+    mesh.load(table)
+
+    took, _ = poll(mesh, links, links)
+    print('{:d} nodes, {:d} links loaded in {:.0f} ms'.format(len(mesh.component), mesh.links, took))
+
+    print('{:>8s} {:>8s} {:>8s}'.format('churn', 'mean ms', 'max ms'))
+    spare = set()
+
+    for churn in args.churn:
+        timings = []
+
+        for _ in range(args.polls):
+            gone = set(rnd.sample(sorted(links), churn // 2))
+            back = set(rnd.sample(sorted(spare), min(len(spare), churn - len(gone))))
+            links = (links - gone) | back
+            spare = (spare - back) | gone
+
+            took, _ = poll(mesh, links, gone | back)
+            timings.append(took)
+
+        print('{:>8d} {:8.2f} {:8.2f}'.format(churn, sum(timings) / len(timings), max(timings)))
+
+    check(mesh, links)
+
+    # put everything back, then cut a block in a corner off the rest
+    took, _ = poll(mesh, links | spare, spare)
+    links |= spare
+
+    block = set(node_id(x, y) for x in range(BLOCK) for y in range(BLOCK))
+    cut = set(link for link in links if (link[0] in block) != (link[1] in block))
+
+    took, events = poll(mesh, links - cut, cut)
+    print('cut off {:d} links in {:.2f} ms: {}'.format(
+        len(cut), took, ', '.join('{} {:d}'.format(type(event).__name__, event.cloud.total) for event in events)))
+
+    took, events = poll(mesh, links, cut)
+    print('reconnected in {:.2f} ms: {}'.format(
+        took, ', '.join('{} {:d}'.format(type(event).__name__, event.cloud.total) for event in events)))
+
+    check(mesh, links)
+
+    trials(args.trials, rnd)
+
+
+if __name__ == '__main__':
+    main()
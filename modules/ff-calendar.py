@@ -3,10 +3,18 @@
 from willie.module import commands, rate, interval, rule, event, example
 
 from datetime import datetime, timedelta, timezone
-from dateutil import parser
-import caldav
+import os
 import pytz
 import re
+import sys
+
+# willie doesn't put modules/ on the path, but we need the shared fflib package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fflib import agenda, outbox, worker
+
+# the events of caldav_cal, refreshed in the background, see fflib.agenda
+calendar_store = None
+refresh_worker = None
 
 class Event():
 	def __init__(self, title, start, end):
@@ -14,13 +22,6 @@ class Event():
 		self.start = start
 		self.end = end
 
-	def fromVEvent(event):
-		title = event._get_instance().vevent.summary.value
-		start = parser.parse(str(event._get_instance().vevent.dtstart.value))
-		end = parser.parse(str(event._get_instance().vevent.dtend.value))
-
-		return Event(title, start, end)
-
 	def formattime(input):
 		if input.tzinfo:
 			input = input.astimezone(pytz.timezone('Europe/Berlin'))
@@ -66,13 +67,43 @@ class Event():
 		return s_start > o_start
 
 def setup(bot):
+	global calendar_store, refresh_worker
+
 	if not bot.memory.contains('topic'):
 		bot.memory['topic'] = {}
 
+	if not bot.config.freifunk.caldav_url:
+		calendar_store = refresh_worker = None
+		return
+
+	calendar_store = agenda.get(bot.config.freifunk.caldav_url, bot.config.freifunk.caldav_cal)
+	refresh_worker = worker.PollWorker('ff-calendar refresh', bot, refresh)
+	refresh_worker.trigger()
+
+def shutdown(bot):
+	if refresh_worker:
+		refresh_worker.stop(timeout=30)
+
+@interval(60*5)
+def poll_calendar(bot):
+	"""Starts refresh() on the worker thread, unless the last one is still running."""
+	if refresh_worker:
+		refresh_worker.trigger()
+
+def refresh(bot):
+	changed = calendar_store.refresh()
+
+	if changed:
+		print('{}: {:d} calendar events changed'.format(str(datetime.now()), changed))
+
 @rate(600)
 @commands('ne', 'nextevent', 'treffen', 't')
 def next_event(bot, trigger):
 	"""Gibt das nächste Treffen aus."""
+	if calendar_store is None:
+		bot.say('Kein Kalender eingerichtet.')
+		return
+
 	bot.say('Nächstes Treffen: {}'.format(get_next_event(bot)))
 
 @commands('settopic')
@@ -102,7 +133,7 @@ def announce(bot):
 
 	for event in events:
 		if now + timedelta(hours=1) < event.start < now + timedelta(hours=2):
-			bot.msg(bot.config.freifunk.channel, 'Nächster Termin (in {:s}): {:s}'.format(Event.formattimedelta(event.start - now), str(event)))
+			outbox.get(bot).put(bot.config.freifunk.channel, 'Nächster Termin (in {:s}): {:s}'.format(Event.formattimedelta(event.start - now), str(event)))
 
 @event('332')
 @rule('.*')
@@ -123,23 +154,12 @@ def get_next_event(bot):
 		return events[0]
 
 def fetch_events(bot):
-	client = caldav.DAVClient(bot.config.freifunk.caldav_url)
-	principal = client.principal()
-	calendars = principal.calendars()
-
-	eventlist = []
-	if len(calendars) > 0:
-		for calendar in calendars:
-			if str(calendar) != bot.config.freifunk.caldav_cal:
-				continue
-
-			results = calendar.date_search(
-				pytz.timezone('Europe/Berlin').localize(datetime.now()).astimezone(pytz.utc), (datetime.now() + timedelta(days=30*3)))
-
-			for event in results:
-				eventlist.append(Event.fromVEvent(event))
+	"""Returns the events of the next 90 days from memory, by start, none
+	without caldav_url."""
+	if calendar_store is None:
+		return []
 
-	return sorted(eventlist)
+	return [Event(*occurrence) for occurrence in calendar_store.upcoming(datetime.now(tz=timezone.utc), days=30*3)]
 
 def topic(bot, channel, topic):
 	bot.msg('chanserv', 'TOPIC {} {}'.format(channel, topic))
@@ -0,0 +1,885 @@
+# -*- coding: utf-8 -*-
+
+from willie import formatting
+from willie.module import commands, rate, interval, example
+
+import datetime
+import os
+import re
+import sys
+import time
+
+# willie doesn't put modules/ on the path, but we need the shared fflib package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fflib import aggregates, bus, db, diff, history, httpclient, ingest, metrics, outage, outbox, rollout, search, \
+    sites, sources, spatial, stats, storage, topology, worker
+from fflib.storage import Highscore, Node
+
+session_maker_instance = None
+# the site code was only filled in for older databases, and the source of
+# every node flips at once when a source goes stale or comes back
+NOT_ANNOUNCED = ('site', 'source')
+# the communities served, each with its own channels, highscores and .status
+served_sites = None
+nodes_table = None
+# nodes.json and alfred.json merged into nodes_table, see fflib.ingest
+pipeline = None
+# links of graph_uri, None unless it is set
+graph_source = None
+# the clouds the links form, to find those cut off from the gateways
+mesh_topology = None
+# online totals per site and the highscores, so reading them needs no SQL
+network_stats = None
+highscores = {}
+# hostname, MAC and node_id lookup for .nodeinfo
+node_index = None
+# positions for .near and the new node announcements
+node_positions = None
+# clientcount and online course of every node for .history
+node_history = None
+# firmware distribution and its snapshots for .firmware
+firmware_rollout = None
+# mass outages, so they aren't announced node by node
+outage_tracker = None
+fetch_worker = None
+# rate limited announcements, see fflib.outbox
+announcements = None
+# stage timings and counters for .ffstats, the sources have their own
+fetch_stats = stats.get('ingest')
+# Prometheus /metrics, None unless metrics_port is set
+exporter = None
+# nodes whose clientcount changed but wasn't written yet, see fetch()
+stale_stats = set()
+stats_flushed = datetime.datetime.now()
+
+config = {}
+
+def describe(values):
+    out = []
+
+    if values.get('hostname'):
+        out.append(formatting.color(values['hostname'], formatting.colors.RED))
+    else:
+        out.append(formatting.color(values['node_id'], formatting.colors.RED))
+
+    if values.get('hardware'):
+        out.append(formatting.color(values['hardware'], formatting.colors.GREEN))
+
+    if values.get('firmware_base') and values.get('firmware_release'):
+        out.append(formatting.color('{0:s}/{1:s}'.format(
+            values['firmware_base'], values['firmware_release']), formatting.colors.PURPLE))
+
+    if values.get('lat') and values.get('lon'):
+        out.append(map_link(values))
+
+    return ', '.join(out)
+
+def map_link(values):
+    """Links the node in the meshviewer, or its position on the map without one."""
+    if config.meshviewer_uri:
+        return config.meshviewer_uri.format(id=values['node_id'])
+
+    return config.map_uri.format(lat=values['lat'], lon=values['lon'])
+
+def site_of(node):
+    """Returns the fflib.sites.Site of a node's column values."""
+    return served_sites.site(node.get('site'))
+
+def setup(bot):
+    global session_maker_instance, served_sites, nodes_table, pipeline, graph_source, mesh_topology, network_stats, \
+        highscores, node_index, node_positions, node_history, firmware_rollout, outage_tracker, fetch_worker, \
+        announcements, exporter, config
+
+    config = bot.config.freifunk
+    served_sites = sites.from_config(bot.config.freifunk)
+    announcements = outbox.get(bot)
+    exporter = metrics.get(bot.config.freifunk.metrics_host, bot.config.freifunk.metrics_port, announcements)
+
+    if 'ff' not in bot.memory:
+        bot.memory['ff'] = {}
+
+    store = storage.get(bot.config.freifunk.db_path)
+    store.create_tables(storage.Base.metadata)
+
+    session_maker_instance = store.sessionmaker
+
+    # state of the last poll, fetch() compares the next one against it
+    nodes_table = diff.NodeTable(column.name for column in Node.__table__.columns
+                                 if column.name not in ('firstseen', 'lastseen'))
+    with store.engine.connect() as connection:
+        nodes_table.load(db.load_rows(connection, Node.__table__))
+
+    pipeline = ingest.Ingest(nodes_table, make_sources(bot, served_sites))
+
+    if bot.config.freifunk.graph_uri:
+        graph_source = topology.GraphSource(bot.config.freifunk.graph_uri, make_client(bot),
+            int(bot.config.freifunk.graph_freshness or bot.config.freifunk.source_freshness or 300))
+
+    mesh_topology = topology.Topology(nodes_table.fields, minimum=int(bot.config.freifunk.cloud_minimum or 5))
+    mesh_topology.load(nodes_table)
+
+    # the only full count, fetch() keeps the totals up to date from then on
+    site_column = nodes_table.fields.index('site')
+    network_stats = aggregates.NetworkAggregates(nodes_table.fields,
+        partition=lambda row: served_sites.site(row[site_column]).name)
+    network_stats.load(nodes_table)
+
+    node_index = search.NodeIndex(nodes_table.fields)
+    node_index.load(nodes_table)
+
+    node_positions = spatial.GridIndex(nodes_table.fields)
+    node_positions.load(nodes_table)
+
+    store.create_tables(history.Base.metadata)
+    node_history = history.NodeHistory(nodes_table.fields, {
+        history.HOURLY: int(bot.config.freifunk.history_retention_days or 365) * 86400})
+
+    store.create_tables(rollout.Base.metadata)
+    firmware_rollout = rollout.RolloutTracker(nodes_table.fields,
+        partition=lambda row: served_sites.site(row[site_column]).name)
+    firmware_rollout.load(nodes_table)
+    with store.engine.connect() as connection:
+        firmware_rollout.load_snapshots(connection, time.time())
+
+    outage_tracker = outage.OutageTracker(nodes_table.fields,
+        share=float(bot.config.freifunk.outage_share or 0.1),
+        minimum=int(bot.config.freifunk.outage_minimum or 10))
+
+    session = session_maker_instance()
+    highscores = dict((score.name, score) for score in session.query(Highscore))
+    session.close()
+
+    fetch(bot, initial=True)
+
+    # later polls run in the background, see poll()
+    fetch_worker = worker.PollWorker('ff-nodeinfo fetch', bot, fetch)
+
+    fetch_stats.gauge('worker', lambda: {'runs': fetch_worker.runs, 'skipped': fetch_worker.skipped,
+                                         'failed': fetch_worker.failed})
+    fetch_stats.gauge('nodes', lambda: {'known': len(nodes_table), 'online': len(nodes_table.online),
+                                        'indexed': len(node_index), 'located': len(node_positions),
+                                        'links': mesh_topology.links})
+
+    bot.memory['initialized'] = True
+
+def make_sources(bot, site_filter):
+    """Returns a source for nodes_uri and alfred_uri, for those that are set.
+    nodes.json is parsed once for all sites, `site_filter` keeps the nodes
+    of any of them."""
+    result = []
+    default = int(bot.config.freifunk.source_freshness or 300)
+
+    if bot.config.freifunk.nodes_uri:
+        result.append(sources.MeshviewerSource(bot.config.freifunk.nodes_uri, make_client(bot), site_filter,
+                                               int(bot.config.freifunk.nodes_freshness or default)))
+
+    if bot.config.freifunk.alfred_uri:
+        result.append(sources.AlfredSource(bot.config.freifunk.alfred_uri, make_client(bot),
+                                           int(bot.config.freifunk.alfred_freshness or default)))
+
+    return result
+
+def make_client(bot):
+    """Returns an HttpClient for one source."""
+    # A source only knows its nodes after a full download, so its ETag
+    # mustn't survive a reload the way the nodes table does.
+    return httpclient.HttpClient(
+        connect_timeout=float(bot.config.freifunk.http_connect_timeout or 3.05),
+        read_timeout=float(bot.config.freifunk.http_read_timeout or 10))
+
+def shutdown(bot):
+    global session_maker_instance
+
+    if fetch_worker:
+        fetch_worker.stop(timeout=60)
+
+    session = session_maker_instance()
+
+    # the history has them offline until the next start as well
+    changes = nodes_table.changeset()
+    for node_id in nodes_table.online:
+        changes.add(node_id, {'online': False, 'clientcount': 0})
+    node_history.record(changes, time.time())
+    node_history.flush(session.connection(), time.time())
+    firmware_rollout.flush(session.connection(), time.time())
+
+    for node in session.query(Node):
+        if node.online:
+            node.lastseen = bot.memory['ff'].get('nodes_last_poll', node.lastseen)
+        node.online = False
+        node.clientcount = 0
+
+    try:
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def pick_site(bot, trigger):
+    """Returns the site named in the command, else the one of the channel it
+    was sent in, else None for all of them. Returns False for an unknown
+    site, after telling so."""
+    if trigger.group(2):
+        name = trigger.group(2).strip()
+        site = served_sites.get(name)
+
+        if site is None:
+            bot.say('Unbekannte Community {}, bekannt sind: {}'.format(
+                name, ', '.join(known.name for known in served_sites)))
+            return False
+
+        return site
+
+    if len(served_sites) == 1:
+        return served_sites.default
+
+    return served_sites.for_channel(trigger.sender)
+
+@rate(10)
+@commands('s', 'status')
+@example('.status ffka')
+def status(bot, trigger):
+    """Zeigt an, was gerade online ist. Mit mehreren Communities die des Kanals oder die angegebene."""
+    site = pick_site(bot, trigger)
+
+    if site is False:
+        return
+
+    if site is None:
+        totals = network_stats.totals()
+        nodes = ', '.join('{}: {:d}'.format(part.name, network_stats.totals(part.name)['nodes'])
+                          for part in served_sites)
+
+        bot.say('Online: {:d} Gateways, {:d} Nodes ({}) und {:d} Clients'
+            .format(totals['gateways'], totals['nodes'], nodes, totals['clients']))
+        return
+
+    totals = network_stats.totals(site.name)
+
+    bot.say('Online{}: {:d} Gateways, {:d} Nodes und {:d} Clients'
+        .format(' in ' + site.name if len(served_sites) > 1 else '',
+                totals['gateways'], totals['nodes'], totals['clients']))
+
+@rate(20)
+@commands('n', 'nodeinfo')
+@example('.nodeinfo entropia')
+def nodeinfo(bot, trigger):
+    """Zeigt Infos über bis zu 2 Knoten an. Der Knotenname muss nicht vollständig angegeben werden,
+    MAC-Adresse oder Node-ID gehen auch."""
+    global session_maker_instance
+
+    if trigger.group(2):
+        count, matches = node_index.search(trigger.group(2), nodes_table.online)
+
+        if not matches:
+            bot.msg(trigger.nick, 'Keine Ergebnisse.')
+            return
+
+        exact = [match for match in matches if match.kind == search.EXACT]
+
+        if exact:
+            matches = exact[:2]
+        elif count > 2:
+            names = ', '.join(match.hostname for match in matches)
+            if matches[0].kind == search.SIMILAR:
+                bot.msg(trigger.nick, 'Keine Ergebnisse. Meintest du: {}?'.format(names))
+            else:
+                bot.msg(trigger.nick, 'Zu viele Ergebnisse ({:d}): {}, …'.format(count, names))
+            return
+
+        session = session_maker_instance()
+
+        for match in matches:
+            node = session.query(Node).filter(Node.node_id == match.node_id).first()
+            if node:
+                printNodeinfo(bot, trigger.nick, node)
+
+        session.close()
+
+def printNodeinfo(bot, recp, node):
+    bot.msg(recp, '{} ist {}'.format(formatting.color(node.name, formatting.colors.WHITE),
+        'online ({} Clients)'.format(node.clientcount) if node.online else 'offline'))
+    bot.msg(recp, 'Hardware:    {}'.format(node.hardware))
+    bot.msg(recp, 'Firmware:    {}/{}'.format(node.firmware_base, node.firmware_release))
+    bot.msg(recp, 'Autoupdater: {}'.format('on (' + str(node.branch) + ')' if node.autoupdate else 'off'))
+    if node.contact:
+        bot.msg(recp, 'Contact:     {}'.format(str(node.contact)))
+    if node.lastseen and not node.online:
+        bot.msg(recp, 'Lastseen:    {}'.format(node.lastseen.strftime('%d.%m.%y %H:%M')))
+    if node.lat and node.lon:
+        bot.msg(recp, 'Map:         {}'.format(map_link(node.__dict__)))
+    bot.msg(recp, 'Grafana:     http://s.ffka.net/g/{}'.format(re.sub(r"[^a-zA-Z0-9_.-]", '', node.mac.replace(':', ''))))
+
+
+@rate(20)
+@commands('history')
+@example('.history entropia 30d')
+def nodehistory(bot, trigger):
+    """Zeigt Clients und Onlinezeit eines Knotens der letzten 7 Tage an, andere Zeiträume z.B. mit 24h oder 90d."""
+    global session_maker_instance
+
+    if not trigger.group(2):
+        return
+
+    args = trigger.group(2).split()
+    period = '7d'
+
+    if len(args) > 1 and re.match(r'^\d+[hd]$', args[-1]):
+        period = args.pop()
+
+    seconds = int(period[:-1]) * (3600 if period[-1] == 'h' else 86400)
+
+    count, matches = node_index.search(' '.join(args), nodes_table.online)
+
+    if not matches:
+        bot.say('Keine Ergebnisse.')
+        return
+
+    if count > 1 and matches[0].kind != search.EXACT:
+        bot.say('Zu viele Ergebnisse ({:d}): {}'.format(count, ', '.join(match.hostname for match in matches)))
+        return
+
+    node_id, name = matches[0].node_id, matches[0].hostname or matches[0].node_id
+
+    end = time.time()
+    session = session_maker_instance()
+    try:
+        summary = node_history.query(session.connection(), node_id, end - seconds, end)
+    finally:
+        session.close()
+
+    if summary is None:
+        bot.say('Keine Daten zu {} in den letzten {}.'.format(name, period))
+        return
+
+    bot.say('{}, letzte {}: {:d}-{:d} Clients (Ø {:.1f}), {:.0%} online {}'.format(
+        name, period, summary.min, summary.max, summary.avg, summary.online, history.sparkline(summary.values)))
+
+def format_distance(meters):
+    if meters < 1000:
+        return '{:.0f} m'.format(meters)
+
+    return '{:.1f} km'.format(meters / 1000)
+
+def neighbours(bot, node):
+    """Returns how many nodes are online around a new node, to go after its
+    description, or nothing if it has no position."""
+    if not (node['lat'] and node['lon']):
+        return ''
+
+    radius = int(bot.config.freifunk.near_radius or 500)
+    count, _ = node_positions.near(node['lat'], node['lon'], radius, limit=0, only=nodes_table.online,
+                                   exclude=(node['node_id'],))
+
+    return ', {} online im Umkreis von {}'.format(
+        '{:d} Knoten'.format(count) if count else 'kein Knoten', format_distance(radius))
+
+@rate(20)
+@commands('near')
+@example('.near entropia 2km')
+def near(bot, trigger):
+    """Zeigt die nächsten Knoten online um einen Knoten oder eine Position (lat,lon) im Umkreis von 1 km an,
+    andere Radien z.B. mit 500m oder 5km."""
+    if not trigger.group(2):
+        return
+
+    args = trigger.group(2).split()
+    radius = 1000
+
+    if len(args) > 1 and re.match(r'^\d+(\.\d+)?k?m$', args[-1]):
+        arg = args.pop()
+        radius = float(arg[:-2]) * 1000 if arg.endswith('km') else float(arg[:-1])
+
+    # a larger radius would list half of the map
+    radius = min(radius, 50000)
+
+    query = ' '.join(args)
+    position = re.match(r'^(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)$', query)
+
+    if position:
+        lat, lon = float(position.group(1)), float(position.group(2))
+        node_id, name = None, query
+    else:
+        count, matches = node_index.search(query, nodes_table.online)
+
+        if not matches:
+            bot.say('Keine Ergebnisse.')
+            return
+
+        if count > 1 and matches[0].kind != search.EXACT:
+            bot.say('Zu viele Ergebnisse ({:d}): {}'.format(count, ', '.join(match.hostname for match in matches)))
+            return
+
+        node_id, name = matches[0].node_id, matches[0].hostname or matches[0].node_id
+
+        if node_positions.position(node_id) is None:
+            bot.say('{} hat keine Position.'.format(name))
+            return
+
+        lat, lon = node_positions.position(node_id)
+
+    count, nearest = node_positions.near(lat, lon, radius, only=nodes_table.online, exclude=(node_id,))
+
+    if not count:
+        bot.say('Keine Knoten online im Umkreis von {} um {}.'.format(format_distance(radius), name))
+        return
+
+    names = []
+    for distance, match in nearest:
+        values = nodes_table.get(match)
+        names.append('{} ({})'.format(values['hostname'] if values and values['hostname'] else match,
+                                      format_distance(distance)))
+
+    bot.say('{:d} Knoten online im Umkreis von {} um {}: {}{}'.format(
+        count, format_distance(radius), name, ', '.join(names), ', …' if count > len(nearest) else ''))
+
+@rate(20)
+@commands('fw', 'firmware')
+@example('.firmware v2016.1.5')
+def firmware(bot, trigger):
+    """Zeigt, wie viele Knoten online schon eine Firmware haben und wie schnell es mehr werden, ohne Angabe die
+    neueste. Mit mehreren Communities die des Kanals."""
+    site = served_sites.for_channel(trigger.sender) if len(served_sites) > 1 else None
+    part = site.name if site else None
+
+    release = trigger.group(2).strip() if trigger.group(2) else firmware_rollout.latest(part)
+
+    if release is None:
+        bot.say('Keine Knoten online.')
+        return
+
+    progress = firmware_rollout.progress(release, time.time(), part)
+
+    if not progress.count:
+        common = firmware_rollout.releases(part).most_common(3)
+        bot.say('Kein Knoten online mit {}. Am häufigsten: {}'.format(release, ', '.join(
+            '{} ({:.0%})'.format(name, float(count) / progress.total) for name, count in common)))
+        return
+
+    out = ['{:.0%} auf {} ({:d} von {:d} Knoten{})'.format(
+        progress.share, release, progress.count, progress.total, ' in ' + site.name if site else '')]
+
+    if progress.rate is not None:
+        out.append('{:+.1f}%/h'.format(progress.rate))
+
+    branches = sorted(progress.branches.items(), key=lambda item: -item[1][1])
+    out.append(', '.join('{} {:.0%}'.format(branch, float(count) / nodes)
+                         for branch, (count, nodes) in branches if branch))
+
+    if progress.manual:
+        out.append('{:d} ohne Autoupdater noch nicht'.format(progress.manual))
+
+    bot.say('; '.join(item for item in out if item))
+
+@commands('h', 'highscore')
+def highscore(bot, trigger):
+    """Zeigt die Highscores an. Mit mehreren Communities die des Kanals oder die angegebene, sonst alle."""
+    site = pick_site(bot, trigger)
+
+    if site is False:
+        return
+
+    for site in [site] if site else served_sites:
+        label = ' ' + site.name if len(served_sites) > 1 else ''
+        nodes = highscores.get(site.highscore('nodes'))
+        clients = highscores.get(site.highscore('clients'))
+
+        if nodes is None or clients is None:
+            bot.say('Noch keine Highscores{}.'.format(label))
+            continue
+
+        bot.say('Highscore{}: {:d} Nodes ({:s}) und {:d} Clients ({:s})'.format(label, nodes.count,
+                                                                                nodes.date.strftime('%d.%m.%y %H:%M'),
+                                                                                clients.count,
+                                                                                clients.date.strftime('%d.%m.%y %H:%M')))
+
+
+@interval(30)
+def poll(bot):
+    """Starts fetch() on the worker thread, unless the last one is still running."""
+    if not fetch_worker.trigger():
+        print('{}: Last fetch still running, skipping this poll ({:d} so far)'.format(
+            str(datetime.datetime.now()), fetch_worker.skipped))
+
+def fetch(bot, initial=False):
+    global session_maker_instance, stats_flushed
+
+    started = time.time()
+    fetch_stats.count('polls')
+
+    # all sources at once, see fflib.ingest
+    changes, errors = pipeline.poll()
+
+    links = None
+    if graph_source is not None:
+        try:
+            links = graph_source.poll()
+        except sources.SourceError as e:
+            errors.append(e)
+
+    if errors:
+        error(bot, '; '.join(sorted(str(e) for e in errors)))
+    elif 'last_error_msg' in bot.memory['ff'] and bot.memory['ff']['last_error_msg']:
+        # No problems? Everything fine? Clear last error
+        bot.memory['ff']['last_error_msg'] = None
+        for target in served_sites.targets():
+            announce(target, formatting.color('Everything back to normal!', formatting.colors.GREEN),
+                     priority=outbox.URGENT)
+
+    fetch_stats.add('merge', time.time() - started)
+
+    if changes is None:
+        check_topology(bot, links)
+
+        # a quiet network needs its firmware snapshots as well, the rollout
+        # rates are measured against them
+        if not errors and firmware_rollout.snapshot(time.time()):
+            flush_snapshots()
+
+        publish_health()
+        return
+
+    mark = time.time()
+
+    now = datetime.datetime.now()
+    timestamp = time.time()
+    last_poll = bot.memory['ff'].get('nodes_last_poll', now)
+
+    # Client counts change all the time. Nodes where nothing else changed are
+    # only written every stats_flush_interval seconds, so a quiet poll
+    # doesn't touch the database at all.
+    rows, deferred = changes.rows(volatile=('clientcount',))
+
+    inserts = []
+    updates = []
+
+    for old, node in rows:
+        if old is None:
+            node['firstseen'] = now if not initial else None
+            node['lastseen'] = now if node['online'] else None
+            inserts.append(node)
+        else:
+            # lastseen only has to be right for offline nodes
+            if node['online']:
+                node['lastseen'] = now
+            elif old['online']:
+                node['lastseen'] = last_poll
+
+            updates.append((old['node_id'], node))
+            stale_stats.discard(node['node_id'])
+
+    flush_stats = now - stats_flushed >= datetime.timedelta(
+        seconds=int(bot.config.freifunk.stats_flush_interval or 300))
+
+    if flush_stats:
+        for node_id in stale_stats:
+            updates.append((node_id, {'clientcount': nodes_table.get(node_id)['clientcount']}))
+
+    # the outages are found after the write, against the nodes online before
+    online = len(nodes_table.online)
+
+    fetch_stats.add('diff', time.time() - mark)
+    session = session_maker_instance()
+
+    try:
+        with fetch_stats.time('write'):
+            db.write_rows(session.connection(), Node.__table__, inserts, updates)
+            node_history.record(changes, timestamp)
+            node_history.flush(session.connection(), timestamp)
+            firmware_rollout.flush(session.connection(), timestamp)
+
+        with fetch_stats.time('commit'):
+            session.commit()
+
+        with fetch_stats.time('apply'):
+            nodes_table.apply(changes)
+            network_stats.apply(changes)
+            node_index.apply(changes)
+            node_positions.apply(changes)
+            mesh_topology.apply(changes)
+            firmware_rollout.apply(changes)
+            # written with the next poll
+            firmware_rollout.snapshot(timestamp)
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    fetch_stats.count('rows_written', len(inserts) + len(updates))
+
+    with fetch_stats.time('highscores'):
+        check_highscores(bot, initial)
+
+    publish_metrics(timestamp)
+
+    if flush_stats:
+        stale_stats.clear()
+        stats_flushed = now
+
+    stale_stats.update(deferred)
+    bot.memory['ff']['nodes_last_poll'] = now
+
+    mark = time.time()
+
+    if not initial:
+        events, covered = outage_tracker.update(changes, online, timestamp)
+
+        for event in events:
+            # an outage behind a shared gateway concerns every site it hit
+            hit = sites_of(event.outage.nodes)
+            for target in site_targets(hit):
+                announce(target, outage_message(event),
+                         priority=outbox.HIGH if isinstance(event, outage.OutageStarted) else outbox.NORMAL)
+            bus.get().publish(bus.OutageChanged([site.name for site in hit], event))
+
+        ignore = bot.config.freifunk.get_list('change_no_announce') + list(NOT_ANNOUNCED)
+
+        for event in changes.events(ignore=ignore):
+            if isinstance(event, diff.NodeOnline) and event.node['node_id'] in covered:
+                continue
+
+            node = event.node
+            name = node['hostname'] if node['hostname'] is not None else node['node_id']
+            site = site_of(node)
+
+            if isinstance(event, diff.NodeAdded):
+                bus.get().publish(bus.NodeAppeared(site.name, node))
+
+                if node['gateway']:
+                    announce(site.channel, 'Neues Gateway: {:s}'.format(describe(node)))
+                else:
+                    announce(site.channel, 'Neuer Knoten: {:s}{:s}'.format(describe(node), neighbours(bot, node)),
+                             summary='{count:d} neue Knoten: {items}', item=name)
+            elif not node['gateway']:
+                announce(site.change_announce_target, change_message(bot, event),
+                         summary=change_summary(event), item=name)
+
+    fetch_stats.add('announce', time.time() - mark)
+
+    check_topology(bot, links)
+
+    fetch_stats.add('total', time.time() - started)
+
+def check_topology(bot, links):
+    """Takes the links that changed into the topology and announces the
+    clouds that were cut off from the gateways or got one back."""
+    # until the links load for the first time, what is cut off when they do
+    # is taken as it is, not announced
+    if graph_source is None or graph_source.fetched is None:
+        return
+
+    with fetch_stats.time('topology'):
+        events = mesh_topology.update(links or (), graph_source.nodes, time.time())
+
+    for event in events:
+        for target in site_targets(sites_of(event.cloud.nodes)):
+            announce(target, cloud_message(event),
+                     priority=outbox.HIGH if isinstance(event, topology.CloudCutOff) else outbox.NORMAL)
+
+def publish_metrics(timestamp):
+    """Hands the totals, breakdowns, highscores and poll counters to the
+    metrics exporter, with several sites their totals, breakdowns and
+    highscores one by one as well."""
+    if exporter is None:
+        return
+
+    def scores(site):
+        result = {}
+        for name in ('gateways', 'nodes', 'clients'):
+            score = highscores.get(site.highscore(name))
+            if score is not None:
+                result[name] = (score.count, time.mktime(score.date.timetuple()) if score.date else None)
+        return result
+
+    exporter.update(None,
+        totals=network_stats.totals(),
+        breakdowns=dict((name, network_stats.breakdown(name)) for name in aggregates.BREAKDOWNS),
+        highscores=scores(served_sites.default) if len(served_sites) == 1 else {},
+        counters=dict(fetch_stats.counters),
+        last_success=timestamp)
+
+    if len(served_sites) > 1:
+        for site in served_sites:
+            exporter.update(metrics.site_key(site.name),
+                totals=network_stats.totals(site.name),
+                breakdowns=dict((name, network_stats.breakdown(name, site.name)) for name in aggregates.BREAKDOWNS),
+                highscores=scores(site))
+
+    publish_health()
+
+def publish_health():
+    """Hands whether each source can be polled to the metrics exporter."""
+    if exporter is None:
+        return
+
+    for source in pipeline.sources + ([graph_source] if graph_source else []):
+        exporter.update(source.name, counters=dict(source.stats.counters), last_success=source.fetched,
+                        error=source.error)
+
+def announce(target, text, **kwargs):
+    """Hands `text` to the outbox, see fflib.outbox.Outbox.put()."""
+    fetch_stats.count('messages')
+    announcements.put(target, text, **kwargs)
+
+def change_message(bot, event):
+    node = event.node
+    name = node['hostname'] if node['hostname'] is not None else node['node_id']
+
+    if isinstance(event, diff.NodeOnline):
+        return 'Knoten {:s} ist nun {:s}'.format(
+            formatting.bold(str(name)),
+            formatting.color('online', formatting.colors.GREEN)
+            if event.online else formatting.color('offline', formatting.colors.RED))
+    elif isinstance(event, diff.NodeMoved):
+        if event.distance is not None:
+            return 'Knoten {:s} änderte seine Position um {:.0f} Meter: {:s}'.format(
+                formatting.bold(str(name)), event.distance, map_link(node))
+        elif (node['lat'] and node['lon']):
+            return 'Knoten {:s} hat nun eine Position: {:s}'.format(
+                formatting.bold(str(name)), map_link(node))
+        else:
+            return 'Knoten {:s} hat keine Position mehr'.format(
+                formatting.bold(str(name)))
+    else:
+        return 'Knoten {:s} änderte {:s} von {:s} zu {:s}'.format(
+            formatting.bold(str(name)),
+            str(event.field), str(event.old), str(event.new))
+
+def sites_of(node_ids):
+    """Returns the sites of `node_ids`, each once."""
+    result = []
+
+    for node_id in node_ids:
+        node = nodes_table.get(node_id)
+        site = site_of(node) if node else served_sites.default
+
+        if site not in result:
+            result.append(site)
+
+    return result
+
+def site_targets(hit):
+    """Returns the change_announce_targets of the sites `hit`, each once."""
+    result = []
+
+    for site in hit:
+        if site.change_announce_target not in result:
+            result.append(site.change_announce_target)
+
+    return result
+
+def outage_message(event):
+    incident = event.outage
+    started = datetime.datetime.fromtimestamp(incident.started).strftime('%d.%m. %H:%M')
+
+    if isinstance(event, outage.OutageStarted):
+        msg = '{:s}: {:d} Knoten offline'.format(
+            formatting.color(formatting.bold('Ausfall'), formatting.colors.RED), incident.total)
+        if incident.gateways:
+            msg += ', mit Gateway {:s}'.format(', '.join(str(name) for name in incident.gateways))
+        if incident.bbox:
+            msg += ', im Bereich {:.4f},{:.4f} bis {:.4f},{:.4f} ({:.1f} x {:.1f} km)'.format(
+                *(incident.bbox + tuple(length / 1000 for length in incident.extent())))
+        return msg
+    elif isinstance(event, outage.OutageRecovering):
+        return 'Ausfall vom {:s}: {:d} von {:d} Knoten wieder online'.format(started, incident.recovered, incident.total)
+    elif event.expired:
+        return 'Ausfall vom {:s}: {:d} von {:d} Knoten nicht zurückgekommen'.format(
+            started, len(incident.down), incident.total)
+    else:
+        return 'Ausfall vom {:s} {:s}: alle {:d} Knoten wieder online'.format(
+            started, formatting.color('behoben', formatting.colors.GREEN), incident.total)
+
+def cloud_message(event):
+    cloud = event.cloud
+
+    if isinstance(event, topology.CloudCutOff):
+        names = sorted(str(node['hostname'] if node and node['hostname'] else node_id)
+                       for node_id, node in ((node_id, nodes_table.get(node_id)) for node_id in cloud.nodes))
+
+        return '{:s}: {:d} Knoten ohne Verbindung zu einem Gateway: {:s}{:s}'.format(
+            formatting.color(formatting.bold('Mesh getrennt'), formatting.colors.RED), cloud.total,
+            ', '.join(names[:3]), ', …' if len(names) > 3 else '')
+
+    return 'Mesh-Wolke vom {:s} {:s}: {:d} Knoten wieder mit einem Gateway verbunden'.format(
+        datetime.datetime.fromtimestamp(cloud.started).strftime('%d.%m. %H:%M'),
+        formatting.color('behoben', formatting.colors.GREEN), cloud.total)
+
+def change_summary(event):
+    """Returns the line many events like `event` are merged into, or None
+    if they are announced one by one."""
+    if isinstance(event, diff.NodeOnline):
+        return '{{count:d}} Knoten sind nun {:s}: {{items}}'.format(
+            formatting.color('online', formatting.colors.GREEN)
+            if event.online else formatting.color('offline', formatting.colors.RED))
+
+    return None
+
+def flush_snapshots():
+    """Writes the firmware snapshots taken on a poll that changed nothing."""
+    session = session_maker_instance()
+
+    try:
+        firmware_rollout.flush(session.connection(), time.time())
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def error(bot, msg):
+    print('{}: {}'.format(str(datetime.datetime.now()), msg))
+
+    if 'initialized' in bot.memory:
+        if 'last_error_msg' not in bot.memory['ff'] or bot.memory['ff']['last_error_msg'] != msg:
+            bot.memory['ff']['last_error_msg'] = msg
+            for target in served_sites.targets():
+                announce(target,
+                         formatting.color('{}: {}'.format(formatting.bold('[ERROR]'), msg), formatting.colors.RED),
+                         priority=outbox.URGENT)
+
+def check_highscores(bot, initial=False):
+    """Compares the online totals of every site with its highscores and
+    stores new ones. The initial fetch only stores them, an empty
+    highscores table would announce every total otherwise."""
+    global session_maker_instance
+
+    new_highscores = []
+
+    for site in served_sites:
+        for name, count in network_stats.totals(site.name).items():
+            score = highscores.get(site.highscore(name)) or Highscore(site.highscore(name))
+
+            if score.update(count):
+                highscores[score.name] = score
+                new_highscores.append((site, name, score))
+
+    if not new_highscores:
+        return
+
+    session = session_maker_instance()
+
+    try:
+        for _, _, score in new_highscores:
+            session.merge(score)
+
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    if initial:
+        return
+
+    for site, name, score in new_highscores:
+        announce(site.channel,
+                 'Neuer Highscore{}: {:d} {:s}'.format(' ' + site.name if len(served_sites) > 1 else '',
+                                                      score.count, name.capitalize()),
+                 priority=outbox.HIGH)
+        bus.get().publish(bus.HighscoreReached(site.name, score.name, score.count, score.date))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from willie.module import commands, interval
+
+import datetime
+import json
+import os
+import sys
+
+# willie doesn't put modules/ on the path, but we need the shared fflib package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fflib import outbox, stats, storage
+
+# the stages of fetch(), the sources and the posters in the order they run
+STAGES = ('total', 'http', 'download', 'parse', 'merge', 'diff', 'write', 'commit', 'apply', 'highscores',
+          'announce', 'topology', 'post', 'latency')
+
+# (counter, label) in the order they are shown, counters that are 0 are left out
+COUNTERS = (('polls', '{:d} Polls'), ('not_modified', '{:d} unverändert'), ('errors', '{:d} Fehler'),
+            ('skipped', '{:d} übersprungen'), ('bytes_downloaded', '{:.1f} MiB'),
+            ('nodes_parsed', '{:d} Knoten gelesen'), ('nodes_ingested', '{:d} übernommen'),
+            ('nodes_ignored', '{:d} ignoriert'), ('nodes_unchanged', '{:d} davon unverändert'),
+            ('links_parsed', '{:d} Links gelesen'), ('events_fetched', '{:d} Termine geladen'),
+            ('rows_written', '{:d} Zeilen geschrieben'), ('messages', '{:d} Nachrichten'),
+            ('published', '{:d} Ereignisse'), ('dropped', '{:d} verworfen'), ('posted', '{:d} gepostet'),
+            ('post_failures', '{:d} Fehlversuche'), ('duplicates', '{:d} doppelt'))
+
+
+@commands('ffstats')
+def ffstats(bot, trigger):
+    """Zeigt Laufzeiten und Zähler der Abfragen, nur für Admins."""
+    if not trigger.admin:
+        return
+
+    snapshot = dump(bot)
+
+    for name, source in sorted(snapshot['sources'].items()):
+        counters = dict(source['counters'])
+        worker = source['gauges'].get('worker', {})
+        counters['errors'] = counters.get('errors', 0) + worker.get('failed', 0)
+        counters['skipped'] = worker.get('skipped', 0)
+        counters['bytes_downloaded'] = counters.get('bytes_downloaded', 0) / 1048576.0
+
+        # the sources and the ingest pipeline count different things
+        values = [label.format(counters[key]) for key, label in COUNTERS if counters.get(key)]
+        ingest = source['gauges'].get('ingest')
+        if ingest:
+            values.append('zuletzt {:d} Knoten übernommen, {:d} ignoriert'.format(ingest['ingested'],
+                                                                               ingest['ignored']))
+        skip = source['gauges'].get('skip', {}).get('ratio')
+        if skip:
+            values.append('{:.0%} der Knoten zuletzt übersprungen'.format(skip))
+        waiting = source['gauges'].get('queue', {}).get('depth')
+        if waiting:
+            values.append('{:d} wartend'.format(waiting))
+        if values:
+            bot.msg(trigger.nick, '{}: {}'.format(name, ', '.join(values)))
+
+        timings = ['{} {}'.format(stage, '/'.join('{:.0f}'.format(source['timings'][stage][p] or 0)
+                                                 for p in ('p50', 'p95', 'p99')))
+                   for stage in STAGES if stage in source['timings']]
+        if timings:
+            bot.msg(trigger.nick, '{}: p50/p95/p99 ms: {}'.format(name, ', '.join(timings)))
+
+    subscribers = snapshot['sources'].get('bus', {}).get('gauges', {}).get('subscribers', {})
+    for name, subscriber in sorted(subscribers.items()):
+        bot.msg(trigger.nick, 'Bus {}: {:d} wartend, {:d} zugestellt, {:d} verworfen, {:d} Fehler'.format(
+            name, subscriber['depth'], subscriber['delivered'], subscriber['dropped'], subscriber['failed']))
+
+    queue = snapshot['outbox']
+    bot.msg(trigger.nick, 'Outbox: {:d} wartend, {:d} gesendet, {:d} zusammengefasst, Verzögerung {:.1f} s '
+                          '(max. {:.1f} s)'.format(queue['depth'], queue['sent'], queue['coalesced'],
+                                                   queue['latency_avg'], queue['latency_max']))
+
+
+@interval(60)
+def write_dump(bot):
+    """Writes the stats as JSON to stats_path, if it is set."""
+    path = bot.config.freifunk.stats_path
+    if not path:
+        return
+
+    # replaced in one go, so readers never see half a file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dump(bot), f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def dump(bot):
+    """Returns all stats as plain dicts."""
+    store = storage.get(bot.config.freifunk.db_path)
+
+    return {
+        'time': datetime.datetime.now().isoformat(),
+        'sources': stats.snapshot(),
+        'outbox': outbox.get().stats(),
+        'queries': [{'statement': ' '.join(statement.split()), 'count': count, 'total_ms': total * 1000,
+                     'max_ms': longest * 1000}
+                    for statement, count, total, longest in store.timer.report(5)],
+    }
@@ -1,69 +1,73 @@
 # -*- coding: utf-8 -*-
 
-from willie.module import interval
-
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime
-from sqlalchemy.orm import sessionmaker
 import datetime
-from twython import Twython, TwythonStreamer
+import os
+import sys
+
+try:
+    from twython import Twython, TwythonError
+except ImportError:
+    # not needed with twitter_backend = stub
+    Twython = None
 
-Base = declarative_base()
-session_maker_instance = None
+# willie doesn't put modules/ on the path, but we need the shared fflib package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fflib import bus, posting, storage
 
+poster = None
 
-# already defined in ff-nodeinfo, better move to separate class file
-class Highscore(Base):
-    __tablename__ = 'highscores'
 
-    name = Column(String, primary_key=True)
-    date = Column(DateTime)
-    count = Column(Integer)
+class TwitterBackend(posting.Backend):
+    """Tweets with one client for all statuses."""
 
-    def __init__(self, name):
-        self.name = name
-        self.count = 0
+    def __init__(self, config):
+        self.client = Twython(config.twitter_api_key, config.twitter_api_secret,
+                              config.twitter_oauth_key, config.twitter_oauth_secret)
 
-    def update(self, count):
-        if self.count < count:
-            self.count = count
-            self.date = datetime.datetime.now()
-            return True
-        return False
+    def post(self, text):
+        try:
+            self.client.update_status(status=text)
+        except TwythonError as e:
+            # duplicates and statuses Twitter doesn't like, unlike 429 and 5xx
+            if e.error_code == 403:
+                raise posting.PostRejected(str(e))
+            raise
 
 
 def setup(bot):
-    if 'ff' not in bot.memory:
-        bot.memory['ff'] = {}
+    global poster
+
+    config = bot.config.freifunk
+
+    if config.twitter_backend == 'stub':
+        backend = posting.StubBackend()
+    elif Twython is None:
+        print('{}: ff-twitter: twython is not installed, the tweets are only kept by the stub backend'.format(
+            str(datetime.datetime.now())))
+        backend = posting.StubBackend()
+    else:
+        backend = TwitterBackend(config)
+
+    store = storage.get(config.db_path)
+    store.create_tables(posting.Base.metadata)
+    poster = posting.Poster('twitter', backend, store.engine)
 
-    bot.memory['ff']['last_highscore_dt'] = {}
+    bus.get().subscribe('ff-twitter', tweet, kinds=(bus.HighscoreReached,))
 
-    check_highscore(bot, initial=True)
 
+def shutdown(bot):
+    bus.get().unsubscribe('ff-twitter', timeout=10)
 
-@interval(30)
-def check_highscore(bot, initial=False):
-    engine = create_engine('sqlite:///{0}'.format(bot.config.freifunk.db_path))
-    session_maker_instance = sessionmaker(engine)
+    if poster:
+        poster.stop(timeout=10)
 
-    session = session_maker_instance()
 
-    for highscore in session.query(Highscore):
-        if highscore.name not in bot.memory['ff']['last_highscore_dt'] \
-                or (bot.memory['ff']['last_highscore_dt'][highscore.name]
-                and bot.memory['ff']['last_highscore_dt'][highscore.name] < highscore.date):
-            bot.memory['ff']['last_highscore_dt'][highscore.name] = highscore.date
+def tweet(highscore):
+    poster.put(describe(highscore))
 
-            if not initial:
-                print('Neuer Highscore: {:d} {:s}'.format(highscore.count, highscore.name.capitalize()))
 
-                twitter = Twython(
-                    bot.config.freifunk.twitter_api_key,
-                    bot.config.freifunk.twitter_api_secret,
-                    bot.config.freifunk.twitter_oauth_key,
-                    bot.config.freifunk.twitter_oauth_secret)
-                twitter.update_status(
-                    status='Neuer Highscore: {:d} {:s}'.format(highscore.count, highscore.name.capitalize()))
+def describe(highscore):
+    # highscores of one of several sites are named site/name, see fflib.sites
+    site, _, name = highscore.name.rpartition('/')
 
-    session.close()
+    return 'Neuer Highscore{}: {:d} {:s}'.format(' ' + site if site else '', highscore.count, name.capitalize())
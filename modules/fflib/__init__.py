@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""Code shared by the ff-* willie modules.
+
+willie loads every file in modules/ on its own, so anything that more than
+one module needs lives in this package instead of being copied around.
+"""
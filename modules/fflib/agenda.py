@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""The events of the CalDAV calendar, for ff-calendar. A CalendarStore keeps
+them in memory for the commands and refresh() brings them up to date in the
+background:
+
+    - the calendar's URL is looked up once (current-user-principal,
+      calendar-home-set, the calendar named `calendar`) and then kept
+    - its getctag and sync-token are asked for first, if neither changed
+      nothing else is read
+    - with a sync-token, a sync-collection REPORT names the events that
+      changed or were deleted since, otherwise a calendar-query lists the
+      ETags of all events and those that changed are found by comparing
+    - only changed events are downloaded, with calendar-multiget
+
+    store = agenda.get(bot.config.freifunk.caldav_url, bot.config.freifunk.caldav_cal)
+    store.refresh()
+    store.upcoming(datetime.now(tz=timezone.utc), days=90)
+
+Recurring events are expanded in memory with dateutil, EXDATEs and moved
+occurrences (RECURRENCE-ID) taken into account.
+"""
+
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+try:
+    from urllib.parse import unquote, urljoin, urlsplit, urlunsplit
+except ImportError:
+    from urllib import unquote
+    from urlparse import urljoin, urlsplit, urlunsplit
+
+import pytz
+import requests
+from dateutil import rrule
+
+from . import stats
+
+NS = {'d': 'DAV:', 'c': 'urn:ietf:params:xml:ns:caldav', 'cs': 'http://calendarserver.org/ns/'}
+
+# times without a time zone are taken to be local
+TIMEZONE = pytz.timezone('Europe/Berlin')
+
+# events asked for per calendar-multiget
+MULTIGET_SIZE = 50
+
+# start and end are datetimes, naive for all-day events
+Occurrence = namedtuple('Occurrence', ['title', 'start', 'end'])
+
+_PROPFIND = '''<?xml version="1.0" encoding="utf-8"?>
+<d:propfind xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav" xmlns:cs="http://calendarserver.org/ns/">
+<d:prop>{}</d:prop>
+</d:propfind>'''
+
+_SYNC = '''<?xml version="1.0" encoding="utf-8"?>
+<d:sync-collection xmlns:d="DAV:">
+<d:sync-token>{}</d:sync-token>
+<d:sync-level>1</d:sync-level>
+<d:prop><d:getetag/></d:prop>
+</d:sync-collection>'''
+
+_QUERY = '''<?xml version="1.0" encoding="utf-8"?>
+<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+<d:prop><d:getetag/></d:prop>
+<c:filter><c:comp-filter name="VCALENDAR"><c:comp-filter name="VEVENT"/></c:comp-filter></c:filter>
+</c:calendar-query>'''
+
+_MULTIGET = '''<?xml version="1.0" encoding="utf-8"?>
+<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+<d:prop><d:getetag/><c:calendar-data/></d:prop>
+{}
+</c:calendar-multiget>'''
+
+_until = re.compile(r'UNTIL=(\d{8}T\d{6})Z')
+
+# a content line is NAME *(;PARAM=VALUE) :VALUE, parameter values in double
+# quotes may contain ':', ';' and ',' (RFC 5545, 3.1)
+_name = re.compile(r'[^;:]*')
+_param = re.compile(r';([^=;:]*)=((?:"[^"]*"|[^";:])*)')
+
+
+class CalendarError(Exception):
+    """A request to the CalDAV server failed, `status` is its HTTP status."""
+
+    def __init__(self, message, status=None):
+        super(CalendarError, self).__init__(message)
+        self.status = status
+
+
+def parse(data):
+    """Returns the VEVENTs of the iCalendar `data` as dicts mapping the
+    property names to lists of (parameters, value)."""
+    events = []
+    current = None
+    # components inside the event, like VALARMs, whose properties aren't the event's
+    nested = 0
+
+    for line in re.sub(r'\r?\n[ \t]', '', data).splitlines():
+        name, params, value = _content_line(line)
+
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            current = {}
+            events.append(current)
+        elif name == 'END' and value.upper() == 'VEVENT':
+            current = None
+        elif name in ('BEGIN', 'END'):
+            if current is not None:
+                nested += 1 if name == 'BEGIN' else -1
+        elif current is not None and not nested:
+            current.setdefault(name, []).append((params, value))
+
+    return events
+
+
+def _content_line(line):
+    """Returns the name, the parameters (without their quotes) and the value
+    of an unfolded content line."""
+    end = _name.match(line).end()
+    name = line[:end].upper()
+    params = {}
+
+    while True:
+        match = _param.match(line, end)
+        if match is None:
+            break
+        params[match.group(1).upper()] = match.group(2).replace('"', '')
+        end = match.end()
+
+    # the value starts at the first ':' outside of the parameters
+    colon = line.find(':', end)
+
+    return name, params, line[colon + 1:] if colon >= 0 else ''
+
+
+def parse_time(params, value):
+    """Returns the DATE or DATE-TIME `value` as datetime, in UTC, in its TZID
+    or, for dates, naive."""
+    value = value.strip()
+
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d')
+
+    if value.endswith('Z'):
+        return pytz.utc.localize(datetime.strptime(value[:-1], '%Y%m%dT%H%M%S'))
+
+    try:
+        zone = pytz.timezone(params.get('TZID', '').strip('"'))
+    except pytz.UnknownTimeZoneError:
+        zone = TIMEZONE
+
+    return zone.localize(datetime.strptime(value, '%Y%m%dT%H%M%S'))
+
+
+def parse_duration(value):
+    """Returns the iCalendar DURATION `value` as timedelta."""
+    match = re.match(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$', value.strip())
+    if not match:
+        return timedelta()
+
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+
+    return -duration if sign == '-' else duration
+
+
+def aware(moment):
+    """Takes naive datetimes, those of all-day events, as local time."""
+    return moment if moment.tzinfo else TIMEZONE.localize(moment)
+
+
+def occurrences(events, start, end):
+    """Returns the Occurrences of the VEVENTs `events` (of one calendar
+    object, see parse()) overlapping `start` to `end` (aware datetimes)."""
+    result = []
+    # RECURRENCE-IDs replacing an occurrence of their UID
+    moved = set()
+
+    for event in events:
+        if 'RECURRENCE-ID' in event:
+            moved.add((_value(event, 'UID'), aware(parse_time(*event['RECURRENCE-ID'][0]))))
+
+    for event in events:
+        if 'DTSTART' not in event or _value(event, 'STATUS', '').upper() == 'CANCELLED':
+            continue
+
+        title = _unescape(_value(event, 'SUMMARY', ''))
+        first = parse_time(*event['DTSTART'][0])
+
+        if 'DTEND' in event:
+            length = parse_time(*event['DTEND'][0]) - first
+        elif 'DURATION' in event:
+            length = parse_duration(_value(event, 'DURATION'))
+        else:
+            length = timedelta(days=1) if first.tzinfo is None else timedelta()
+
+        if 'RRULE' in event and 'RECURRENCE-ID' not in event:
+            starts = _expand(event, first, start - length, end)
+            uid = _value(event, 'UID')
+            starts = [moment for moment in starts if (uid, aware(moment)) not in moved]
+        else:
+            starts = [first]
+
+        for moment in starts:
+            if aware(moment) < end and aware(moment + length) > start:
+                result.append(Occurrence(title, moment, moment + length))
+
+    return result
+
+
+def _value(event, name, default=None):
+    return event[name][0][1] if name in event else default
+
+
+def _unescape(text):
+    return re.sub(r'\\([\\;,nN])', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), text)
+
+
+def _expand(event, first, start, end):
+    """Returns the starts of the recurring `event` from `start` to `end`.
+    dateutil expands in naive local time, so a weekly event stays at 19:00
+    across a change to or from daylight saving time."""
+    zone = getattr(first.tzinfo, 'zone', None)
+    zone = pytz.timezone(zone) if zone else (TIMEZONE if first.tzinfo else None)
+
+    def to_local(moment):
+        return moment.astimezone(zone or TIMEZONE).replace(tzinfo=None)
+
+    local = to_local(first) if zone else first
+
+    rules = rrule.rruleset()
+    for _, value in event['RRULE']:
+        # UNTIL is given in UTC, dateutil wants it like DTSTART
+        value = _until.sub(lambda match: 'UNTIL=' + to_local(pytz.utc.localize(
+            datetime.strptime(match.group(1), '%Y%m%dT%H%M%S'))).strftime('%Y%m%dT%H%M%S'), value)
+        rules.rrule(rrule.rrulestr(value, dtstart=local))
+
+    for name in ('RDATE', 'EXDATE'):
+        for params, value in event.get(name, ()):
+            for item in value.split(','):
+                moment = parse_time(params, item)
+                moment = to_local(moment) if moment.tzinfo else moment
+                if name == 'RDATE':
+                    rules.rdate(moment)
+                else:
+                    rules.exdate(moment)
+
+    between = rules.between(to_local(start), to_local(end), inc=True)
+
+    return [zone.localize(moment) for moment in between] if zone else between
+
+
+class CalendarStore(object):
+    """The events of the calendar `calendar`, its URL or display name, of
+    the CalDAV server at `url`, see the module docstring."""
+
+    def __init__(self, url, calendar, timeout=(3.05, 10)):
+        parts = urlsplit(url)
+        self.session = requests.Session()
+
+        # credentials in the URL, like caldav.DAVClient takes them
+        if parts.username:
+            self.session.auth = (unquote(parts.username), unquote(parts.password or ''))
+            parts = parts._replace(netloc=parts.netloc.rpartition('@')[2])
+
+        self.url = urlunsplit(parts)
+        self.calendar = calendar
+        self.timeout = timeout
+
+        self.calendar_url = None
+        # getctag and sync-token of the calendar at the last refresh
+        self.tags = None
+        # of the last sync-collection, None without
+        self.sync_token = None
+        # href -> (etag, VEVENTs), see parse()
+        self.objects = {}
+        # unix time of the last successful refresh, None before the first
+        self.refreshed = None
+
+        # counts the changes of `objects`, for the cache of upcoming()
+        self._version = 0
+        self._upcoming = (None, None)
+
+        self.stats = stats.get('calendar')
+        self.stats.gauge('events', lambda: {'objects': len(self.objects)})
+
+        self._lock = threading.Lock()
+
+    def upcoming(self, now, days=90):
+        """Returns the Occurrences from `now` (an aware datetime) to `days`
+        days later by start, including those still going on."""
+        end = now + timedelta(days=days)
+        # expanded for the whole hour, until the events change
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        key = (self._version, hour, days)
+
+        with self._lock:
+            cached = self._upcoming[1] if self._upcoming[0] == key else None
+            objects = list(self.objects.values())
+
+        if cached is None:
+            cached = []
+            for _, events in objects:
+                cached.extend(occurrences(events, hour, end + timedelta(hours=1)))
+            cached.sort(key=lambda occurrence: aware(occurrence.start))
+
+            with self._lock:
+                self._upcoming = (key, cached)
+
+        return [occurrence for occurrence in cached if aware(occurrence.end) > now and aware(occurrence.start) < end]
+
+    def refresh(self):
+        """Downloads what changed since the last refresh. Returns the number
+        of events downloaded or deleted, raises CalendarError."""
+        self.stats.count('polls')
+
+        try:
+            with self.stats.time('total'):
+                if self.calendar_url is None:
+                    self.calendar_url = self._discover()
+                    self.tags = self.sync_token = None
+
+                try:
+                    changed = self._refresh()
+                except CalendarError as e:
+                    if e.status not in (404, 410):
+                        raise
+                    # the calendar moved, look for it again next time
+                    self.calendar_url = None
+                    raise
+        except (CalendarError, requests.RequestException):
+            self.stats.count('errors')
+            raise
+
+        self.refreshed = time.time()
+
+        return changed
+
+    def _refresh(self):
+        props = self._properties(self.calendar_url, '<cs:getctag/><d:sync-token/>')
+        tags = (props.get('getctag'), props.get('sync-token'))
+
+        if any(tags) and tags == self.tags:
+            self.stats.count('not_modified')
+            return 0
+
+        if tags[1] is not None:
+            try:
+                fetch, gone, token = self._sync(self.sync_token or '')
+            except CalendarError as e:
+                # the token expired, or sync-collection isn't supported after all
+                if e.status not in (400, 403, 409, 501):
+                    raise
+                fetch, gone = self._compare()
+                token = None
+        else:
+            fetch, gone = self._compare()
+            token = None
+
+        self._multiget(fetch)
+
+        with self._lock:
+            for href in gone:
+                self.objects.pop(href, None)
+            self._version += 1
+
+        # only now, if anything above failed the next refresh asks again
+        self.sync_token = token
+        self.tags = tags
+
+        return len(fetch) + len(gone)
+
+    def _sync(self, token):
+        """Returns the hrefs changed and gone since `token`, and the new token."""
+        root = self._report(self.calendar_url, 1, _SYNC.format(_escape(token)))
+        fetch, gone = [], []
+
+        for href, status, props in self._responses(root):
+            if status == 404:
+                gone.append(href)
+            elif href != self.calendar_url and props.get('getetag') != self._etag(href):
+                fetch.append(href)
+
+        return fetch, gone, root.findtext('d:sync-token', namespaces=NS)
+
+    def _compare(self):
+        """Returns the hrefs changed and gone according to a list of all ETags."""
+        root = self._report(self.calendar_url, 1, _QUERY)
+        etags = dict((href, props.get('getetag')) for href, status, props in self._responses(root)
+                     if status == 200 and href != self.calendar_url)
+
+        with self._lock:
+            known = dict((href, etag) for href, (etag, _) in self.objects.items())
+
+        return [href for href, etag in etags.items() if known.get(href) != etag or etag is None], \
+            [href for href in known if href not in etags]
+
+    def _multiget(self, hrefs):
+        for offset in range(0, len(hrefs), MULTIGET_SIZE):
+            body = _MULTIGET.format(''.join('<d:href>{}</d:href>'.format(_escape(urlsplit(href).path))
+                                            for href in hrefs[offset:offset + MULTIGET_SIZE]))
+            root = self._report(self.calendar_url, 1, body)
+            fetched = {}
+
+            for href, status, props in self._responses(root):
+                if status == 200 and props.get('calendar-data'):
+                    fetched[href] = (props.get('getetag'), parse(props['calendar-data']))
+
+            self.stats.count('events_fetched', len(fetched))
+
+            with self._lock:
+                self.objects.update(fetched)
+                self._version += 1
+
+    def _discover(self):
+        """Returns the URL of the calendar."""
+        if self.calendar.startswith(('http://', 'https://')):
+            return self.calendar
+
+        home = self.url
+        principal = self._properties(self.url, '<d:current-user-principal/>').get('current-user-principal')
+        if principal:
+            home = self._properties(principal, '<c:calendar-home-set/>').get('calendar-home-set') or home
+
+        for href, props in self._propfind(home, 1, '<d:displayname/><d:resourcetype/>').items():
+            if props.get('calendar') and self.calendar in (props.get('displayname'), href,
+                                                            urlsplit(href).path.rstrip('/').rpartition('/')[2]):
+                return href
+
+        raise CalendarError('no calendar {} at {}'.format(self.calendar, self.url))
+
+    def _etag(self, href):
+        with self._lock:
+            return self.objects.get(href, (None,))[0]
+
+    def _propfind(self, url, depth, props):
+        """Returns href -> {property: value} of a PROPFIND for `props`."""
+        root = self._request('PROPFIND', url, depth, _PROPFIND.format(props))
+
+        return dict((href, props) for href, status, props in self._responses(root) if status == 200)
+
+    def _properties(self, url, props):
+        """Returns {property: value} of `url` itself."""
+        return next(iter(self._propfind(url, 0, props).values()), {})
+
+    def _report(self, url, depth, body):
+        return self._request('REPORT', url, depth, body)
+
+    def _request(self, method, url, depth, body):
+        with self.stats.time('http'):
+            response = self.session.request(method, url, data=body.encode('utf-8'), timeout=self.timeout,
+                                            headers={'Depth': str(depth),
+                                                     'Content-Type': 'application/xml; charset=utf-8'})
+
+        if response.status_code >= 400:
+            raise CalendarError('{} {} failed: HTTP {:d}'.format(method, url, response.status_code),
+                                response.status_code)
+
+        self.stats.count('bytes_downloaded', len(response.content))
+
+        return ElementTree.fromstring(response.content)
+
+    def _responses(self, root):
+        """Yields (href, status, {property: value}) for every response of a
+        multistatus. hrefs are absolute URLs, the values text or, for
+        properties holding an href, its absolute URL, resourcetype gives
+        'calendar' True for calendars."""
+        for response in root.findall('d:response', NS):
+            href = urljoin(self.url, (response.findtext('d:href', '', NS)).strip())
+            status = _status(response.findtext('d:status', None, NS))
+            props = {}
+
+            for propstat in response.findall('d:propstat', NS):
+                if _status(propstat.findtext('d:status', None, NS)) not in (None, 200):
+                    continue
+
+                status = status or 200
+
+                found = propstat.find('d:prop', NS)
+
+                for prop in found if found is not None else ():
+                    name = prop.tag.rpartition('}')[2]
+                    link = prop.find('d:href', NS)
+
+                    if link is not None:
+                        props[name] = urljoin(self.url, (link.text or '').strip())
+                    elif name == 'resourcetype':
+                        props['calendar'] = prop.find('c:calendar', NS) is not None
+                    else:
+                        props[name] = prop.text
+
+            yield href, status or 200, props
+
+
+def _status(line):
+    """Returns the code of an HTTP status line like "HTTP/1.1 404 Not Found"."""
+    if not line:
+        return None
+
+    parts = line.split()
+    return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get(url, calendar):
+    """Returns the CalendarStore of `calendar` at `url`, kept across module
+    reloads so the events don't need to be downloaded again."""
+    with _stores_lock:
+        if (url, calendar) not in _stores:
+            _stores[(url, calendar)] = CalendarStore(url, calendar)
+
+        return _stores[(url, calendar)]
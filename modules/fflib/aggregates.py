@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Network totals kept up to date from the changesets of the ingest."""
+
+import threading
+from collections import Counter
+
+BREAKDOWNS = ('firmware_release', 'hardware', 'branch', 'autoupdate')
+
+
+class _Counts(object):
+    """The numbers of one part of the network."""
+
+    def __init__(self):
+        self.gateways = 0
+        self.nodes = 0
+        self.clients = 0
+        self.breakdowns = dict((name, Counter()) for name in BREAKDOWNS)
+
+    def totals(self):
+        return {'gateways': self.gateways, 'nodes': self.nodes, 'clients': self.clients}
+
+
+class NetworkAggregates(object):
+    """Online gateways, online nodes and their clients, plus the number of
+    online nodes per firmware_release, hardware, branch and autoupdate.
+
+    Gateways don't count as nodes and their clients aren't counted, the same
+    as in the old SQL queries.
+
+    If `partition` is given, it maps a row to the part of the network it
+    belongs to, e.g. its site, and every part is counted on its own as well.
+    A node whose part changes is moved from the old one to the new one.
+    """
+
+    def __init__(self, fields, partition=None):
+        self.partition = partition
+        self._all = _Counts()
+        # partition -> _Counts
+        self._parts = {}
+
+        self._online = fields.index('online')
+        self._gateway = fields.index('gateway')
+        self._clientcount = fields.index('clientcount')
+        self._breakdowns = [(name, fields.index(name)) for name in BREAKDOWNS]
+
+        self._lock = threading.Lock()
+
+    def load(self, table):
+        """Counts everything in `table` (a fflib.diff.NodeTable) from scratch."""
+        with self._lock:
+            self._all = _Counts()
+            self._parts = {}
+
+            for row in table.rows.values():
+                self._account(row, 1)
+
+    def apply(self, changeset):
+        """Takes the nodes of a fflib.diff.Changeset into account."""
+        with self._lock:
+            for old, new in changeset.changed.values():
+                if old is not None:
+                    self._account(old, -1)
+                self._account(new, 1)
+
+    def totals(self, part=None):
+        """Returns the totals the highscores are kept for, of the whole
+        network or of one `part`."""
+        with self._lock:
+            return self._counts(part).totals()
+
+    def breakdown(self, name, part=None):
+        """Returns a copy of the counts for one of BREAKDOWNS."""
+        with self._lock:
+            return dict(self._counts(part).breakdowns[name])
+
+    def _counts(self, part):
+        if part is None:
+            return self._all
+
+        return self._parts.get(part) or _Counts()
+
+    def _account(self, row, sign):
+        if not row[self._online]:
+            return
+
+        counts = [self._all]
+        if self.partition is not None:
+            part = self.partition(row)
+            if part not in self._parts:
+                self._parts[part] = _Counts()
+            counts.append(self._parts[part])
+
+        for count in counts:
+            if row[self._gateway]:
+                count.gateways += sign
+                continue
+
+            count.nodes += sign
+            count.clients += sign * (row[self._clientcount] or 0)
+
+            for name, i in self._breakdowns:
+                counter = count.breakdowns[name]
+                counter[row[i]] += sign
+                if not counter[row[i]]:
+                    del counter[row[i]]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Events of ff-nodeinfo for the other modules, which subscribe to the
+kinds they want:
+
+    bus.get().subscribe('ff-twitter', tweet, kinds=(bus.HighscoreReached,))
+    bus.get().publish(bus.HighscoreReached('ffka', 'nodes', 1234, datetime.datetime.now()))
+
+publish() never waits for a subscriber. Every subscription has a queue of
+its own and a thread that hands it the events one by one, in the order they
+were published. A subscriber that falls `limit` events behind loses the
+oldest ones, they are counted as dropped in the 'bus' stats.
+
+The bus is kept across module reloads, subscribing again under the same
+name replaces the old subscription.
+"""
+
+import datetime
+import threading
+import traceback
+from collections import deque, namedtuple
+
+from . import stats
+
+# site is the name of the fflib.sites.Site, name that of the highscore as in
+# the highscores table, e.g. ka/nodes if the bot serves several sites
+HighscoreReached = namedtuple('HighscoreReached', ['site', 'name', 'count', 'date'])
+# node is a dict of the node's column values
+NodeAppeared = namedtuple('NodeAppeared', ['site', 'node'])
+# event is the fflib.outage event, sites the names of the sites it hit
+OutageChanged = namedtuple('OutageChanged', ['sites', 'event'])
+
+# events a subscriber may fall behind by default
+LIMIT = 100
+
+
+class Subscription(object):
+    """Hands the events of `kinds`, all if empty, to `callback` on a thread
+    of its own."""
+
+    def __init__(self, name, callback, kinds=(), limit=LIMIT):
+        self.name = name
+        self.callback = callback
+        self.kinds = tuple(kinds)
+        self.limit = limit
+
+        # counters, for the stats
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, name='ff bus ' + name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wants(self, event):
+        return not self.kinds or isinstance(event, self.kinds)
+
+    def put(self, event):
+        """Queues `event`, dropping the oldest one if the queue is full.
+        Returns False if one was dropped."""
+        with self._condition:
+            full = len(self._queue) >= self.limit
+            if full:
+                self._queue.popleft()
+                self.dropped += 1
+
+            self._queue.append(event)
+            self._condition.notify()
+
+        return not full
+
+    def depth(self):
+        with self._condition:
+            return len(self._queue)
+
+    def stop(self, timeout=None):
+        """Stops the thread once the event it is handing over is done, the
+        ones still queued are dropped."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+
+                if self._stopped:
+                    return
+
+                event = self._queue.popleft()
+
+            try:
+                self.callback(event)
+                self.delivered += 1
+            except Exception:
+                self.failed += 1
+                print('{}: {} failed on {}'.format(str(datetime.datetime.now()), self.name, type(event).__name__))
+                traceback.print_exc()
+
+
+class Bus(object):
+    """Subscriptions by name, see the module docstring."""
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.stats = stats.get('bus')
+        self.stats.gauge('subscribers', lambda: dict(
+            (name, {'depth': subscription.depth(), 'delivered': subscription.delivered,
+                    'dropped': subscription.dropped, 'failed': subscription.failed})
+            for name, subscription in list(self.subscriptions.items())))
+
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, callback, kinds=(), limit=LIMIT):
+        """Calls `callback(event)` for every event of `kinds` published
+        from now on. Returns the Subscription."""
+        subscription = Subscription(name, callback, kinds, limit)
+
+        with self._lock:
+            old = self.subscriptions.get(name)
+            self.subscriptions[name] = subscription
+
+        if old is not None:
+            old.stop()
+
+        return subscription
+
+    def unsubscribe(self, name, timeout=None):
+        with self._lock:
+            subscription = self.subscriptions.pop(name, None)
+
+        if subscription is not None:
+            subscription.stop(timeout)
+
+    def publish(self, event):
+        """Queues `event` for every subscriber of its kind, never blocks on
+        them."""
+        self.stats.count('published')
+
+        with self._lock:
+            subscriptions = [subscription for subscription in self.subscriptions.values()
+                             if subscription.wants(event)]
+
+        for subscription in subscriptions:
+            if not subscription.put(event):
+                self.stats.count('dropped')
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get():
+    """Returns the Bus all modules share."""
+    global _bus
+
+    with _bus_lock:
+        if _bus is None:
+            _bus = Bus()
+
+        return _bus
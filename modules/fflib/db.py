@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Database helpers shared by the ff-* modules: bulk reads and writes of
+whole tables and a statement counter."""
+
+import sqlalchemy
+from sqlalchemy import bindparam, event
+
+# select() takes the columns as a list up to SQLAlchemy 1.3, one by one from 2.0
+_SELECT_LIST = tuple(int(part) for part in sqlalchemy.__version__.split('.')[:2]) < (1, 4)
+
+
+def select(*columns):
+    """sqlalchemy.select() of `columns`, on every SQLAlchemy from 1.3 on."""
+    return sqlalchemy.select(list(columns)) if _SELECT_LIST else sqlalchemy.select(*columns)
+
+
+def load_rows(connection, table):
+    """Returns every row of `table` as a dict, with one SELECT."""
+    columns = [column.name for column in table.columns]
+
+    return [dict(zip(columns, row)) for row in connection.execute(table.select())]
+
+
+def write_rows(connection, table, inserts, updates):
+    """Writes `inserts` (row dicts) and `updates` ((primary key, row dict)
+    pairs) to `table`.
+
+    Rows are grouped by the columns they set and every group is sent as one
+    executemany, so the number of statements doesn't grow with the rows.
+    """
+    key = list(table.primary_key.columns)[0]
+
+    for rows in _group_by_columns(inserts):
+        connection.execute(table.insert(), rows)
+
+    updates = [dict(values, b_key=pk) for pk, values in updates]
+    for rows in _group_by_columns(updates):
+        connection.execute(table.update().where(key == bindparam('b_key')), rows)
+
+
+def _group_by_columns(rows):
+    groups = {}
+
+    for row in rows:
+        groups.setdefault(frozenset(row), []).append(row)
+
+    return groups.values()
+
+
+class StatementCounter(object):
+    """Counts the statements an engine sends to the database.
+
+        with StatementCounter(engine) as counter:
+            fetch(bot)
+        print(counter.count)
+
+    An executemany() is one statement, no matter how many rows it carries.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Change detection between two polls.
+
+NodeTable remembers the last known state of every node as one tuple of field
+values per node_id. A Changeset is fed the entries of the next poll and only
+keeps the nodes whose tuple differs, so an unchanged node costs a single
+tuple comparison. The changeset turns those nodes into typed events the
+modules render their announcements from.
+"""
+
+from collections import namedtuple
+
+from .geo import calc_distance
+
+# `node` is always a dict of the node's new field values
+NodeAdded = namedtuple('NodeAdded', ['node'])
+NodeOnline = namedtuple('NodeOnline', ['node', 'online'])
+# distance is None if the node didn't have a position before or has none now
+NodeMoved = namedtuple('NodeMoved', ['node', 'old_lat', 'old_lon', 'distance'])
+FieldChanged = namedtuple('FieldChanged', ['node', 'field', 'old', 'new'])
+
+
+class NodeTable(object):
+    """Last known field values of every node, keyed by node_id."""
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.empty = (None,) * len(self.fields)
+        self.rows = {}
+        # node_ids of all nodes that are online, so nodes that vanished from
+        # a poll can be found with a set difference
+        self.online = set()
+
+        self._online = self.fields.index('online')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, node_id):
+        return node_id in self.rows
+
+    def load(self, rows):
+        """Fills the table from dicts of field values, e.g. database rows."""
+        for values in rows:
+            self._set(values['node_id'], tuple(map(values.get, self.fields)))
+
+    def get(self, node_id):
+        row = self.rows.get(node_id)
+
+        if row is None:
+            return None
+
+        return dict(zip(self.fields, row))
+
+    def changeset(self):
+        return Changeset(self)
+
+    def apply(self, changeset):
+        """Takes over the new state of every node in `changeset`."""
+        for node_id, (old, new) in changeset.changed.items():
+            self._set(node_id, new)
+
+    def _set(self, node_id, row):
+        self.rows[node_id] = row
+
+        if row[self._online]:
+            self.online.add(node_id)
+        else:
+            self.online.discard(node_id)
+
+
+class Changeset(object):
+    """The difference between a NodeTable and the poll fed into add()."""
+
+    def __init__(self, table):
+        self.table = table
+        self.seen = set()
+        self.changed = {}
+
+    def add(self, node_id, values):
+        """Records the state of `node_id` in this poll.
+
+        Fields missing from `values` keep their previous value, so adding
+        the same node twice merges both sets of values.
+        """
+        old = self.table.rows.get(node_id)
+
+        if node_id in self.changed:
+            base = self.changed[node_id][1]
+        else:
+            base = old or self.table.empty
+
+        new = tuple(map(values.get, self.table.fields, base))
+
+        self.seen.add(node_id)
+
+        if new != old:
+            self.changed[node_id] = (old, new)
+        elif node_id in self.changed:
+            del self.changed[node_id]
+
+    def rows(self, volatile=()):
+        """Returns the changed nodes that have to be written.
+
+        The result is a list of (old, new) dicts, `old` is None for nodes
+        the table didn't know yet, and the set of node_ids left out because
+        only their `volatile` fields changed.
+        """
+        fields = self.table.fields
+        volatile = [i for i, field in enumerate(fields) if field in volatile]
+
+        rows = []
+        deferred = set()
+
+        for node_id, (old, new) in self.changed.items():
+            if old is not None and volatile and \
+                    all(old[i] == new[i] for i in range(len(fields)) if i not in volatile):
+                deferred.add(node_id)
+                continue
+
+            rows.append(((dict(zip(fields, old)) if old is not None else None), dict(zip(fields, new))))
+
+        return rows, deferred
+
+    def events(self, ignore=()):
+        """Returns the events for all changed nodes, leaving out changes of
+        the fields in `ignore`."""
+        fields = self.table.fields
+        lat = fields.index('lat')
+        lon = fields.index('lon')
+
+        events = []
+
+        for old, new in self.changed.values():
+            node = dict(zip(fields, new))
+
+            if old is None:
+                events.append(NodeAdded(node))
+                continue
+
+            location_updated = False
+
+            for i, field in enumerate(fields):
+                if old[i] == new[i] or field in ignore:
+                    continue
+
+                if field == 'online':
+                    events.append(NodeOnline(node, new[i]))
+                elif field == 'lat' or field == 'lon':
+                    if not location_updated:
+                        location_updated = True
+
+                        if old[lat] and old[lon] and new[lat] and new[lon]:
+                            distance = calc_distance(old[lat], old[lon], new[lat], new[lon])
+                        else:
+                            distance = None
+
+                        events.append(NodeMoved(node, old[lat], old[lon], distance))
+                else:
+                    events.append(FieldChanged(node, field, old[i], new[i]))
+
+        return events
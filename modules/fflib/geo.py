@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Geographic helpers.
+
+distances() computes many distances at once, with NumPy if it is installed
+and a plain loop otherwise.
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# in meters, the same calc_distance uses
+EARTH_RADIUS = 6378137
+
+# below this many positions the loop is faster than building arrays
+VECTORIZE_MIN = 64
+
+
+def calc_distance(lat1, long1, lat2, long2):
+    if not (lat1 and lat2 and long1 and long2):
+        return 0
+
+    # http://www.johndcook.com/blog/python_longitude_latitude/
+    degrees_to_radians = math.pi/180.0
+
+    phi1 = (90.0 - lat1)*degrees_to_radians
+    phi2 = (90.0 - lat2)*degrees_to_radians
+
+    theta1 = long1*degrees_to_radians
+    theta2 = long2*degrees_to_radians
+
+    cos = (math.sin(phi1)*math.sin(phi2)*math.cos(theta1 - theta2) +
+           math.cos(phi1)*math.cos(phi2))
+    # rounding can push identical positions slightly above 1
+    arc = math.acos(min(1.0, cos))
+
+    return arc * EARTH_RADIUS
+
+
+def haversine(lat1, long1, lat2, long2):
+    """Returns the distance in meters between two positions in degrees."""
+    lat1, long1, lat2, long2 = map(math.radians, (lat1, long1, lat2, long2))
+
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distances(lat, long, lats, longs):
+    """Returns the distances in meters from `lat`, `long` to each of the
+    positions `lats`, `longs` as a list, the same as haversine() would."""
+    if numpy is None or len(lats) < VECTORIZE_MIN:
+        return [haversine(lat, long, lat2, long2) for lat2, long2 in zip(lats, longs)]
+
+    lat1 = math.radians(lat)
+    lats = numpy.radians(numpy.asarray(lats, dtype=float))
+    longs = numpy.radians(numpy.asarray(longs, dtype=float))
+
+    a = numpy.sin((lats - lat1) / 2) ** 2 + \
+        math.cos(lat1) * numpy.cos(lats) * numpy.sin((longs - math.radians(long)) / 2) ** 2
+
+    return (2 * EARTH_RADIUS * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))).tolist()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Client count and online history of every node.
+
+The nodes table only knows the latest clientcount of a node. NodeHistory
+keeps its course in the node_history table at three resolutions:
+
+    RAW            every change as it was polled, kept for 48 hours
+    FIVE_MINUTES   min, max and time weighted average per 5 minutes, 30 days
+    HOURLY         the same per hour, kept for a year by default
+
+Only changes are stored. A sample holds from its time until the next sample
+of the same node and resolution, so a node that keeps its 3 clients all day
+costs a single row. The rollups are built in memory while the changes come
+in, with work only for the nodes that changed.
+"""
+
+import threading
+from collections import namedtuple
+
+from sqlalchemy import Column, Float, Index, Integer, String, and_
+from sqlalchemy.ext.declarative import declarative_base
+
+from . import db
+
+RAW, FIVE_MINUTES, HOURLY = 0, 300, 3600
+
+# seconds the samples of every resolution are kept
+RETENTION = {RAW: 48 * 3600, FIVE_MINUTES: 30 * 86400, HOURLY: 365 * 86400}
+
+SPARKS = u'▁▂▃▄▅▆▇█'
+
+Base = declarative_base()
+
+HistorySummary = namedtuple('HistorySummary', ['min', 'max', 'avg', 'online', 'values', 'resolution'])
+
+
+class Sample(Base):
+    __tablename__ = 'node_history'
+    # one node's samples are stored next to each other, ordered by time
+    __table_args__ = (Index('ix_node_history_resolution_time', 'resolution', 'time'),
+                      {'sqlite_with_rowid': False})
+
+    node_id = Column(String, primary_key=True)
+    resolution = Column(Integer, primary_key=True, autoincrement=False)
+    # unix time
+    time = Column(Integer, primary_key=True, autoincrement=False)
+    min = Column(Integer)
+    max = Column(Integer)
+    avg = Column(Float)
+    # share of the time the node was online, 0 to 1
+    online = Column(Float)
+
+
+class _Bucket(object):
+    """Time weighted statistics of one node within one rollup interval."""
+
+    __slots__ = ('start', 'since', 'value', 'online', 'min', 'max', 'sum', 'online_sum', 'changed')
+
+    def __init__(self, start, value, online):
+        self.start = self.since = start
+        self.value = value
+        self.online = online
+        self.min = self.max = value
+        self.sum = self.online_sum = 0.0
+        self.changed = False
+
+    def add(self, now, value, online):
+        self._advance(now)
+        self.value = value
+        self.online = online
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.changed = True
+
+    def close(self, end):
+        self._advance(end)
+        length = float(end - self.start)
+
+        return self.min, self.max, self.sum / length, self.online_sum / length
+
+    def _advance(self, now):
+        self.sum += self.value * (now - self.since)
+        self.online_sum += self.online * (now - self.since)
+        self.since = now
+
+
+class _Rollup(object):
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        # end of the current interval
+        self.end = None
+        # node_id -> _Bucket, only for nodes that changed in this or the
+        # last interval, all others repeat their last sample
+        self.buckets = {}
+        # node_id -> last stored (min, max, avg, online)
+        self.last = {}
+
+
+class NodeHistory(object):
+    """Records the clientcount and online changes of fflib.diff.Changesets
+    with the fields of `fields`. `retention` overrides RETENTION."""
+
+    def __init__(self, fields, retention=None):
+        self.retention = dict(RETENTION)
+        self.retention.update(retention or {})
+
+        self._clientcount = fields.index('clientcount')
+        self._online = fields.index('online')
+
+        self._rollups = [_Rollup(FIVE_MINUTES), _Rollup(HOURLY)]
+        self._pending = []
+        self._cleaned = 0
+        self._lock = threading.Lock()
+
+    def record(self, changeset, now):
+        """Takes the changes of `changeset`, polled at `now` (unix time)."""
+        now = int(now)
+
+        with self._lock:
+            for rollup in self._rollups:
+                self._close(rollup, now)
+
+            for node_id, (old, new) in changeset.changed.items():
+                value = (new[self._clientcount] or 0, 1 if new[self._online] else 0)
+                previous = (old[self._clientcount] or 0, 1 if old[self._online] else 0) if old is not None else None
+
+                if value == previous:
+                    continue
+
+                self._pending.append(self._row(node_id, RAW, now, (value[0], value[0], value[0], value[1])))
+
+                for rollup in self._rollups:
+                    bucket = rollup.buckets.get(node_id)
+
+                    if bucket is None:
+                        if previous is not None:
+                            # unchanged since before this interval started
+                            bucket = _Bucket(now - now % rollup.resolution, *previous)
+                        else:
+                            bucket = _Bucket(now, *value)
+                        rollup.buckets[node_id] = bucket
+
+                    bucket.add(now, *value)
+
+    def flush(self, connection, now):
+        """Writes the samples recorded since the last flush and, once an hour,
+        deletes the samples older than their retention."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+
+        table = Sample.__table__
+
+        if rows:
+            # a restart within an interval stores its rollup again
+            connection.execute(table.insert().prefix_with('OR REPLACE'), rows)
+
+        if now - self._cleaned >= 3600:
+            self._cleaned = now
+
+            for resolution, seconds in sorted(self.retention.items()):
+                connection.execute(table.delete().where(
+                    and_(table.c.resolution == resolution, table.c.time < now - seconds)))
+
+    def query(self, connection, node_id, start, end, buckets=48):
+        """Returns a HistorySummary of `node_id` between the unix times
+        `start` and `end`, with `values` holding the average clientcount of
+        `buckets` equal parts of that time. Returns None without data."""
+        # the coarsest resolution still finer than a bucket, as long as it is
+        # kept that long
+        resolutions = [RAW, FIVE_MINUTES, HOURLY]
+        usable = [resolution for resolution in resolutions
+                  if start >= end - self.retention[resolution]] or [HOURLY]
+        resolution = max([resolution for resolution in usable
+                          if resolution <= (end - start) / buckets] or usable[:1])
+
+        # the interval that is still open only has raw samples yet
+        covered = end
+        for rollup in self._rollups:
+            if rollup.resolution == resolution:
+                covered = min(end, max(start, rollup.end - resolution if rollup.end else 0))
+
+        rows = self._rows(connection, node_id, resolution, start, covered) if covered > start else []
+        if covered < end:
+            rows += self._rows(connection, node_id, RAW, covered, end)
+
+        if not rows:
+            return None
+
+        return self._summarize(rows, start, end, buckets, resolution)
+
+    def _rows(self, connection, node_id, resolution, start, end):
+        table = Sample.__table__
+        columns = [table.c.time, table.c.min, table.c.max, table.c.avg, table.c.online]
+
+        rows = connection.execute(db.select(*columns).where(and_(
+            table.c.node_id == node_id, table.c.resolution == resolution,
+            table.c.time >= start, table.c.time < end)).order_by(table.c.time)).fetchall()
+
+        # the sample holding at `start`, if the last one of this resolution
+        # is already deleted a coarser one has to do
+        for coarser in (RAW, FIVE_MINUTES, HOURLY):
+            if coarser < resolution:
+                continue
+
+            first = connection.execute(db.select(*columns).where(and_(
+                table.c.node_id == node_id, table.c.resolution == coarser,
+                table.c.time < start)).order_by(table.c.time.desc()).limit(1)).first()
+
+            if first is not None:
+                rows.insert(0, (start,) + tuple(first[1:]))
+                break
+
+        return rows
+
+    @staticmethod
+    def _summarize(rows, start, end, buckets, resolution):
+        width = float(end - start) / buckets
+        sums = [0.0] * buckets
+        durations = [0.0] * buckets
+
+        total = online = duration = 0.0
+        lowest = highest = None
+
+        for i, (since, low, high, avg, share) in enumerate(rows):
+            until = rows[i + 1][0] if i + 1 < len(rows) else end
+
+            if until <= since:
+                continue
+
+            lowest = low if lowest is None else min(lowest, low)
+            highest = high if highest is None else max(highest, high)
+            total += avg * (until - since)
+            online += share * (until - since)
+            duration += until - since
+
+            # spread the sample over the buckets it covers
+            t = since
+            while t < until:
+                bucket = min(buckets - 1, int((t - start) / width))
+                bucket_end = until if bucket == buckets - 1 else min(until, start + (bucket + 1) * width)
+                if bucket_end <= t:
+                    bucket_end = until
+
+                sums[bucket] += avg * (bucket_end - t)
+                durations[bucket] += bucket_end - t
+                t = bucket_end
+
+        if not duration:
+            return None
+
+        values = [(sums[i] / durations[i]) if durations[i] else None for i in range(buckets)]
+
+        return HistorySummary(lowest, highest, total / duration, online / duration, values, resolution)
+
+    def _close(self, rollup, now):
+        if rollup.end is None:
+            rollup.end = now - now % rollup.resolution + rollup.resolution
+
+        while now >= rollup.end:
+            end = rollup.end
+
+            for node_id, bucket in list(rollup.buckets.items()):
+                stats = bucket.close(end)
+
+                if rollup.last.get(node_id) != stats:
+                    rollup.last[node_id] = stats
+                    self._pending.append(self._row(node_id, rollup.resolution, end - rollup.resolution, stats))
+
+                if bucket.changed:
+                    # the next interval may still differ from this one
+                    rollup.buckets[node_id] = _Bucket(end, bucket.value, bucket.online)
+                else:
+                    del rollup.buckets[node_id]
+
+            rollup.end += rollup.resolution
+
+    @staticmethod
+    def _row(node_id, resolution, when, stats):
+        return {'node_id': node_id, 'resolution': resolution, 'time': when,
+                'min': stats[0], 'max': stats[1], 'avg': stats[2], 'online': stats[3]}
+
+
+def sparkline(values):
+    """Renders `values` as a line of block characters, None as a space."""
+    top = max([value for value in values if value is not None] or [0])
+
+    return u''.join(u' ' if value is None else SPARKS[int(round(value / top * (len(SPARKS) - 1))) if top else 0]
+                    for value in values)
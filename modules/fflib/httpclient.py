@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""HTTP client for the upstream JSON files.
+
+HttpClient keeps one requests.Session, so connections to the map server are
+reused between polls instead of doing a TCP and TLS handshake every 30
+seconds. It asks for compressed transfer, sends the ETag and Last-Modified
+of the last good response back as If-None-Match / If-Modified-Since and uses
+separate connect and read timeouts.
+
+Every request gets a `timing` dict:
+
+    dns, connect   seconds spent resolving and connecting (TCP + TLS), both
+                   0 when a pooled connection was reused
+    ttfb           seconds from sending the request to the response headers
+    transfer       seconds spent reading the body
+    bytes          size of the decoded body
+    wire_bytes     bytes actually received, before decompression
+"""
+
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib3 import connection, connectionpool
+except ImportError:
+    from requests.packages.urllib3 import connection, connectionpool
+
+try:
+    import brotli  # noqa: F401, urllib3 decodes br if this is importable
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+CHUNK_SIZE = 64 * 1024
+
+# the timing dict of the request running in this thread, filled in by the
+# connection classes below
+_local = threading.local()
+
+
+def _record(key, seconds):
+    timing = getattr(_local, 'timing', None)
+
+    if timing is not None:
+        timing[key] += seconds
+
+
+class _TimedConnectionMixin(object):
+
+    def _new_conn(self):
+        host = self._dns_host
+
+        start = time.time()
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except socket.error:
+            # urllib3 will fail the same way and raise its usual error
+            address = None
+        _record('dns', time.time() - start)
+
+        if address is None:
+            return super(_TimedConnectionMixin, self)._new_conn()
+
+        # connect to the address we just resolved, the TLS handshake still
+        # uses self.host once this method returned
+        self._dns_host = address
+        try:
+            return super(_TimedConnectionMixin, self)._new_conn()
+        except Exception:
+            # the first address didn't work, let urllib3 try all of them
+            self._dns_host = host
+            return super(_TimedConnectionMixin, self)._new_conn()
+        finally:
+            self._dns_host = host
+
+    def connect(self):
+        timing = getattr(_local, 'timing', None)
+        dns = timing['dns'] if timing is not None else 0
+
+        start = time.time()
+        super(_TimedConnectionMixin, self).connect()
+
+        if timing is not None:
+            _record('connect', time.time() - start - (timing['dns'] - dns))
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, connection.HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, connection.HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_TimedAdapter, self).init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class HttpClient(object):
+    """Conditional, pooled GET requests.
+
+    `validators` maps URLs to their last (ETag, Last-Modified) pair. Pass a
+    dict from bot.memory to keep them across module reloads.
+    """
+
+    def __init__(self, user_agent='ff-irc-bot', connect_timeout=3.05, read_timeout=10,
+                 validators=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.validators = validators if validators is not None else {}
+        # url -> timing dict of the last request
+        self.timings = {}
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': user_agent,
+            'Accept-Encoding': ACCEPT_ENCODING,
+        })
+
+        adapter = _TimedAdapter()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url):
+        """Starts a GET request for `url` and returns once the headers are in.
+
+        The body has to be read with iter_content() or read(), or dropped
+        with release(). A 304 status means nothing changed since the
+        response last passed to remember(). requests' exceptions are passed
+        on.
+        """
+        headers = {}
+
+        etag, last_modified = self.validators.get(url, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        timing = {'dns': 0.0, 'connect': 0.0, 'ttfb': 0.0, 'transfer': 0.0, 'bytes': 0, 'wire_bytes': 0}
+        self.timings[url] = timing
+
+        _local.timing = timing
+        start = time.time()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        finally:
+            _local.timing = None
+
+        timing['ttfb'] = max(0.0, time.time() - start - timing['dns'] - timing['connect'])
+        response.timing = timing
+
+        return response
+
+    def iter_content(self, response, chunk_size=CHUNK_SIZE):
+        """Yields the decoded body of `response` in chunks and closes it."""
+        timing = response.timing
+
+        start = time.time()
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                timing['bytes'] += len(chunk)
+                yield chunk
+        finally:
+            timing['transfer'] = time.time() - start
+            if hasattr(response.raw, 'tell'):
+                timing['wire_bytes'] = response.raw.tell()
+            response.close()
+
+    def read(self, response):
+        """Returns the whole decoded body of `response`."""
+        return b''.join(self.iter_content(response))
+
+    def release(self, response):
+        """Closes `response` without using its body, e.g. a 304. What is
+        left of the body is read first, closing it unread would close the
+        pooled connection as well."""
+        try:
+            for _ in response.iter_content(chunk_size=CHUNK_SIZE):
+                pass
+        except requests.exceptions.RequestException:
+            pass
+        finally:
+            response.close()
+
+    def remember(self, url, response):
+        """Stores the validators of `response`, call it once its content was
+        processed successfully."""
+        self.validators[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Merges the nodes of all fflib.sources into one fflib.diff.NodeTable,
+polling every source on a thread of its own:
+
+    pipeline = ingest.Ingest(nodes_table, [MeshviewerSource(...), AlfredSource(...)])
+    changes, errors = pipeline.poll()
+
+A node known to several sources is merged field by field. Every field comes
+from the fresh source with a value for it whose Source.priority_of() that
+field is highest. A node is online if any fresh source has it online, and
+its clientcount comes from the first of those. A node no fresh source knows
+is offline.
+
+Only the nodes a source reports as changed are merged again, plus all nodes
+of a source that became stale or fresh.
+"""
+
+import threading
+import time
+
+from .sources import SourceError
+
+
+class Ingest(object):
+    """Polls `sources` and merges them into changesets of `table`."""
+
+    def __init__(self, table, sources):
+        self.table = table
+        self.sources = list(sources)
+        # source name -> field -> index in its tuples
+        self._index = dict((source.name, dict((field, i) for i, field in enumerate(source.fields)))
+                           for source in self.sources)
+        # field -> the sources providing it, by priority
+        self._order = {}
+        for source in self.sources:
+            for field in source.fields:
+                self._order.setdefault(field, []).append(source)
+        for field, order in self._order.items():
+            order.sort(key=lambda source: -source.priority_of(field))
+        self._by_priority = sorted(self.sources, key=lambda source: -source.priority)
+        # names of the sources that were fresh after the last poll
+        self._fresh = set()
+        # the table may still have nodes online no source knows, e.g. after a crash
+        self._checked = False
+
+    def poll(self):
+        """Polls all sources at once. Returns the changeset of the merged
+        nodes, or None if nothing changed, and the SourceErrors of the
+        sources that failed."""
+        results = {}
+
+        def run(source):
+            try:
+                results[source.name] = source.poll()
+            except SourceError as e:
+                results[source.name] = e
+
+        threads = [threading.Thread(target=run, args=(source,), name='ff poll ' + source.name)
+                   for source in self.sources]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        errors = [result for result in results.values() if isinstance(result, SourceError)]
+
+        changed = set()
+        for result in results.values():
+            if isinstance(result, set):
+                changed |= result
+
+        now = time.time()
+        fresh = [source for source in self._by_priority if source.fresh(now)]
+        names = set(source.name for source in fresh)
+
+        # what a source knows only counts while it is fresh
+        for source in self.sources:
+            if (source.name in names) != (source.name in self._fresh):
+                changed.update(source.nodes)
+
+        self._fresh = names
+
+        if fresh and not self._checked:
+            changed.update(self.table.online)
+            self._checked = True
+
+        if not changed:
+            return None, errors
+
+        changes = self.table.changeset()
+
+        for node_id in changed:
+            values = self.merge(node_id, fresh)
+
+            if values is not None:
+                changes.add(node_id, values)
+            elif node_id in self.table.online:
+                changes.add(node_id, {'online': False, 'clientcount': 0})
+
+        return changes, errors
+
+    def merge(self, node_id, fresh):
+        """Returns the column values of `node_id` merged from the `fresh`
+        sources, None if none of them knows it."""
+        rows = dict((source.name, source.nodes[node_id]) for source in fresh if node_id in source.nodes)
+
+        if not rows:
+            return None
+
+        if len(rows) == 1:
+            # the common case, nothing to merge
+            source = next(source for source in fresh if source.name in rows)
+            values = dict(zip(source.fields, rows[source.name]))
+            values['source'] = source.name
+            if not values['online']:
+                values['clientcount'] = 0
+            return values
+
+        values = {'source': next(source.name for source in fresh if source.name in rows)}
+
+        for field, order in self._order.items():
+            value = None
+            for source in order:
+                row = rows.get(source.name)
+                if row is not None and row[self._index[source.name][field]] is not None:
+                    value = row[self._index[source.name][field]]
+                    break
+            values[field] = value
+
+        values['online'] = False
+        values['clientcount'] = 0
+
+        for source in self._order['clientcount']:
+            row = rows.get(source.name)
+            if row is not None and row[self._index[source.name]['online']]:
+                values['online'] = True
+                values['clientcount'] = row[self._index[source.name]['clientcount']] or 0
+                break
+
+        return values
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Prometheus metrics of the mesh, on http://metrics_host:metrics_port/metrics,
+rendered from a snapshot fetch() updates after every poll.
+
+    exporter = metrics.get('127.0.0.1', 9120)
+    exporter.update(None, totals=network_stats.totals(), last_success=time.time())
+    exporter.update('nodes.json', last_success=source.fetched, error=source.error)
+
+The snapshot of source None is the merged mesh and rendered without a
+source label, the others are those of the single sources. With several
+sites, each of them has a snapshot of its own under site_key(), rendered
+with a site label instead. The server is kept across module reloads.
+"""
+
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (name, type, help) of every metric, in the order they are rendered
+METRICS = (
+    ('ff_nodes_online', 'gauge', 'Nodes online, without gateways'),
+    ('ff_gateways_online', 'gauge', 'Gateways online'),
+    ('ff_clients_online', 'gauge', 'Clients on the nodes online'),
+    ('ff_nodes_online_by_firmware_release', 'gauge', 'Nodes online per firmware release'),
+    ('ff_nodes_online_by_hardware', 'gauge', 'Nodes online per hardware model'),
+    ('ff_nodes_online_by_branch', 'gauge', 'Nodes online per autoupdater branch'),
+    ('ff_nodes_online_by_autoupdate', 'gauge', 'Nodes online with the autoupdater on or off'),
+    ('ff_highscore', 'gauge', 'Highest count seen'),
+    ('ff_highscore_timestamp_seconds', 'gauge', 'When the highscore was reached'),
+    ('ff_fetch_last_success_timestamp_seconds', 'gauge', 'End of the last successful poll'),
+    ('ff_fetch_last_success_age_seconds', 'gauge', 'Seconds since the last successful poll'),
+    ('ff_fetch_error', 'gauge', '1 while the last poll failed'),
+    ('ff_fetch_events_total', 'counter', 'Poll events since the start, see .ffstats'),
+    ('ff_outbox_depth', 'gauge', 'Announcement lines waiting to be sent'),
+)
+
+
+def _label(value):
+    if value is None:
+        value = ''
+    elif value is True or value is False:
+        value = str(value).lower()
+
+    return u'{}'.format(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def site_key(name):
+    """Returns the key of the snapshot of the site `name`."""
+    return ('site', name)
+
+
+def _labels(key):
+    if key is None:
+        return {}
+    elif isinstance(key, tuple):
+        return {key[0]: key[1]}
+
+    return {'source': key}
+
+
+def render(snapshots, outbox_depth=None, now=None):
+    """Renders the snapshots of all sources and sites as Prometheus text format."""
+    now = time.time() if now is None else now
+    samples = dict((name, []) for name, _, _ in METRICS)
+
+    for key, snapshot in sorted(snapshots.items(), key=lambda item: sorted(_labels(item[0]).items())):
+        labels = _labels(key)
+
+        totals = snapshot.get('totals', {})
+        for name in ('nodes', 'gateways', 'clients'):
+            if name in totals:
+                samples['ff_{}_online'.format(name)].append((labels, totals[name]))
+
+        for field, counts in sorted(snapshot.get('breakdowns', {}).items()):
+            for value, count in sorted(counts.items(), key=lambda item: _label(item[0])):
+                samples['ff_nodes_online_by_' + field].append((dict(labels, **{field: value}), count))
+
+        for name, (count, reached) in sorted(snapshot.get('highscores', {}).items()):
+            samples['ff_highscore'].append((dict(labels, name=name), count))
+            if reached is not None:
+                samples['ff_highscore_timestamp_seconds'].append((dict(labels, name=name), reached))
+
+        last_success = snapshot.get('last_success')
+        if last_success is not None:
+            samples['ff_fetch_last_success_timestamp_seconds'].append((labels, last_success))
+            samples['ff_fetch_last_success_age_seconds'].append((labels, now - last_success))
+
+        if 'error' in snapshot or last_success is not None:
+            samples['ff_fetch_error'].append((labels, 1 if snapshot.get('error') else 0))
+
+        for event, count in sorted(snapshot.get('counters', {}).items()):
+            samples['ff_fetch_events_total'].append((dict(labels, event=event), count))
+
+    if outbox_depth is not None:
+        samples['ff_outbox_depth'].append(({}, outbox_depth))
+
+    lines = []
+
+    for name, kind, description in METRICS:
+        if not samples[name]:
+            continue
+
+        lines.append(u'# HELP {} {}'.format(name, description))
+        lines.append(u'# TYPE {} {}'.format(name, kind))
+
+        for labels, value in samples[name]:
+            label_text = u','.join(u'{}="{}"'.format(key, _label(labels[key])) for key in sorted(labels))
+            lines.append(u'{}{} {}'.format(name, u'{' + label_text + u'}' if label_text else u'', float(value)))
+
+    return (u'\n'.join(lines) + u'\n').encode('utf-8')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Exporter(object):
+    """Serves the published snapshots of all sources on `host`:`port`.
+    `outbox` is an optional fflib.outbox.Outbox whose queue is exported."""
+
+    def __init__(self, host, port, outbox=None):
+        self.outbox = outbox
+        # source -> dict of values, only ever replaced, never changed
+        self.snapshots = {}
+        self._lock = threading.Lock()
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = exporter.render()
+
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server((host, port), Handler)
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='ff metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def update(self, source, **values):
+        """Sets `values` in the snapshot of `source`, keeping the others."""
+        with self._lock:
+            snapshot = dict(self.snapshots.get(source, {}))
+            snapshot.update(values)
+            self.snapshots[source] = snapshot
+
+    def render(self):
+        with self._lock:
+            snapshots = dict(self.snapshots)
+
+        depth = sum(self.outbox.depth().values()) if self.outbox is not None else None
+
+        return render(snapshots, depth)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get(host=None, port=None, outbox=None):
+    """Returns the Exporter all modules share, starting it on `host`:`port`
+    the first time. Returns None as long as no port was given."""
+    global _exporter
+
+    with _exporter_lock:
+        if _exporter is None and port:
+            _exporter = Exporter(host or '127.0.0.1', int(port), outbox)
+
+        return _exporter
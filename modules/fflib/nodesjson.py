@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Incremental reader for meshviewer nodes.json, decoding one node at a
+time from a stream of chunks.
+
+sections() fingerprints the raw text of every node and of its nodeinfo, and
+whatever still has the fingerprint of the last poll is skipped without
+being decoded at all:
+
+    for node_id, data, fingerprints in parser.sections(previous.get):
+        if data is nodesjson.UNCHANGED:
+            ...
+"""
+
+import codecs
+import json
+import json.scanner
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+# the decoder's scanner, without raw_decode()'s wrapper around it; raises
+# StopIteration if there is no value at the index
+_scan = json.scanner.make_scanner(_decoder)
+_whitespace = ' \t\n\r'
+_skip_whitespace = re.compile(r'[ \t\n\r]*').match
+_delimiters = _whitespace + ',:]}'
+_hash_mask = (1 << 64) - 1
+
+
+def _after_whitespace(buf, pos):
+    # most of the time there is none or a single space, cheaper to check by hand
+    if buf[pos] not in _whitespace:
+        return pos
+    if buf[pos + 1] not in _whitespace:
+        return pos + 1
+    return _skip_whitespace(buf, pos).end()
+
+
+class _Unchanged(object):
+    def __repr__(self):
+        return 'UNCHANGED'
+
+# stands in for what sections() skipped
+UNCHANGED = _Unchanged()
+
+
+def fingerprint(raw):
+    """Returns the fingerprint of the raw JSON text `raw`, its length and
+    hash in one int. Only valid within one process."""
+    return len(raw) << 64 | hash(raw) & _hash_mask
+
+
+class NodesParser(object):
+    """Yields (node_id, data) for every entry of the 'nodes' object.
+
+    `chunks` is any iterable of bytes (or str), e.g. requests'
+    Response.iter_content(). Top level keys other than 'nodes' (timestamp,
+    version, ...) are collected in `meta`. Malformed or truncated input
+    raises ValueError while iterating.
+    """
+
+    def __init__(self, chunks, key='nodes'):
+        self.key = key
+        self.meta = {}
+
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        self._expect('{')
+
+        for key in self._members():
+            if key == self.key:
+                self._expect('{')
+
+                for node_id in self._members():
+                    yield node_id, self._value()
+            else:
+                self.meta[key] = self._value()
+
+    def sections(self, known):
+        """Like iterating, but skips what didn't change since the last poll.
+
+        Yields (node_id, data, fingerprints) with `fingerprints` being the
+        fingerprint() of the node's raw text and that of its nodeinfo.
+        `known(node_id)` returns the pair of the last poll, or None. If the
+        node's raw text still matches, it isn't decoded at all and `data` is
+        UNCHANGED. Otherwise, if only its nodeinfo still matches, that isn't
+        decoded and is UNCHANGED in `data`.
+        """
+        self._expect('{')
+
+        for key in self._members():
+            if key == self.key:
+                self._expect('{')
+
+                for node_id in self._members():
+                    data, fingerprints = self._node(known(node_id))
+                    yield node_id, data, fingerprints
+            else:
+                self.meta[key] = self._value()
+
+    def _node(self, previous):
+        # The node is scanned in one go from the buffer. If the buffer ends
+        # within it, the next chunk is added and the node scanned again,
+        # which happens for about one node per chunk.
+        while True:
+            try:
+                data, fingerprints, end = self._scan_node(previous)
+            except (ValueError, IndexError, StopIteration) as e:
+                if self._fill():
+                    continue
+                raise e if isinstance(e, ValueError) else ValueError('Unexpected end of input')
+
+            self._pos = end
+            return data, fingerprints
+
+    def _scan_node(self, previous):
+        buf = self._buf
+        start = pos = _after_whitespace(buf, self._pos)
+
+        # a value ending where the old one did, with the same fingerprint, is the old one
+        if previous is not None:
+            end = start + (previous[0] >> 64)
+            if end < len(buf) and buf[end] in _delimiters and fingerprint(buf[start:end]) == previous[0]:
+                return UNCHANGED, previous, end
+
+        if buf[pos] != '{':
+            raise ValueError("Expecting '{{' but found '{}'".format(buf[pos]))
+
+        data = {}
+        nodeinfo = None
+
+        pos = _after_whitespace(buf, pos + 1)
+        if buf[pos] == '}':
+            return data, (fingerprint(buf[start:pos + 1]), nodeinfo), pos + 1
+
+        while True:
+            member, pos = _scan(buf, pos)
+            if not isinstance(member, str):
+                raise ValueError('Expecting property name, found {!r}'.format(member))
+
+            pos = _after_whitespace(buf, pos)
+            if buf[pos] != ':':
+                raise ValueError("Expecting ':' but found '{}'".format(buf[pos]))
+            pos = _after_whitespace(buf, pos + 1)
+
+            if member == 'nodeinfo':
+                known = previous[1] if previous is not None else None
+                end = pos + (known >> 64) if known is not None else len(buf)
+
+                if end < len(buf) and buf[end] in _delimiters and fingerprint(buf[pos:end]) == known:
+                    data[member] = UNCHANGED
+                else:
+                    data[member], end = _scan(buf, pos)
+
+                nodeinfo = fingerprint(buf[pos:end])
+                pos = end
+            else:
+                data[member], pos = _scan(buf, pos)
+
+            pos = _after_whitespace(buf, pos)
+            found = buf[pos]
+
+            if found == '}':
+                return data, (fingerprint(buf[start:pos + 1]), nodeinfo), pos + 1
+
+            if found != ',':
+                raise ValueError("Expecting ',' or '}}' but found '{}'".format(found))
+
+            pos = _after_whitespace(buf, pos + 1)
+
+    def _fill(self):
+        if self._eof:
+            return False
+
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            chunk = b''
+
+        if isinstance(chunk, bytes):
+            chunk = self._utf8.decode(chunk, final=self._eof)
+
+        # drop everything we already consumed, the buffer only ever holds
+        # the entry currently being decoded plus one chunk
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+
+        return True
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _whitespace:
+                self._pos += 1
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+
+            if not self._fill():
+                raise ValueError('Unexpected end of input')
+
+    def _expect(self, char):
+        found = self._peek()
+
+        if found != char:
+            raise ValueError("Expecting '{}' but found '{}'".format(char, found))
+
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+
+            # a number cut off at the end of a chunk still decodes ('1.25'
+            # arriving as '1.'), so only trust values followed by a delimiter
+            if (end < len(self._buf) and self._buf[end] in _delimiters) or not self._fill():
+                self._pos = end
+                return value
+
+    def _members(self):
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            key = self._value()
+
+            if not isinstance(key, str):
+                raise ValueError('Expecting property name, found {!r}'.format(key))
+
+            self._expect(':')
+
+            yield key
+
+            found = self._peek()
+            self._pos += 1
+
+            if found == '}':
+                return
+
+            if found != ',':
+                raise ValueError("Expecting ',' or '}}' but found '{}'".format(found))
+
+
+class SiteFilter(object):
+    """Tells from a raw nodes.json entry whether the node belongs to us.
+
+    A node is accepted if its nodeinfo.system.site_code is one of
+    `site_codes` and, if `domain_codes` is given, its domain_code is one of
+    those. An empty list accepts every code. Runs before anything else is
+    done with the entry, so foreign nodes on a shared map are cheap.
+    """
+
+    def __init__(self, site_codes, domain_codes=()):
+        self.site_codes = frozenset(site_codes)
+        self.domain_codes = frozenset(domain_codes)
+
+    def __call__(self, data):
+        try:
+            system = data['nodeinfo']['system']
+        except (KeyError, TypeError):
+            return False
+
+        if self.site_codes and system.get('site_code') not in self.site_codes:
+            return False
+
+        if self.domain_codes and system.get('domain_code') not in self.domain_codes:
+            return False
+
+        return True
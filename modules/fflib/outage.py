@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Mass outages instead of hundreds of offline events.
+
+When a gateway or a whole segment goes down, the diff sees every node going
+offline on its own. OutageTracker looks at all nodes that went offline in
+one poll together. If they are a large share of the nodes that were online,
+or a gateway went down with them, they become one Outage with the number of
+nodes and the area they are in. Their offline events, and later their
+online events, are left out and the outage reports how many of them are
+back instead:
+
+    OutageStarted      a new outage
+    OutageRecovering   some of its nodes came back in this poll
+    OutageEnded        all of them are back, or the outage is too old to
+                       still wait for the rest
+
+Every poll only costs work for the nodes it changed.
+"""
+
+from collections import namedtuple
+
+from .geo import calc_distance
+
+OutageStarted = namedtuple('OutageStarted', ['outage'])
+# back is the number of nodes that came back in this poll
+OutageRecovering = namedtuple('OutageRecovering', ['outage', 'back'])
+# expired is True if the outage ended with nodes still missing
+OutageEnded = namedtuple('OutageEnded', ['outage', 'expired'])
+
+
+class Outage(object):
+    """Nodes that went offline together."""
+
+    def __init__(self, started, nodes, gateways, bbox):
+        # unix time
+        self.started = started
+        self.total = len(nodes)
+        # node_ids of all nodes that went offline
+        self.nodes = frozenset(nodes)
+        # node_ids of the nodes still offline
+        self.down = set(nodes)
+        # names of the gateways that went down with them
+        self.gateways = gateways
+        # (south, west, north, east) of the nodes with a position, or None
+        self.bbox = bbox
+
+    @property
+    def recovered(self):
+        return self.total - len(self.down)
+
+    def extent(self):
+        """Returns width and height of the bounding box in meters."""
+        if self.bbox is None:
+            return 0, 0
+
+        south, west, north, east = self.bbox
+        middle = (south + north) / 2
+
+        return calc_distance(middle, west, middle, east), calc_distance(south, west, north, west)
+
+
+class OutageTracker(object):
+    """Finds outages in fflib.diff.Changesets with the fields of `fields`.
+
+    A poll is an outage if at least `minimum` nodes went offline and they
+    are at least `share` of the nodes online before, or a gateway went
+    offline with them. Outages that still miss nodes after `timeout`
+    seconds end anyway.
+    """
+
+    def __init__(self, fields, share=0.1, minimum=10, timeout=86400):
+        self.share = share
+        self.minimum = minimum
+        self.timeout = timeout
+        self.outages = []
+
+        # node_id -> the Outage it is still missing from
+        self._down = {}
+
+        self._online = fields.index('online')
+        self._gateway = fields.index('gateway')
+        self._hostname = fields.index('hostname')
+        self._lat = fields.index('lat')
+        self._lon = fields.index('lon')
+
+    def update(self, changeset, online, now):
+        """Correlates the offline and online changes of `changeset`, polled
+        at `now` (unix time). `online` is the number of nodes that were
+        online before the poll.
+
+        Returns the outage events and the set of node_ids whose online
+        changes they stand for.
+        """
+        dropped = []
+        gateways = []
+        back = {}
+        covered = set()
+
+        for node_id, (old, new) in changeset.changed.items():
+            if old is None or bool(old[self._online]) == bool(new[self._online]):
+                continue
+
+            if new[self._online]:
+                outage = self._down.pop(node_id, None)
+                if outage is not None:
+                    outage.down.discard(node_id)
+                    back[outage] = back.get(outage, 0) + 1
+                    covered.add(node_id)
+            elif new[self._gateway]:
+                gateways.append(new[self._hostname] or node_id)
+            else:
+                dropped.append((node_id, new))
+
+        events = []
+
+        for outage in self.outages:
+            # the last ones back are reported by OutageEnded
+            if outage in back and outage.down:
+                events.append(OutageRecovering(outage, back[outage]))
+
+        if len(dropped) >= self.minimum and (gateways or len(dropped) >= self.share * online):
+            outage = Outage(now, [node_id for node_id, _ in dropped], gateways, self._bbox(dropped))
+            self.outages.append(outage)
+
+            for node_id in outage.down:
+                self._down[node_id] = outage
+            covered.update(outage.down)
+
+            events.append(OutageStarted(outage))
+
+        for outage in list(self.outages):
+            expired = now - outage.started >= self.timeout
+
+            if outage.down and not expired:
+                continue
+
+            self.outages.remove(outage)
+            for node_id in outage.down:
+                del self._down[node_id]
+
+            events.append(OutageEnded(outage, bool(outage.down)))
+
+        return events, covered
+
+    def _bbox(self, nodes):
+        lats = [new[self._lat] for _, new in nodes if new[self._lat] and new[self._lon]]
+        lons = [new[self._lon] for _, new in nodes if new[self._lat] and new[self._lon]]
+
+        if not lats:
+            return None
+
+        return min(lats), min(lons), max(lats), max(lons)
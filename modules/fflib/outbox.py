@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Outgoing announcements of all ff-* modules, sent from a thread of the
+shared Outbox:
+
+    - every target has a token bucket, so a channel gets at most `burst`
+      lines at once and then `rate` lines per second, all targets together
+      at most `total_rate`
+    - URGENT lines (errors) go out before HIGH ones (highscores), those
+      before NORMAL ones, in the order they came in
+    - lines with a `summary` wait `window` seconds, all lines with the same
+      summary queued for the same target by then are merged into one, e.g.
+      "42 Knoten offline: a, b, c, …"
+
+Command replies don't go through here, willie's @rate covers those.
+
+    outbox.get(bot).put(channel, text, summary='{count:d} Knoten offline: {items}', item=name)
+"""
+
+import datetime
+import threading
+import time
+
+URGENT, HIGH, NORMAL = range(3)
+
+# a summary line is cut after this many characters of items
+SUMMARY_LENGTH = 350
+
+
+class _Message(object):
+
+    __slots__ = ('priority', 'seq', 'due', 'queued', 'text', 'summary', 'item')
+
+    def __init__(self, priority, seq, due, queued, text, summary, item):
+        self.priority = priority
+        self.seq = seq
+        self.due = due
+        self.queued = queued
+        self.text = text
+        self.summary = summary
+        self.item = item
+
+
+class _TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self):
+        """Seconds until the next token."""
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class Outbox(object):
+    """Sends queued lines to IRC from a thread of its own."""
+
+    def __init__(self, rate=0.5, burst=4, total_rate=1.0, window=10):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.bot = None
+
+        # for the stats
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+        self._queues = {}
+        self._buckets = {}
+        self._total = _TokenBucket(total_rate, burst)
+        self._seq = 0
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, name='ff outbox')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, target, text, priority=NORMAL, summary=None, item=None):
+        """Queues `text` for `target`.
+
+        `summary` is a format string with {count} and {items}. Lines with
+        the same summary and target are merged, each contributing `item`.
+        """
+        now = time.time()
+
+        with self._condition:
+            self._seq += 1
+            self.queued += 1
+            due = now + self.window if summary else now
+            self._queues.setdefault(target, []).append(
+                _Message(priority, self._seq, due, now, text, summary, item))
+            self._condition.notify()
+
+    def depth(self):
+        """Returns the number of queued lines per target."""
+        with self._condition:
+            return dict((target, len(queue)) for target, queue in self._queues.items() if queue)
+
+    def stats(self):
+        with self._condition:
+            depth = sum(len(queue) for queue in self._queues.values())
+
+        return {
+            'depth': depth,
+            'queued': self.queued,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'latency_avg': self.latency_sum / self.sent if self.sent else 0.0,
+            'latency_max': self.latency_max,
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                target, messages, wait = self._next()
+
+                if target is None:
+                    self._condition.wait(wait)
+                    continue
+
+            text = self._render(messages)
+
+            try:
+                self.bot.msg(target, text)
+            except Exception as e:
+                print('{}: Unable to send to {}: {}'.format(str(datetime.datetime.now()), target, e))
+
+            now = time.time()
+            self.sent += 1
+            self.coalesced += len(messages) - 1
+            for message in messages:
+                latency = now - message.queued
+                self.latency_sum += latency / len(messages)
+                self.latency_max = max(self.latency_max, latency)
+
+    def _next(self):
+        """Takes the next line(s) to send off the queues. Returns the
+        target, the messages and, if nothing can be sent yet, how long to
+        wait."""
+        now = time.time()
+        wait = None
+        best = None
+
+        self._total.refill(now)
+
+        if self.bot is not None:
+            for target, queue in self._queues.items():
+                if not queue:
+                    continue
+
+                bucket = self._buckets.get(target)
+                if bucket is None:
+                    bucket = self._buckets[target] = _TokenBucket(self.rate, self.burst)
+                bucket.refill(now)
+
+                due = [message for message in queue if message.due <= now]
+                if not due:
+                    later = min(message.due for message in queue) - now
+                    wait = later if wait is None else min(wait, later)
+                    continue
+
+                if bucket.tokens < 1:
+                    wait = bucket.wait() if wait is None else min(wait, bucket.wait())
+                    continue
+
+                message = min(due, key=lambda message: (message.priority, message.seq))
+                if best is None or (message.priority, message.seq) < (best[1].priority, best[1].seq):
+                    best = (target, message)
+
+        if best is None:
+            return None, None, wait
+
+        if self._total.tokens < 1:
+            return None, None, self._total.wait()
+
+        target, message = best
+        queue = self._queues[target]
+
+        if message.summary:
+            messages = [other for other in queue if other.summary == message.summary]
+        else:
+            messages = [message]
+
+        if len(messages) == 1:
+            queue.remove(message)
+        else:
+            merged = set(id(other) for other in messages)
+            self._queues[target] = [other for other in queue if id(other) not in merged]
+        self._buckets[target].tokens -= 1
+        self._total.tokens -= 1
+
+        return target, messages, None
+
+    @staticmethod
+    def _render(messages):
+        if len(messages) == 1:
+            return messages[0].text
+
+        items = []
+        length = 0
+
+        for message in messages:
+            item = str(message.item)
+            if length + len(item) > SUMMARY_LENGTH:
+                items.append(u'…')
+                break
+
+            items.append(item)
+            length += len(item) + 2
+
+        return messages[0].summary.format(count=len(messages), items=', '.join(items))
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get(bot=None):
+    """Returns the Outbox all modules share, sending through `bot`."""
+    global _outbox
+
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+
+        if bot is not None:
+            _outbox.bot = bot
+
+    return _outbox
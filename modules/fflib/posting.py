@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Statuses posted to social media, e.g. the highscores ff-twitter tweets.
+A Poster keeps them in the posts table and sends them from a thread of its
+own:
+
+    store.create_tables(posting.Base.metadata)
+    poster = posting.Poster('twitter', backend, store.engine)
+    poster.put('Neuer Highscore: 1234 Nodes')
+
+    - a status that failed is tried again after 2, 4, 8, ... seconds, at
+      most `max_delay`, every wait cut short by up to half at random so
+      several bots don't all come back at once, and given up after
+      `attempts` tries
+    - a status queued or sent within the last `dedup` seconds isn't queued
+      again, the networks reject those anyway
+    - what is still queued when the bot stops is sent after the next start
+
+A Backend posts to one network. StubBackend only keeps the statuses, to run
+the bot without an account or to try a Poster out:
+
+    poster = posting.Poster('stub', posting.StubBackend(failures=3), store.engine)
+
+Post latency, failures and duplicates are counted in the stats of `name`.
+"""
+
+import datetime
+import random
+import threading
+import time
+
+from sqlalchemy import Column, Float, Index, Integer, String, and_, func, or_
+from sqlalchemy.ext.declarative import declarative_base
+
+from . import db, stats
+
+QUEUED, SENT, FAILED = 'queued', 'sent', 'failed'
+
+Base = declarative_base()
+
+
+class Post(Base):
+    __tablename__ = 'posts'
+    __table_args__ = (Index('ix_posts_poster_state_due', 'poster', 'state', 'due'),)
+
+    id = Column(Integer, primary_key=True)
+    # name of the Poster
+    poster = Column(String)
+    text = Column(String)
+    state = Column(String)
+    attempts = Column(Integer)
+    # unix times, sent is None until it was
+    queued = Column(Float)
+    due = Column(Float)
+    sent = Column(Float)
+    # of the last attempt
+    error = Column(String)
+
+
+class PostRejected(Exception):
+    """The network refused the status, trying again won't help."""
+
+
+class Backend(object):
+    """Posts statuses to one network."""
+
+    def post(self, text):
+        """Posts `text`. Raises PostRejected if it must not be tried again,
+        any other exception if it may work later."""
+        raise NotImplementedError
+
+
+class StubBackend(Backend):
+    """Keeps the statuses in `posts` instead of posting them. The first
+    `failures` posts fail as if the network were down."""
+
+    def __init__(self, failures=0, delay=0):
+        self.posts = []
+        self.failures = failures
+        # seconds every post takes
+        self.delay = delay
+
+    def post(self, text):
+        time.sleep(self.delay)
+
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('stub backend down')
+
+        self.posts.append(text)
+
+
+class Poster(object):
+    """Sends the statuses queued in the posts table under `name` through
+    `backend`, see the module docstring."""
+
+    def __init__(self, name, backend, engine, base_delay=2, max_delay=3600, attempts=10, dedup=86400):
+        self.name = name
+        self.backend = backend
+        self.engine = engine
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = attempts
+        self.dedup = dedup
+
+        table = Post.__table__
+        with self.engine.begin() as connection:
+            # statuses still queued from before the last stop
+            self.depth = connection.execute(db.select(func.count()).select_from(table).where(
+                and_(table.c.poster == name, table.c.state == QUEUED))).scalar()
+
+        self.stats = stats.get(name)
+        self.stats.gauge('queue', lambda: {'depth': self.depth})
+
+        # post id -> the values of its row the table didn't take yet
+        self._unsaved = {}
+
+        self._condition = threading.Condition()
+        self._woken = False
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, name='ff poster ' + name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, text, now=None):
+        """Queues `text`. Returns False if it is a duplicate."""
+        now = time.time() if now is None else now
+        table = Post.__table__
+
+        with self.engine.begin() as connection:
+            duplicates = connection.execute(db.select(func.count()).select_from(table).where(and_(
+                table.c.poster == self.name, table.c.text == text,
+                or_(table.c.state == QUEUED, and_(table.c.state == SENT, table.c.sent >= now - self.dedup))))).scalar()
+
+            if duplicates:
+                self.stats.count('duplicates')
+                return False
+
+            connection.execute(table.insert(), {'poster': self.name, 'text': text, 'state': QUEUED, 'attempts': 0,
+                                                'queued': now, 'due': now})
+
+        with self._condition:
+            self.depth += 1
+            self._woken = True
+            self._condition.notify()
+
+        return True
+
+    def stop(self, timeout=None):
+        """Stops the thread after the post in progress, the rest stays queued."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        self._thread.join(timeout)
+
+    def delay(self, attempts):
+        """Seconds to wait after the `attempts`th failed try."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+
+        return delay * random.uniform(0.5, 1)
+
+    def _next(self):
+        table = Post.__table__
+
+        with self.engine.begin() as connection:
+            return connection.execute(db.select(table.c.id, table.c.text, table.c.attempts, table.c.queued, table.c.due)
+                                      .where(and_(table.c.poster == self.name, table.c.state == QUEUED))
+                                      .order_by(table.c.due, table.c.id).limit(1)).first()
+
+    def _run(self):
+        # times in a row the posts table failed, to back off
+        failures = 0
+
+        while True:
+            try:
+                # until the outcome of the last post is stored it still
+                # looks queued, _next() must not see it
+                self._store()
+                post = self._next()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                post = None
+                print('{}: {}: the posts table failed: {}'.format(str(datetime.datetime.now()), self.name, e))
+
+            with self._condition:
+                if self._stopped:
+                    return
+
+                if failures:
+                    wait = self.delay(failures)
+                else:
+                    wait = 60 if post is None else post.due - time.time()
+
+                if wait > 0:
+                    # put() may have queued one since _next() looked
+                    if not self._woken:
+                        self._condition.wait(wait)
+                    self._woken = False
+                    continue
+
+            self._send(post)
+
+    def _send(self, post):
+        start = time.time()
+        values = {'attempts': post.attempts + 1}
+
+        try:
+            self.backend.post(post.text)
+        except PostRejected as e:
+            values.update(state=FAILED, error=str(e))
+        except Exception as e:
+            values['error'] = str(e) or type(e).__name__
+
+            if values['attempts'] >= self.attempts:
+                values['state'] = FAILED
+            else:
+                values['due'] = time.time() + self.delay(values['attempts'])
+        else:
+            values.update(state=SENT, sent=time.time(), error=None)
+
+        now = time.time()
+        self.stats.add('post', now - start)
+
+        if values.get('state') == SENT:
+            self.stats.count('posted')
+            self.stats.add('latency', now - post.queued)
+        else:
+            self.stats.count('post_failures')
+            print('{}: {}: posting failed ({:d}. attempt): {}'.format(
+                str(datetime.datetime.now()), self.name, values['attempts'], values['error']))
+
+        if 'state' in values:
+            with self._condition:
+                self.depth -= 1
+
+        self._unsaved[post.id] = values
+
+    def _store(self):
+        """Writes the outcome of the posts sent to the posts table. Kept in
+        memory until it is written, so a post that went out is never picked
+        up as queued again."""
+        if not self._unsaved:
+            return
+
+        table = Post.__table__
+        now = time.time()
+
+        for post_id, values in list(self._unsaved.items()):
+            with self.engine.begin() as connection:
+                connection.execute(table.update().where(table.c.id == post_id), values)
+            del self._unsaved[post_id]
+
+        with self.engine.begin() as connection:
+            # sent and failed ones are only needed to find duplicates
+            connection.execute(table.delete().where(and_(table.c.poster == self.name, table.c.state != QUEUED,
+                                                         table.c.queued < now - self.dedup)))
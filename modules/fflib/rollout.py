@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Firmware rollouts for .firmware.
+
+RolloutTracker counts the nodes online per firmware_release, branch and
+autoupdate, kept up to date from the same changesets as the other indexes,
+so asking how far a release got never reads the nodes table. Every
+INTERVAL seconds the distribution is stored in firmware_snapshots, which
+tells how fast a release spreads:
+
+    tracker.progress('v2016.1.5', time.time())
+    # Progress(release='v2016.1.5', count=1234, total=1990, rate=4.1, ...)
+
+The snapshots are read back once when the module starts, all answers come
+from the counters and the snapshots in memory.
+"""
+
+import re
+import threading
+from collections import Counter, deque, namedtuple
+
+from sqlalchemy import Boolean, Column, Index, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from . import db
+
+# seconds between two snapshots
+INTERVAL = 900
+
+# seconds the snapshots are kept
+RETENTION = 30 * 86400
+
+Base = declarative_base()
+
+# share is count / total, rate the change of the share in percentage points
+# per hour or None without a snapshot old enough, branches maps every branch
+# to (nodes on the release, nodes) and manual is the number of nodes with the
+# autoupdater off that aren't on the release
+Progress = namedtuple('Progress', ['release', 'count', 'total', 'share', 'rate', 'branches', 'manual'])
+
+_digits = re.compile(r'(\d+)')
+
+
+class Snapshot(Base):
+    __tablename__ = 'firmware_snapshots'
+    __table_args__ = (Index('ix_firmware_snapshots_time', 'time'),)
+
+    id = Column(Integer, primary_key=True)
+    # unix time
+    time = Column(Integer)
+    # the part of the network, e.g. the site, None without partitions
+    part = Column(String)
+    release = Column(String)
+    branch = Column(String)
+    autoupdate = Column(Boolean)
+    count = Column(Integer)
+
+
+def version_key(release):
+    """Sorts releases by the numbers in them, v2016.1.10 after v2016.1.9."""
+    return [int(piece) if piece.isdigit() else piece for piece in _digits.split(release or '')]
+
+
+class RolloutTracker(object):
+    """Online nodes, without gateways, per firmware_release, branch and
+    autoupdate of fflib.diff.Changesets with the fields of `fields`.
+
+    If `partition` is given, it maps a row to the part of the network it
+    belongs to, like for aggregates.NetworkAggregates, and progress() can
+    be asked for one part.
+    """
+
+    def __init__(self, fields, partition=None, interval=INTERVAL, retention=RETENTION):
+        self.partition = partition
+        self.interval = interval
+        self.retention = retention
+        # (part, release, branch, autoupdate) -> nodes
+        self.counts = Counter()
+        # (time, Counter (part, release) -> nodes, Counter part -> nodes), oldest first
+        self.snapshots = deque()
+
+        self._online = fields.index('online')
+        self._gateway = fields.index('gateway')
+        self._release = fields.index('firmware_release')
+        self._branch = fields.index('branch')
+        self._autoupdate = fields.index('autoupdate')
+
+        self._pending = []
+        self._next = None
+        self._cleaned = 0
+        self._lock = threading.Lock()
+
+    def load(self, table):
+        """Counts everything in `table` (a fflib.diff.NodeTable) from scratch."""
+        with self._lock:
+            self.counts.clear()
+
+            for row in table.rows.values():
+                self._account(row, 1)
+
+    def apply(self, changeset):
+        """Takes the nodes of a fflib.diff.Changeset into account."""
+        with self._lock:
+            for old, new in changeset.changed.values():
+                if old is not None:
+                    self._account(old, -1)
+                self._account(new, 1)
+
+    def releases(self, part=None):
+        """Returns a Counter of the nodes per release, of all parts or one."""
+        with self._lock:
+            return self._releases(part)
+
+    def latest(self, part=None):
+        """Returns the newest release any node is on, None without nodes."""
+        releases = [release for release in self.releases(part) if release]
+
+        return max(releases, key=version_key) if releases else None
+
+    def progress(self, release, now, part=None, window=3600):
+        """Returns the Progress of `release` at `now` (unix time). The rate
+        is measured against the snapshot `window` seconds ago, or the oldest
+        one if there isn't one that old yet."""
+        with self._lock:
+            branches = {}
+            count = total = manual = 0
+
+            for (key_part, key_release, branch, autoupdate), nodes in self.counts.items():
+                if part is not None and key_part != part:
+                    continue
+
+                on_release, in_branch = branches.get(branch, (0, 0))
+                total += nodes
+
+                if key_release == release:
+                    count += nodes
+                    branches[branch] = (on_release + nodes, in_branch + nodes)
+                else:
+                    branches[branch] = (on_release, in_branch + nodes)
+                    if not autoupdate:
+                        manual += nodes
+
+            share = float(count) / total if total else 0.0
+            rate = None
+
+            # the newest snapshot at least `window` old, else the oldest
+            before = None
+            for snapshot in self.snapshots:
+                if snapshot[0] > now - window and before is not None:
+                    break
+                before = snapshot
+
+            if before is not None and now - before[0] >= self.interval:
+                then, releases, totals = before
+                then_total = totals[part] if part is not None else sum(totals.values())
+                then_count = (releases[(part, release)] if part is not None else
+                              sum(nodes for (_, key_release), nodes in releases.items() if key_release == release))
+
+                if then_total:
+                    rate = (share - float(then_count) / then_total) * 100 * 3600 / (now - then)
+
+        return Progress(release, count, total, share, rate, branches, manual)
+
+    def snapshot(self, now):
+        """Takes a snapshot if the last one is INTERVAL seconds old. Returns
+        True if it did."""
+        now = int(now)
+
+        with self._lock:
+            if self._next is not None and now < self._next:
+                return False
+
+            self._next = now - now % self.interval + self.interval
+
+            releases = Counter()
+            totals = Counter()
+
+            for (part, release, branch, autoupdate), nodes in self.counts.items():
+                releases[(part, release)] += nodes
+                totals[part] += nodes
+                self._pending.append({'time': now, 'part': part, 'release': release, 'branch': branch,
+                                      'autoupdate': autoupdate, 'count': nodes})
+
+            self.snapshots.append((now, releases, totals))
+
+            while self.snapshots and self.snapshots[0][0] < now - self.retention:
+                self.snapshots.popleft()
+
+        return True
+
+    def load_snapshots(self, connection, now):
+        """Reads the snapshots of the last RETENTION seconds back."""
+        table = Snapshot.__table__
+
+        rows = connection.execute(db.select(table.c.time, table.c.part, table.c.release, table.c.count)
+                                  .where(table.c.time >= now - self.retention).order_by(table.c.time)).fetchall()
+
+        with self._lock:
+            self.snapshots.clear()
+
+            for when, part, release, count in rows:
+                if not self.snapshots or self.snapshots[-1][0] != when:
+                    self.snapshots.append((when, Counter(), Counter()))
+
+                self.snapshots[-1][1][(part, release)] += count
+                self.snapshots[-1][2][part] += count
+
+            if self.snapshots:
+                last = self.snapshots[-1][0]
+                self._next = last - last % self.interval + self.interval
+
+    def flush(self, connection, now):
+        """Writes the snapshots taken since the last flush and, once an hour,
+        deletes those older than RETENTION."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+
+        table = Snapshot.__table__
+
+        if rows:
+            connection.execute(table.insert(), rows)
+
+        if now - self._cleaned >= 3600:
+            self._cleaned = now
+            connection.execute(table.delete().where(table.c.time < now - self.retention))
+
+    def _releases(self, part):
+        result = Counter()
+
+        for (key_part, release, _, _), nodes in self.counts.items():
+            if part is None or key_part == part:
+                result[release] += nodes
+
+        return result
+
+    def _account(self, row, sign):
+        if not row[self._online] or row[self._gateway]:
+            return
+
+        part = self.partition(row) if self.partition is not None else None
+        key = (part, row[self._release], row[self._branch], row[self._autoupdate])
+
+        self.counts[key] += sign
+        if not self.counts[key]:
+            del self.counts[key]
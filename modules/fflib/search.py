@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""Hostname search for .nodeinfo, over an in-memory index of hostnames,
+MACs and node_ids.
+
+    - a MAC or node_id (with or without separators) finds that node
+    - hostnames starting with the query are found by bisecting a sorted list
+    - queries of three or more characters also match anywhere in the
+      hostname, looked up through the nodes having all their trigrams
+    - if nothing contains the query, the hostnames sharing its longest
+      prefix or suffix are compared by their trigrams, so a typo still
+      finds the node
+
+Matches are ranked exact > prefix > substring > similar, then by similarity,
+online nodes first and by name.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+from collections import defaultdict, namedtuple
+
+EXACT, PREFIX, SUBSTRING, SIMILAR = range(4)
+
+# least Dice coefficient of the trigrams for a SIMILAR match
+MIN_SIMILARITY = 0.5
+
+# a prefix or suffix shared by more nodes than this doesn't tell them apart
+MAX_CANDIDATES = 1000
+
+Match = namedtuple('Match', ['node_id', 'hostname', 'kind', 'similarity'])
+
+_id_separators = re.compile(r'[:.\- ]')
+_node_id = re.compile(r'^[0-9a-f]{12}$')
+
+
+def trigrams(text):
+    """Returns the trigrams of `text`, padded like pg_trgm does so the start
+    and the end of the text have trigrams of their own."""
+    padded = '  ' + text + ' '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def normalize_id(text):
+    """Returns `text` as a bare node_id if it looks like a MAC or node_id."""
+    text = _id_separators.sub('', text.lower())
+
+    return text if _node_id.match(text) else None
+
+
+class NodeIndex(object):
+    """Search index over the hostnames, MACs and node_ids of all nodes
+    except gateways, fed from the same changesets as the fflib.diff.NodeTable
+    `fields` come from."""
+
+    def __init__(self, fields):
+        # node_id -> (hostname, lowercase hostname, trigrams)
+        self.hostnames = {}
+        # normalized MAC or node_id -> node_id
+        self.ids = {}
+        # trigram -> node_ids
+        self.postings = defaultdict(set)
+        # (lowercase hostname, node_id), sorted
+        self.names = []
+
+        self._hostname = fields.index('hostname')
+        self._mac = fields.index('mac')
+        self._gateway = fields.index('gateway')
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hostnames)
+
+    def load(self, table):
+        """Indexes every node of `table` (a fflib.diff.NodeTable)."""
+        with self._lock:
+            for node_id, row in table.rows.items():
+                self._update(node_id, None, row)
+
+            # sorted once here instead of inserting every name
+            self.names.sort()
+
+    def apply(self, changeset):
+        """Reindexes the nodes of a fflib.diff.Changeset whose hostname, MAC
+        or gateway flag changed."""
+        with self._lock:
+            for node_id, (old, new) in changeset.changed.items():
+                self._update(node_id, old, new, insort=True)
+
+    def search(self, query, online=(), limit=5):
+        """Returns the number of nodes matching `query` and the best `limit`
+        of them as Match tuples. `online` is the set of online node_ids."""
+        query = query.strip().lower()
+
+        if not query:
+            return 0, []
+
+        with self._lock:
+            node_id = self.ids.get(normalize_id(query))
+            if node_id is not None:
+                hostname = self.hostnames.get(node_id, (None,))[0]
+                return 1, [Match(node_id, hostname, EXACT, 1.0)]
+
+            count, matches = self._containing(query, online, limit)
+            if count:
+                return count, matches
+
+            matches = self._similar(query)
+
+        def rank(match):
+            return -match.similarity, match.node_id not in online, match.hostname.lower()
+
+        return len(matches), heapq.nsmallest(limit, matches, key=rank)
+
+    def _containing(self, query, online, limit):
+        start, end = self._prefix_range(query)
+
+        matches = []
+        offline = []
+
+        # exact matches sort first, then every other name with this prefix
+        for i in range(start, end):
+            if len(matches) >= limit:
+                break
+
+            lower, node_id = self.names[i]
+
+            match = Match(node_id, self.hostnames[node_id][0], EXACT if lower == query else PREFIX, 1.0)
+
+            if match.kind == EXACT or node_id in online:
+                matches.append(match)
+            elif len(offline) < limit:
+                offline.append(match)
+
+        matches = sorted(matches + offline, key=lambda match: match.kind)[:limit]
+        count = end - start
+
+        if len(query) < 3:
+            return count, matches
+
+        # every name starting with the query has all of its trigrams too
+        candidates = self._intersect(query)
+        if len(candidates) == count:
+            return count, matches
+
+        hostnames = self.hostnames
+        substrings = [node_id for node_id in candidates if hostnames[node_id][1].find(query) > 0]
+        count += len(substrings)
+
+        if len(matches) < limit:
+            best = heapq.nsmallest(limit - len(matches), substrings,
+                                   key=lambda node_id: (node_id not in online, self.hostnames[node_id][1]))
+            matches.extend(Match(node_id, self.hostnames[node_id][0], SUBSTRING, 1.0) for node_id in best)
+
+        return count, matches
+
+    def _intersect(self, query):
+        postings = []
+
+        for gram in set(query[i:i + 3] for i in range(len(query) - 2)):
+            if gram not in self.postings:
+                return set()
+            postings.append(self.postings[gram])
+
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for nodes in postings[1:]:
+            candidates &= nodes
+            if not candidates:
+                break
+
+        return candidates
+
+    def _similar(self, query):
+        # A typo leaves the text before and after it intact and one of both
+        # is at least half of the query. Only the nodes sharing the longest
+        # intact prefix or suffix are compared by their trigrams.
+        candidates = set()
+
+        start, end = self._longest_prefix(query)
+        if end - start <= MAX_CANDIDATES:
+            candidates.update(self.names[i][1] for i in range(start, end))
+
+        suffix = self._longest_suffix(query)
+        if len(suffix) <= MAX_CANDIDATES:
+            candidates.update(suffix)
+
+        grams = trigrams(query)
+        matches = []
+
+        for node_id in candidates:
+            hostname, _, node_grams = self.hostnames[node_id]
+            similarity = 2.0 * len(grams & node_grams) / (len(grams) + len(node_grams))
+
+            if similarity >= MIN_SIMILARITY:
+                matches.append(Match(node_id, hostname, SIMILAR, similarity))
+
+        return matches
+
+    def _prefix_range(self, prefix):
+        start = bisect.bisect_left(self.names, (prefix,))
+        end = bisect.bisect_left(self.names, (prefix + u'\U0010ffff',), start)
+
+        return start, end
+
+    def _longest_prefix(self, query):
+        """Returns the range of self.names starting with the longest prefix
+        of `query` any hostname starts with."""
+        found = (0, 0)
+        low, high = 1, len(query)
+
+        while low <= high:
+            middle = (low + high) // 2
+            start, end = self._prefix_range(query[:middle])
+
+            if start < end:
+                found = (start, end)
+                low = middle + 1
+            else:
+                high = middle - 1
+
+        return found
+
+    def _longest_suffix(self, query):
+        """Returns the nodes containing the longest suffix of `query` (at
+        least three characters) any hostname contains."""
+        found = []
+        low, high = 0, len(query) - 3
+
+        while low <= high:
+            middle = (low + high) // 2
+            suffix = query[middle:]
+            nodes = [node_id for node_id in self._intersect(suffix) if suffix in self.hostnames[node_id][1]]
+
+            if nodes:
+                found = nodes
+                high = middle - 1
+            else:
+                low = middle + 1
+
+        return found
+
+    def _update(self, node_id, old, new, insort=False):
+        if old is not None and old[self._hostname] == new[self._hostname] and \
+                old[self._mac] == new[self._mac] and old[self._gateway] == new[self._gateway]:
+            return
+
+        self._remove(node_id, old)
+
+        if new[self._gateway]:
+            return
+
+        for key in (node_id, new[self._mac]):
+            key = normalize_id(key) if key else None
+            if key:
+                self.ids[key] = node_id
+
+        hostname = new[self._hostname]
+        if hostname:
+            lower = hostname.lower()
+            grams = trigrams(lower)
+
+            self.hostnames[node_id] = (hostname, lower, grams)
+            for gram in grams:
+                self.postings[gram].add(node_id)
+
+            if insort:
+                bisect.insort(self.names, (lower, node_id))
+            else:
+                self.names.append((lower, node_id))
+
+    def _remove(self, node_id, old):
+        if old is not None:
+            for key in (node_id, old[self._mac]):
+                key = normalize_id(key) if key else None
+                if key and self.ids.get(key) == node_id:
+                    del self.ids[key]
+
+        entry = self.hostnames.pop(node_id, None)
+        if entry is None:
+            return
+
+        i = bisect.bisect_left(self.names, (entry[1], node_id))
+        if i < len(self.names) and self.names[i] == (entry[1], node_id):
+            del self.names[i]
+
+        for gram in entry[2]:
+            nodes = self.postings[gram]
+            nodes.discard(node_id)
+            if not nodes:
+                del self.postings[gram]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""The communities one bot serves from the same map.
+
+Several communities often share one meshviewer. Each of them is a Site with
+the site codes of its nodes, the channels its announcements go to and its
+own highscores and .status. They are configured in [freifunk]:
+
+    sites = ffka, ffxx
+    ffxx_site_codes = ffxx, ffxx-umland
+    ffxx_channel = #ffxx
+    ffxx_change_announce_target = #ffxx-changes
+
+A site's codes default to its name, its channels to `channel` and
+`change_announce_target`. Without `sites` there is a single site with
+`site_codes` (default ffka), the same as before.
+
+nodes.json is still parsed once for all of them: Sites is the
+nodesjson.SiteFilter accepting the codes of every site, the site code of
+each node is stored with it and site() tells which Site it belongs to.
+"""
+
+from .nodesjson import SiteFilter
+
+
+class Site(object):
+    """One community, see the module docstring."""
+
+    def __init__(self, name, codes, channel, change_announce_target, prefix=''):
+        self.name = name
+        self.codes = list(codes)
+        self.channel = channel
+        self.change_announce_target = change_announce_target
+        # in front of the names of its highscores, empty for a single site so
+        # the highscores of older databases are still used
+        self.prefix = prefix
+
+    def highscore(self, name):
+        """Returns the name of the site's highscore `name`."""
+        return self.prefix + name
+
+
+class Sites(SiteFilter):
+    """All sites served, by name. The first one is the default site, for
+    nodes without a known site code, e.g. those only alfred knows."""
+
+    def __init__(self, sites, domain_codes=()):
+        self.sites = list(sites)
+        self.default = self.sites[0]
+
+        self._by_name = dict((site.name, site) for site in self.sites)
+        self._by_code = {}
+        for site in self.sites:
+            for code in site.codes:
+                self._by_code.setdefault(code, site)
+
+        super(Sites, self).__init__(self._by_code, domain_codes)
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def get(self, name):
+        """Returns the Site called `name`, None if there is none."""
+        return self._by_name.get(name)
+
+    def site(self, code):
+        """Returns the Site of the nodes with site code `code`."""
+        return self._by_code.get(code, self.default)
+
+    def for_channel(self, channel):
+        """Returns the first Site announcing to `channel`, None if none does."""
+        for site in self.sites:
+            if channel in (site.channel, site.change_announce_target):
+                return site
+
+        return None
+
+    def targets(self):
+        """Returns the change_announce_targets of all sites, each once."""
+        result = []
+
+        for site in self.sites:
+            if site.change_announce_target not in result:
+                result.append(site.change_announce_target)
+
+        return result
+
+
+def from_config(config):
+    """Returns the Sites configured in `config`, the [freifunk] section."""
+    names = config.get_list('sites')
+    domain_codes = config.get_list('domain_codes')
+
+    if not names:
+        codes = config.get_list('site_codes') or ['ffka']
+        return Sites([Site(codes[0], codes, config.channel, config.change_announce_target)], domain_codes)
+
+    return Sites([Site(name,
+                       config.get_list(name + '_site_codes') or [name],
+                       getattr(config, name + '_channel') or config.channel,
+                       getattr(config, name + '_change_announce_target') or config.change_announce_target,
+                       prefix='' if len(names) == 1 else name + '/')
+                  for name in names], domain_codes)
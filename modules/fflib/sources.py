@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""The places fflib.ingest gets nodes from.
+
+A Source fetches one file and turns every node in it into a tuple of the
+columns it knows about (`fields`). It keeps the tuples of its last poll, so
+poll() can tell which nodes changed since:
+
+    source = sources.MeshviewerSource(uri, httpclient.HttpClient(), site_filter)
+    changed = source.poll()    # node_ids, or None if the file didn't change
+
+Sources don't know of each other. Where two of them disagree about a node,
+fflib.ingest takes the value of the one with the higher priority() for that
+field, as long as it is fresh(). A source that can't be polled for longer
+than `freshness` seconds no longer counts.
+
+Every source records its stages (http, download, parse) and counters in the
+fflib.stats of its name.
+
+Sources that can tell a node didn't change without parsing it yield
+UNCHANGED for it, its tuple of the last poll is then kept as it is. The
+share of nodes skipped that way is the `skip_ratio` in the stats.
+"""
+
+import json
+import time
+
+import requests
+
+from . import nodesjson, stats
+from .nodesjson import UNCHANGED
+
+
+class SourceError(Exception):
+    """A poll failed, the message says why."""
+
+
+class Source(object):
+    """Base of the sources, subclasses implement entries()."""
+
+    name = None
+    # the columns of fflib.storage.Node the source provides
+    fields = ()
+    # higher wins, `field_priority` overrides it for single fields
+    priority = 0
+    field_priority = {}
+
+    def __init__(self, uri, client, freshness=300):
+        self.uri = uri
+        # an fflib.httpclient.HttpClient of its own, sessions aren't thread safe
+        self.client = client
+        self.freshness = freshness
+        # node_id -> tuple of the `fields` of the last poll
+        self.nodes = {}
+        # unix time of the last poll that worked, None before the first one
+        self.fetched = None
+        # message of the last poll, None if it worked
+        self.error = None
+        # share of the nodes of the last poll that were UNCHANGED
+        self.skip_ratio = 0.0
+        self.stats = stats.get(self.name)
+        self.stats.gauge('skip', lambda: {'ratio': self.skip_ratio})
+
+    def priority_of(self, field):
+        return self.field_priority.get(field, self.priority)
+
+    def fresh(self, now):
+        return self.fetched is not None and now - self.fetched <= self.freshness
+
+    def entries(self, response):
+        """Yields (node_id, dict of column values) for every node in `response`,
+        or (node_id, UNCHANGED) for a node known to be the same as in the
+        last poll."""
+        raise NotImplementedError
+
+    def poll(self):
+        """Fetches the file and returns the node_ids whose values changed,
+        appeared or disappeared since the last poll, or None if the file
+        didn't change. Raises SourceError if it can't be fetched or parsed."""
+        try:
+            changed = self._poll()
+        except SourceError as e:
+            self.error = str(e)
+            self.stats.count('errors')
+            raise
+
+        self.fetched = time.time()
+        self.error = None
+
+        return changed
+
+    def _poll(self):
+        started = time.time()
+        self.stats.count('polls')
+
+        try:
+            response = self.client.get(self.uri)
+        except requests.exceptions.Timeout:
+            raise SourceError('Problems requesting {}: Timeout'.format(self.name))
+        except requests.exceptions.ConnectionError:
+            raise SourceError('Problems requesting {}: ConnectionError'.format(self.name))
+        except Exception as e:
+            raise SourceError('Problems requesting {}: {}'.format(self.name, type(e)))
+
+        self.stats.add('http', time.time() - started)
+
+        if response.status_code == 304:
+            # no update since last fetch
+            self.client.release(response)
+            self.stats.count('not_modified')
+            return None
+
+        if response.status_code != 200:
+            self.client.release(response)
+            raise SourceError('Unable to get {}! Status code: {:d}'.format(self.name, response.status_code))
+
+        old = self.nodes
+        nodes = {}
+        changed = set()
+        unchanged = 0
+
+        try:
+            for node_id, values in self.entries(response):
+                if values is UNCHANGED:
+                    nodes[node_id] = old[node_id]
+                    unchanged += 1
+                    continue
+
+                row = tuple(values.get(field) for field in self.fields)
+                nodes[node_id] = row
+
+                if old.get(node_id) != row:
+                    changed.add(node_id)
+        except ValueError as e:
+            raise SourceError('Unable to parse {}! {}'.format(self.name, str(e)))
+        except requests.exceptions.RequestException as e:
+            raise SourceError('Problems reading {}: {}'.format(self.name, type(e)))
+        finally:
+            response.close()
+
+        self.stats.count('bytes_downloaded', response.timing['wire_bytes'] or response.timing['bytes'])
+        self.stats.count('nodes_unchanged', unchanged)
+        self.skip_ratio = float(unchanged) / len(nodes) if nodes else 0.0
+
+        changed.update(node_id for node_id in old if node_id not in nodes)
+
+        self.nodes = nodes
+
+        # No problems? Everything fine? Update last modified timestamp!
+        self.client.remember(self.uri, response)
+
+        return changed
+
+
+class MeshviewerSource(Source):
+    """nodes.json of the meshviewer, with the nodes of all communities in
+    it, of which only those `site_filter` accepts are kept, e.g. the
+    fflib.sites.Sites of all communities served. It is decoded
+    while it is downloaded, one node at a time, so the download and parsing
+    are a single stage.
+
+    Every node and its nodeinfo are fingerprinted. A node with the
+    fingerprint of the last poll isn't even decoded and is UNCHANGED. If
+    only its nodeinfo has the old fingerprint, just the flags and
+    statistics are decoded and parsed. Pass `fingerprints=False` to parse
+    every node in full.
+    """
+
+    name = 'nodes.json'
+    fields = ('node_id', 'mac', 'hostname', 'lat', 'lon', 'hardware', 'contact', 'autoupdate', 'branch',
+              'firmware_base', 'firmware_release', 'online', 'gateway', 'clientcount', 'site')
+    # the only one knowing gateways and offline nodes
+    priority = 20
+
+    def __init__(self, uri, client, site_filter, freshness=300, fingerprints=True):
+        super(MeshviewerSource, self).__init__(uri, client, freshness)
+        self.site_filter = site_filter
+        self.fingerprints = fingerprints
+        # node_id -> (node, nodeinfo) fingerprints of the last poll, of the
+        # nodes kept and those ignored
+        self._fingerprints = {}
+        # node_ids of other communities or without a MAC
+        self._ignored = set()
+        # nodes taken and ignored in the last poll
+        self.ingest = {'ingested': 0, 'ignored': 0}
+        self.stats.gauge('ingest', lambda: self.ingest)
+        # index of the parse_status() columns in the tuples
+        self._status = dict((field, self.fields.index(field)) for field in ('online', 'gateway', 'clientcount'))
+
+    def entries(self, response):
+        mark = time.time()
+        parsed = 0
+        fingerprints = {}
+        ignored = set()
+
+        parser = nodesjson.NodesParser(self.client.iter_content(response, nodesjson.CHUNK_SIZE))
+
+        if self.fingerprints:
+            entries = parser.sections(self._fingerprints.get)
+        else:
+            entries = ((key, data, None) for key, data in parser)
+
+        try:
+            for key, data, fingerprint in entries:
+                parsed += 1
+                fingerprints[key] = fingerprint
+
+                if data is UNCHANGED or data.get('nodeinfo') is UNCHANGED:
+                    if key in self._ignored:
+                        ignored.add(key)
+                    elif data is UNCHANGED:
+                        yield key, UNCHANGED
+                    else:
+                        # only the flags, statistics or lastseen changed, often
+                        # not in any of the columns
+                        row = self.nodes[key]
+                        status = self.parse_status(data)
+
+                        if all(row[self._status[field]] == value for field, value in status.items()):
+                            yield key, UNCHANGED
+                        else:
+                            values = dict(zip(self.fields, row))
+                            values.update(status)
+                            yield key, values
+                    continue
+
+                # drop nodes of other communities before doing any work on them
+                if not self.site_filter(data):
+                    ignored.add(key)
+                    continue
+
+                data['node_id'] = key
+                values = self.parse(data)
+
+                if values.get('mac'):
+                    yield key, values
+                else:
+                    ignored.add(key)
+        finally:
+            self.stats.add('parse', time.time() - mark)
+            self.stats.count('nodes_parsed', parsed)
+
+        self._fingerprints = fingerprints if self.fingerprints else {}
+        self._ignored = ignored
+
+        self.ingest = {'ingested': parsed - len(ignored), 'ignored': len(ignored)}
+        self.stats.count('nodes_ingested', self.ingest['ingested'])
+        self.stats.count('nodes_ignored', self.ingest['ignored'])
+
+    @staticmethod
+    def parse(data):
+        """Turns a nodes.json entry into a dict of column values."""
+        values = MeshviewerSource.parse_status(data)
+
+        values['node_id'] = data['node_id']
+
+        if 'nodeinfo' in data:
+            if 'hardware' in data['nodeinfo']:
+                if 'model' in data['nodeinfo']['hardware']:
+                    values['hardware'] = ''.join(data['nodeinfo']['hardware']['model'])
+
+            if 'hostname' in data['nodeinfo']:
+                values['hostname'] = data['nodeinfo']['hostname']
+
+            if 'location' in data['nodeinfo'] and data['nodeinfo']['location']:
+                values['lat'] = data['nodeinfo']['location']['latitude']
+                values['lon'] = data['nodeinfo']['location']['longitude']
+
+            if 'system' in data['nodeinfo']:
+                values['site'] = data['nodeinfo']['system'].get('site_code')
+
+            if 'network' in data['nodeinfo']:
+                if 'mac' in data['nodeinfo']['network']:
+                    values['mac'] = data['nodeinfo']['network']['mac']
+
+            if 'owner' in data['nodeinfo']:
+                values['contact'] = data['nodeinfo']['owner']['contact']
+
+            if 'software' in data['nodeinfo']:
+                if 'autoupdater' in data['nodeinfo']['software']:
+                    if 'branch' in data['nodeinfo']['software']['autoupdater']:
+                        values['branch'] = data['nodeinfo']['software']['autoupdater']['branch']
+                    if 'enabled' in data['nodeinfo']['software']['autoupdater']:
+                        values['autoupdate'] = data['nodeinfo']['software']['autoupdater']['enabled']
+                if 'firmware' in data['nodeinfo']['software']:
+                    if 'base' in data['nodeinfo']['software']['firmware']:
+                        values['firmware_base'] = data['nodeinfo']['software']['firmware']['base']
+                    if 'release' in data['nodeinfo']['software']['firmware']:
+                        values['firmware_release'] = data['nodeinfo']['software']['firmware']['release']
+
+        return values
+
+    @staticmethod
+    def parse_status(data):
+        """Returns the column values of the flags and statistics of a
+        nodes.json entry."""
+        values = {'clientcount': 0}
+
+        if 'flags' in data:
+            if 'gateway' in data['flags']:
+                values['gateway'] = data['flags']['gateway']
+
+            if 'online' in data['flags']:
+                values['online'] = data['flags']['online']
+
+        if 'statistics' in data:
+            if values.get('online') and 'clients' in data['statistics']:
+                values['clientcount'] = data['statistics']['clients']
+
+        return values
+
+
+class AlfredSource(Source):
+    """alfred.json of the local alfred, keyed by MAC. It only has the nodes
+    online, a node missing from it is offline as far as it knows."""
+
+    name = 'alfred.json'
+    fields = ('node_id', 'mac', 'hostname', 'lat', 'lon', 'hardware', 'contact', 'autoupdate', 'branch',
+              'firmware_base', 'firmware_release', 'online', 'clientcount', 'site')
+    priority = 10
+
+    def entries(self, response):
+        with self.stats.time('download'):
+            body = self.client.read(response)
+
+        with self.stats.time('parse'):
+            mapdata = json.loads(body.decode('utf-8'))
+
+        self.stats.count('nodes_parsed', len(mapdata))
+
+        for key, data in mapdata.items():
+            data['mac'] = key
+            values = self.parse(data)
+            yield values['node_id'], values
+
+    @staticmethod
+    def parse(data):
+        """Turns an alfred.json entry into a dict of column values."""
+        values = {}
+
+        if 'node_id' in data:
+            values['node_id'] = data['node_id']
+        else:
+            values['node_id'] = data['mac'].replace(':', '')
+
+        values['mac'] = data['mac']
+        values['online'] = True
+
+        if 'hostname' in data:
+            values['hostname'] = data['hostname']
+
+        if 'location' in data:
+            values['lat'] = data['location']['latitude']
+            values['lon'] = data['location']['longitude']
+
+        if 'hardware' in data:
+            values['hardware'] = data['hardware']['model']
+
+        if 'owner' in data:
+            values['contact'] = data['owner']['contact']
+
+        if 'software' in data:
+            if 'autoupdater' in data['software']:
+                values['autoupdate'] = data['software']['autoupdater']['enabled']
+                values['branch'] = data['software']['autoupdater']['branch']
+
+            if 'firmware' in data['software']:
+                values['firmware_base'] = data['software']['firmware']['base']
+                values['firmware_release'] = data['software']['firmware']['release']
+
+        if 'system' in data:
+            values['site'] = data['system'].get('site_code')
+
+        if 'clients' in data:
+            values['clientcount'] = data['clients']['total']
+        else:
+            values['clientcount'] = 0
+
+        return values
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Nearby nodes for .near and the new node announcements.
+
+GridIndex puts every node with a position into a cell of a fixed grid of
+CELL degrees. A query only looks at the cells its radius overlaps, and the
+distances of the nodes in them are computed at once by geo.distances(), so
+it takes about as long as there are nodes around, not in the whole mesh:
+
+    index = spatial.GridIndex(nodes_table.fields)
+    index.load(nodes_table)
+    count, nearest = index.near(49.0, 8.4, 1000, only=nodes_table.online)
+
+Like search.NodeIndex it is fed from the changesets, a poll only touches the
+nodes that appeared, moved or lost their position.
+"""
+
+import heapq
+import math
+import threading
+from collections import defaultdict
+
+from .geo import distances
+
+# about 1.1 km north to south, 0.7 km east to west in Germany
+CELL = 0.01
+
+# meters per degree of latitude
+DEGREE = 111320.0
+
+
+class GridIndex(object):
+    """Positions of all nodes that have one, except gateways, fed from the
+    same changesets as the fflib.diff.NodeTable `fields` come from."""
+
+    def __init__(self, fields, cell=CELL):
+        self.cell = cell
+        # (row, column) -> node_id -> (lat, lon)
+        self.cells = defaultdict(dict)
+        # node_id -> (lat, lon)
+        self.positions = {}
+
+        self._lat = fields.index('lat')
+        self._lon = fields.index('lon')
+        self._gateway = fields.index('gateway')
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def load(self, table):
+        """Indexes every node of `table` (a fflib.diff.NodeTable)."""
+        with self._lock:
+            for node_id, row in table.rows.items():
+                self._update(node_id, row)
+
+    def apply(self, changeset):
+        """Moves the nodes of a fflib.diff.Changeset whose position or
+        gateway flag changed."""
+        with self._lock:
+            for node_id, (old, new) in changeset.changed.items():
+                if old is None or old[self._lat] != new[self._lat] or old[self._lon] != new[self._lon] or \
+                        old[self._gateway] != new[self._gateway]:
+                    self._update(node_id, new)
+
+    def position(self, node_id):
+        """Returns (lat, lon) of `node_id`, None if it has no position."""
+        return self.positions.get(node_id)
+
+    def near(self, lat, lon, radius, limit=5, only=None, exclude=()):
+        """Returns the number of nodes within `radius` meters of `lat`, `lon`
+        and the nearest `limit` of them as (meters, node_id), nearest first.
+        With `only` just the node_ids in it count, e.g. those online, the
+        node_ids in `exclude` never do."""
+        node_ids = []
+        lats = []
+        lons = []
+
+        with self._lock:
+            for cell in self._cells(lat, lon, radius):
+                for node_id, (node_lat, node_lon) in cell.items():
+                    if only is not None and node_id not in only or node_id in exclude:
+                        continue
+
+                    node_ids.append(node_id)
+                    lats.append(node_lat)
+                    lons.append(node_lon)
+
+        found = [(distance, node_id) for distance, node_id in zip(distances(lat, lon, lats, lons), node_ids)
+                 if distance <= radius]
+
+        return len(found), heapq.nsmallest(limit, found)
+
+    def _cells(self, lat, lon, radius):
+        """Returns the cells a circle of `radius` meters around `lat`, `lon`
+        overlaps."""
+        lat_span = radius / DEGREE
+        lon_span = radius / (DEGREE * max(math.cos(math.radians(lat)), 0.01))
+
+        rows = range(self._index(lat - lat_span), self._index(lat + lat_span) + 1)
+        columns = range(self._index(lon - lon_span), self._index(lon + lon_span) + 1)
+
+        if len(rows) * len(columns) > len(self.cells):
+            # a radius larger than the mesh, cheaper to go through what's there
+            return [cell for key, cell in self.cells.items() if key[0] in rows and key[1] in columns]
+
+        return [self.cells[key] for key in ((row, column) for row in rows for column in columns)
+                if key in self.cells]
+
+    def _index(self, degrees):
+        return int(math.floor(degrees / self.cell))
+
+    def _update(self, node_id, row):
+        old = self.positions.pop(node_id, None)
+        if old is not None:
+            key = self._key(*old)
+            cell = self.cells[key]
+            del cell[node_id]
+            if not cell:
+                del self.cells[key]
+
+        lat, lon = row[self._lat], row[self._lon]
+
+        # like geo.calc_distance, 0 is no position, and like search.NodeIndex
+        # gateways are left out
+        if lat and lon and not row[self._gateway]:
+            self.positions[node_id] = (lat, lon)
+            self.cells[self._key(lat, lon)][node_id] = (lat, lon)
+
+    def _key(self, lat, lon):
+        return self._index(lat), self._index(lon)
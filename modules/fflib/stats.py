@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Timings and counters of the polls, for .ffstats.
+
+Every source (nodes.json, alfred.json) gets a Stats object from get(). fetch()
+times its stages with it and counts what went through:
+
+    fetch_stats = stats.get('nodes.json')
+
+    with fetch_stats.time('commit'):
+        session.commit()
+    fetch_stats.count('rows_written', len(rows))
+
+A timing keeps its last `window` samples, so its percentiles describe the
+last few hours of polls instead of everything since the start. Recording a
+sample is a deque append, cheap enough to stay on all the time; sorting
+only happens when somebody asks for the percentiles.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# samples kept per timing, 960 polls are eight hours at one poll every 30 s
+WINDOW = 960
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentiles(samples, points=PERCENTILES):
+    """Returns the nearest-rank percentiles of `samples`, None for none."""
+    samples = sorted(samples)
+
+    if not samples:
+        return [None] * len(points)
+
+    return [samples[min(len(samples) - 1, len(samples) * p // 100)] for p in points]
+
+
+class Histogram(object):
+    """The last `window` samples of one timing, in seconds."""
+
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+        # since the start, not only within the window
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+
+class Stats(object):
+    """Timings, counters and gauges of one source."""
+
+    def __init__(self, name, window=WINDOW):
+        self.name = name
+        self.window = window
+        self.timings = {}
+        self.counters = {}
+        # name -> function returning a dict of current values
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        """Times the code in the with block as `stage`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            histogram = self.timings.get(stage)
+            if histogram is None:
+                histogram = self.timings[stage] = Histogram(self.window)
+            histogram.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, function):
+        """Adds the values `function()` returns to every snapshot."""
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """Returns everything as plain dicts, times in milliseconds."""
+        with self._lock:
+            timings = [(stage, list(histogram.samples), histogram.count, histogram.total)
+                       for stage, histogram in self.timings.items()]
+            counters = dict(self.counters)
+
+        result = {'timings': {}, 'counters': counters, 'gauges': {}}
+
+        for stage, samples, count, total in timings:
+            values = percentiles(samples)
+
+            timing = {'count': count, 'avg': total / count * 1000 if count else None}
+            for p, value in zip(PERCENTILES, values):
+                timing['p{:d}'.format(p)] = value * 1000 if value is not None else None
+            result['timings'][stage] = timing
+
+        for name, function in list(self.gauges.items()):
+            try:
+                result['gauges'][name] = function()
+            except Exception as e:
+                result['gauges'][name] = {'error': str(e)}
+
+        return result
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get(name):
+    """Returns the Stats of source `name`, kept across module reloads."""
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = Stats(name)
+
+        return _stats[name]
+
+
+def snapshot():
+    """Returns the snapshots of all sources by name."""
+    with _stats_lock:
+        sources = list(_stats.values())
+
+    return dict((stats.name, stats.snapshot()) for stats in sources)
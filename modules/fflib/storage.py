@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""The SQLite database all ff-* modules share: one engine per file, with
+WAL and a busy timeout, and the nodes and highscores tables.
+
+    store = storage.get(bot.config.freifunk.db_path)
+    store.create_tables(Base.metadata)
+    session = store.sessionmaker()
+"""
+
+import datetime
+import os
+import threading
+import time
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, Integer, String, create_engine, event, \
+    inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+PRAGMAS = (
+    # readers don't block the writer and the other way round
+    'PRAGMA journal_mode=WAL',
+    # with WAL this only risks the last commits on power loss, not corruption
+    'PRAGMA synchronous=NORMAL',
+    # in KiB
+    'PRAGMA cache_size=-16384',
+    'PRAGMA temp_store=MEMORY',
+    # in ms, wait for the writer instead of raising "database is locked"
+    'PRAGMA busy_timeout=5000',
+)
+
+# queries taking longer than this many seconds are printed
+SLOW_QUERY = 0.5
+
+Base = declarative_base()
+
+
+class Node(Base):
+    """A node as fflib.ingest merged it from all sources."""
+
+    __tablename__ = 'nodes'
+    # covers the status and highscore queries, e.g. of monitoring reading the database
+    __table_args__ = (Index('ix_nodes_online_gateway_clientcount', 'online', 'gateway', 'clientcount'),)
+
+    node_id = Column(String, primary_key=True)
+    mac = Column(String)
+    hostname = Column(String)
+    lat = Column(Float)
+    lon = Column(Float)
+    hardware = Column(String)
+    contact = Column(String)
+    autoupdate = Column(Boolean)
+    branch = Column(String)
+    firmware_base = Column(String)
+    firmware_release = Column(String)
+    firstseen = Column(DateTime)
+    lastseen = Column(DateTime)
+    online = Column(Boolean)
+    gateway = Column(Boolean)
+    clientcount = Column(Integer)
+    # the source the node's values mostly came from
+    source = Column(String)
+    # nodeinfo.system.site_code, fflib.sites tells the site it belongs to
+    site = Column(String)
+
+    @property
+    def name(self):
+        return self.hostname if self.hostname is not None else self.node_id
+
+
+class Highscore(Base):
+    __tablename__ = 'highscores'
+
+    name = Column(String, primary_key=True)
+    date = Column(DateTime)
+    count = Column(Integer)
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+
+    def update(self, count):
+        if self.count < count:
+            self.count = count
+            self.date = datetime.datetime.now()
+            return True
+        return False
+
+
+class QueryTimer(object):
+    """Sums up how long the statements sent through an engine take.
+
+    `stats` maps every statement to [count, total seconds, max seconds].
+    """
+
+    def __init__(self, engine):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.time() - conn.info['query_start'].pop()
+
+        with self._lock:
+            stats = self.stats.setdefault(statement, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+
+        if duration > SLOW_QUERY:
+            print('{}: slow query ({:.2f} s): {}'.format(
+                str(datetime.datetime.now()), duration, ' '.join(statement.split())))
+
+    def report(self, limit=10):
+        """Returns the `limit` statements that took the most time in total,
+        as (statement, count, total seconds, max seconds) tuples."""
+        with self._lock:
+            stats = [(statement,) + tuple(values) for statement, values in self.stats.items()]
+
+        return sorted(stats, key=lambda stats: stats[2], reverse=True)[:limit]
+
+
+class Storage(object):
+    """Engine, sessionmaker and query timings of one database file."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.engine = create_engine('sqlite:///{0}'.format(db_path))
+        event.listen(self.engine, 'connect', _configure_connection)
+
+        self.sessionmaker = sessionmaker(self.engine)
+        self.timer = QueryTimer(self.engine)
+
+        self.create_tables(Base.metadata)
+        self._index_node_id()
+
+    def create_tables(self, metadata):
+        """Creates the missing tables of `metadata`, their columns and indexes.
+
+        create_all() only creates the columns and indexes of tables it
+        creates, so both are checked one by one to add new ones to old
+        databases. New columns are NULL in the rows already there.
+        """
+        metadata.create_all(self.engine)
+
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+
+            for table in metadata.sorted_tables:
+                existing = set(column['name'] for column in inspector.get_columns(table.name))
+
+                for column in table.columns:
+                    if column.name not in existing:
+                        connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                            table.name, column.name, column.type.compile(self.engine.dialect))))
+
+                # Index.create() has no checkfirst before SQLAlchemy 1.4
+                existing = set(index['name'] for index in inspector.get_indexes(table.name))
+
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(connection)
+
+
+    def _index_node_id(self):
+        # databases of the old meshviewer module keep mac as the primary key,
+        # but the nodes are written by node_id
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+
+            if inspector.get_pk_constraint('nodes')['constrained_columns'] == ['node_id']:
+                return
+            if any(index['column_names'] == ['node_id'] for index in inspector.get_indexes('nodes')):
+                return
+
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text('CREATE UNIQUE INDEX ix_nodes_node_id ON nodes (node_id)'))
+        except IntegrityError:
+            print('{}: {}: nodes share a node_id, see DB_UPDATE.sql'.format(
+                str(datetime.datetime.now()), self.db_path))
+            with self.engine.begin() as connection:
+                connection.execute(text('CREATE INDEX ix_nodes_node_id ON nodes (node_id)'))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get(db_path):
+    """Returns the Storage of the database at `db_path`, creating it first if
+    no module asked for it yet."""
+    path = os.path.abspath(db_path)
+
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = Storage(path)
+
+        return _stores[path]
+
+
+def _configure_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+
+    for pragma in PRAGMAS:
+        cursor.execute(pragma)
+
+    cursor.close()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""The links between the nodes and the clouds they form.
+
+A node going offline on its own and a whole cloud losing its way to the
+gateways look the same in nodes.json. GraphSource polls the links of the
+meshviewer (graph.json, or the links of meshviewer.json) and Topology keeps
+them as an adjacency list with the connected components on top:
+
+    graph = topology.GraphSource(uri, httpclient.HttpClient())
+    mesh = topology.Topology(nodes_table.fields)
+    mesh.load(nodes_table)
+    events = mesh.update(graph.poll() or (), graph.nodes, time.time())
+
+Components are kept like a union-find whose sets are merged by size: a new
+link relabels the nodes of the smaller component. Union-find can't split,
+so a link that is gone is searched around from both of its ends at once
+until the searches meet, or one of them runs out and is the smaller half
+of a split. Either way a poll costs about as much as the links it changed,
+not the size of the mesh.
+
+A component of at least `minimum` nodes without a gateway is a Cloud that
+was cut off:
+
+    CloudCutOff       a component lost its last gateway, or formed without one
+    CloudReconnected  a gateway is back in it
+"""
+
+import json
+from collections import Counter, defaultdict, deque, namedtuple
+
+from .sources import Source
+
+CloudCutOff = namedtuple('CloudCutOff', ['cloud'])
+CloudReconnected = namedtuple('CloudReconnected', ['cloud'])
+
+
+class GraphSource(Source):
+    """graph.json (version 1) or meshviewer.json of the meshviewer. Its
+    entries are links, not nodes: `nodes` maps (node_id, node_id), the
+    smaller one first, to (vpn,), and poll() returns the links that came,
+    went or changed. The link quality is left out, it changes all the time
+    and doesn't tell whether nodes are connected."""
+
+    name = 'graph.json'
+    fields = ('vpn',)
+
+    def entries(self, response):
+        with self.stats.time('download'):
+            body = self.client.read(response)
+
+        with self.stats.time('parse'):
+            data = json.loads(body.decode('utf-8'))
+
+        if 'batadv' in data:
+            # graph.json, the links refer to the nodes by index
+            nodes = data['batadv']['nodes']
+            ids = [node.get('node_id') or node['id'].replace(':', '') for node in nodes]
+            links = ((ids[link['source']], ids[link['target']], link.get('vpn', False))
+                     for link in data['batadv']['links'])
+        else:
+            links = ((link['source'], link['target'], link.get('type') == 'vpn') for link in data['links'])
+
+        count = 0
+
+        for source, target, vpn in links:
+            count += 1
+
+            if source == target:
+                continue
+
+            yield (source, target) if source < target else (target, source), {'vpn': vpn}
+
+        self.stats.count('links_parsed', count)
+
+
+class Cloud(object):
+    """Nodes cut off from every gateway."""
+
+    def __init__(self, started, nodes, quiet=False):
+        # unix time
+        self.started = started
+        # node_ids of the nodes in it when it was cut off
+        self.nodes = frozenset(nodes)
+        self.total = len(self.nodes)
+        # it was already cut off when the bot started, so it isn't announced
+        self.quiet = quiet
+        self.reconnected = False
+
+
+class Topology(object):
+    """Links and connected components, with the gateways taken from the
+    same changesets as the fflib.diff.NodeTable `fields` come from."""
+
+    def __init__(self, fields, minimum=5):
+        self.minimum = minimum
+        # node_id -> node_ids it has a link to
+        self.adjacency = defaultdict(set)
+        self.links = 0
+        # node_id -> label of its component, for nodes with links
+        self.component = {}
+        # label -> node_ids
+        self.members = {}
+        self.gateways = set()
+        # label -> number of gateways in it
+        self._gateways_in = Counter()
+        # label -> the Cloud it is, while it has no gateway
+        self._clouds = {}
+        # labels whose nodes or gateways changed since the last update()
+        self._dirty = set()
+        self._next = 0
+        self._started = False
+
+        self._gateway = fields.index('gateway')
+
+    def load(self, table):
+        """Takes the gateways of `table` (a fflib.diff.NodeTable)."""
+        for node_id, row in table.rows.items():
+            self._set_gateway(node_id, row[self._gateway])
+
+    def apply(self, changeset):
+        """Takes the gateway flags of a fflib.diff.Changeset into account."""
+        for node_id, (old, new) in changeset.changed.items():
+            if old is None or bool(old[self._gateway]) != bool(new[self._gateway]):
+                self._set_gateway(node_id, new[self._gateway])
+
+    def update(self, changed, links, now):
+        """Adds and removes the `changed` links, those in `links` are there
+        now and the others are gone, e.g. what GraphSource.poll() returned
+        and its `nodes`. Returns the cloud events, none for the first call:
+        what is cut off when the bot starts is taken as it is."""
+        for a, b in changed:
+            if (a, b) in links:
+                self._link(a, b)
+            else:
+                self._unlink(a, b)
+
+        events = []
+
+        # the components that changed are decided anew: the clouds they were
+        # go to the components cut off their nodes are in now
+        previous = set()
+        for label in self._dirty:
+            cloud = self._clouds.pop(label, None)
+            if cloud is not None:
+                previous.add(cloud)
+
+        cut_off = set(label for label in self._dirty if self._cut_off(label))
+
+        for cloud in previous:
+            for label in set(self.component.get(node_id) for node_id in cloud.nodes) & cut_off:
+                self._clouds.setdefault(label, cloud)
+
+        # a cloud left without a component is reconnected if its nodes are
+        # with a gateway, not if they joined another cloud, left the mesh or
+        # fell apart into pieces too small to count
+        for cloud in previous - set(self._clouds.values()):
+            if any(self._gateways_in[self.component[node_id]] for node_id in cloud.nodes
+                   if node_id in self.component):
+                cloud.reconnected = True
+                if not cloud.quiet:
+                    events.append(CloudReconnected(cloud))
+
+        for label in cut_off:
+            if label not in self._clouds:
+                cloud = Cloud(now, self.members[label], quiet=not self._started)
+                self._clouds[label] = cloud
+                if not cloud.quiet:
+                    events.append(CloudCutOff(cloud))
+
+        self._dirty.clear()
+        self._started = True
+
+        return events
+
+    def clouds(self):
+        """Returns the Clouds currently cut off."""
+        return list(set(self._clouds.values()))
+
+    def _cut_off(self, label):
+        return label in self.members and not self._gateways_in[label] and bool(self.gateways) and \
+            len(self.members[label]) >= self.minimum
+
+    def _label(self, node_id):
+        label = self.component.get(node_id)
+
+        if label is None:
+            label = self._next
+            self._next += 1
+            self.component[node_id] = label
+            self.members[label] = {node_id}
+            if node_id in self.gateways:
+                self._gateways_in[label] += 1
+
+        return label
+
+    def _link(self, a, b):
+        if b in self.adjacency[a]:
+            return
+
+        self.adjacency[a].add(b)
+        self.adjacency[b].add(a)
+        self.links += 1
+
+        large, small = self._label(a), self._label(b)
+        if large == small:
+            return
+
+        if len(self.members[large]) < len(self.members[small]):
+            large, small = small, large
+
+        for node_id in self.members[small]:
+            self.component[node_id] = large
+        self.members[large] |= self.members.pop(small)
+        self._gateways_in[large] += self._gateways_in.pop(small, 0)
+
+        self._dirty.add(large)
+        self._dirty.add(small)
+
+    def _unlink(self, a, b):
+        if b not in self.adjacency.get(a, ()):
+            return
+
+        self.adjacency[a].discard(b)
+        self.adjacency[b].discard(a)
+        self.links -= 1
+
+        label = self.component[a]
+        side = self._separate(a, b)
+
+        if side is not None:
+            new = self._next
+            self._next += 1
+
+            for node_id in side:
+                self.component[node_id] = new
+            self.members[label] -= side
+            self.members[new] = side
+
+            gateways = len(side & self.gateways)
+            self._gateways_in[label] -= gateways
+            if gateways:
+                self._gateways_in[new] = gateways
+
+            self._dirty.add(new)
+
+        self._dirty.add(label)
+
+        for node_id in (a, b):
+            if not self.adjacency[node_id]:
+                self._forget(node_id)
+
+    def _separate(self, a, b):
+        """Searches from `a` and `b` in turns. Returns None if they are
+        still connected, else the nodes of the side that ran out first."""
+        seen = ({a}, {b})
+        queues = (deque([a]), deque([b]))
+
+        while True:
+            for side in (0, 1):
+                if not queues[side]:
+                    return seen[side]
+
+                for other in self.adjacency[queues[side].popleft()]:
+                    if other in seen[1 - side]:
+                        return None
+                    if other not in seen[side]:
+                        seen[side].add(other)
+                        queues[side].append(other)
+
+    def _forget(self, node_id):
+        """Drops a node without links, it is a component of its own by now."""
+        del self.adjacency[node_id]
+        label = self.component.pop(node_id)
+        del self.members[label]
+        self._gateways_in.pop(label, None)
+        self._dirty.add(label)
+
+    def _set_gateway(self, node_id, gateway):
+        if bool(gateway) == (node_id in self.gateways):
+            return
+
+        if gateway:
+            self.gateways.add(node_id)
+        else:
+            self.gateways.discard(node_id)
+
+        label = self.component.get(node_id)
+        if label is not None:
+            self._gateways_in[label] += 1 if gateway else -1
+            self._dirty.add(label)
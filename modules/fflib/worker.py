@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Background worker running at most one upstream poll at a time, a poll
+asked for while one is still running is counted as skipped."""
+
+import threading
+import time
+import traceback
+
+
+class PollWorker(object):
+    """Runs `poll(bot)` on its own thread whenever trigger() is called."""
+
+    def __init__(self, name, bot, poll):
+        self.name = name
+        self.poll = poll
+
+        # counters, for the stats
+        self.runs = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_duration = None
+
+        self._bot = bot
+        self._busy = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def trigger(self):
+        """Starts a poll. Returns False, and counts it as skipped, if the
+        previous poll hasn't finished yet."""
+        with self._lock:
+            if self._busy:
+                self.skipped += 1
+                return False
+
+            self._busy = True
+
+        self._wakeup.set()
+        return True
+
+    def stop(self, timeout=None):
+        """Stops the thread, waiting up to `timeout` seconds for a running poll."""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+            if self._stopped:
+                return
+
+            start = time.time()
+            try:
+                self.poll(self._bot)
+            except Exception:
+                self.failed += 1
+                traceback.print_exc()
+            finally:
+                self.runs += 1
+                self.last_duration = time.time() - start
+
+                with self._lock:
+                    self._busy = False